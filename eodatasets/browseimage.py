@@ -3,14 +3,13 @@ from __future__ import absolute_import
 
 import logging
 import math
-import os
-import shutil
-import tempfile
-from subprocess import check_call
+import warnings
 
 import numpy
 import pathlib
-from osgeo import gdal, gdalconst
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
 
 import eodatasets.type as ptype
 from eodatasets import serialise, drivers
@@ -20,51 +19,39 @@ GDAL_CACHE_MAX_MB = 512
 _LOG = logging.getLogger(__name__)
 
 
-def run_command(command, work_dir):
-    _LOG.debug('Running %r', command)
-    check_call(command, cwd=work_dir)
-    _LOG.debug('Finished %s', command[0])
+def _calculate_scale_offset(nodata, array):
+    """
+    Calculate a linear stretch of the 1st-99th percentile of valid values to the 0-255 byte range.
 
+    (This reproduces the histogram clip from the old ULA codebase, vectorised with numpy.)
 
-# This method comes from the old ULA codebase and should be cleaned up eventually.
-# pylint: disable=too-many-locals,invalid-name
-def _calculate_scale_offset(nodata, band):
+    :param nodata: Values less than or equal to this are ignored. (byte data also ignores zeros)
+    :type array: numpy.ndarray
+    :return: scale, offset
+    :rtype: (float, float)
 
+    >>> _calculate_scale_offset(-999, numpy.arange(-999, 1001, dtype='int16'))
+    (0.13010204081632654, 127.5)
+    >>> _calculate_scale_offset(-999, numpy.arange(256, dtype='uint8'))
+    (1.02, -2.04)
     """
-    This method comes from the old ULA codebase.
-    """
-    nbits = gdal.GetDataTypeSize(band.DataType)
     df_scale_dst_min, df_scale_dst_max = 0.0, 255.0
-    if nbits == 16:
-        count = 32767 + nodata
-        histogram = band.GetHistogram(-32767, 32767, 65536)
-    else:
-        count = 0
-        histogram = band.GetHistogram()
-    df_scale_src_min = count
-    total = 0
-    cliplower = int(0.01 * (sum(histogram) - histogram[count]))
-    clipupper = int(0.99 * (sum(histogram) - histogram[count]))
-    while total < cliplower and count < len(histogram) - 1:
-        count += 1
-        total += int(histogram[count])
-        df_scale_src_min = count
-    if nbits == 16:
-        count = 32767 + nodata
+
+    # The old ULA histograms started at the first bin above the nodata value (zero for bytes).
+    stats_floor = max(nodata, 0) if array.dtype.itemsize == 1 else nodata
+    valid = array[array > stats_floor]
+
+    if valid.size == 0:
+        df_scale_src_min = df_scale_src_max = 0
     else:
-        count = 0
-    total = 0
-    df_scale_src_max = count
-    while total < clipupper and count < len(histogram) - 1:
-        count += 1
-        total += int(histogram[count])
-        df_scale_src_max = count
-    if nbits == 16:
-        df_scale_src_min -= 32768
-        df_scale_src_max -= 32768
+        values, counts = _histogram(valid)
+        cumulative_counts = counts.cumsum()
+        total = int(cumulative_counts[-1])
+        df_scale_src_min = values[numpy.searchsorted(cumulative_counts, int(0.01 * total))]
+        df_scale_src_max = values[numpy.searchsorted(cumulative_counts, int(0.99 * total))]
 
     # Determine gain and offset
-    diff_ = df_scale_src_max - df_scale_src_min
+    diff_ = float(df_scale_src_max) - float(df_scale_src_min)
 
     # From the old Jobmanager codebase: avoid divide by zero caused by some stats.
     if diff_ == 0:
@@ -72,147 +59,161 @@ def _calculate_scale_offset(nodata, band):
         diff_ = 1
 
     df_scale = (df_scale_dst_max - df_scale_dst_min) / diff_
-    df_offset = -1 * df_scale_src_min * df_scale + df_scale_dst_min
+    df_offset = -1 * float(df_scale_src_min) * df_scale + df_scale_dst_min
 
     return df_scale, df_offset
 
 
-# This method comes from the old ULA codebase and should be cleaned up eventually.
-# pylint: disable=too-many-locals
-def _create_thumbnail(red_file, green_file, blue_file, output_path,
-                      x_constraint=None, nodata=-999, work_dir=None, overwrite=True):
+def _histogram(values):
     """
-    Create JPEG thumbnail image using individual R, G, B images.
+    Get the sorted distinct values of an array, and the count of each.
 
-    This method comes from the old ULA codebase.
+    :type values: numpy.ndarray
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    # Small integer types can be counted directly (much faster than a sort).
+    if numpy.issubdtype(values.dtype, numpy.integer) and values.dtype.itemsize <= 2:
+        minimum = int(values.min())
+        counts = numpy.bincount(values.astype(numpy.int32) - minimum)
+        return numpy.arange(minimum, minimum + len(counts)), counts
 
-    :param red_file: red band data file
-    :param green_file: green band data file
-    :param blue_file: blue band data file
-    :param output_path: thumbnail file to write to.
-    :param x_constraint: thumbnail width (if not full resolution)
-    :param nodata: null/fill data value
-    :param work_dir: temp/work directory to use.
-    :param overwrite: overwrite existing thumbnail?
+    return numpy.unique(values, return_counts=True)
 
-    Thumbnail height is adjusted automatically to match the aspect ratio
-    of the input images.
 
+def _stretch_to_bytes(array, nodata):
     """
-    nodata = int(nodata)
+    Stretch an array to the byte range for display. Nodata becomes zero.
 
-    # GDAL calls need absolute paths.
-    thumbnail_path = pathlib.Path(output_path).absolute()
+    :type array: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    scale, offset = _calculate_scale_offset(nodata, array)
+    _LOG.debug('Scale %r, offset %r', scale, offset)
 
-    if thumbnail_path.exists() and not overwrite:
-        _LOG.warning('File already exists. Skipping creation of %s', thumbnail_path)
-        return None, None, None
+    stretched = numpy.rint(array * scale + offset)
+    stretched[array <= nodata] = 0
+    return numpy.clip(stretched, 0, 255).astype('uint8')
 
-    # thumbnail_image = os.path.abspath(thumbnail_image)
 
-    out_directory = str(thumbnail_path.parent)
-    work_dir = os.path.abspath(work_dir) if work_dir else tempfile.mkdtemp(prefix='.thumb-tmp', dir=out_directory)
-    try:
-        # working files
-        file_to = os.path.join(work_dir, 'rgb.vrt')
-        warp_to_file = os.path.join(work_dir, 'rgb-warped.vrt')
-        outtif = os.path.join(work_dir, 'thumbnail.tif')
+# Output format of browse images, by file suffix.
+_BROWSE_DRIVERS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.webp': 'WEBP',
+    '.tif': 'COG',
+}
 
-        # Build the RGB Virtual Raster at full resolution
-        run_command(
-            [
-                "gdalbuildvrt",
-                "-overwrite", "-separate",
-                file_to,
-                str(red_file), str(green_file), str(blue_file)
-            ],
-            work_dir
-        )
-        assert os.path.exists(file_to), "VRT must exist"
-
-        # Determine the pixel scaling to get the correct width thumbnail
-        vrt = gdal.Open(file_to)
-        intransform = vrt.GetGeoTransform()
-        inpixelx = intransform[1]
-        # inpixely = intransform[5]
-        inrows = vrt.RasterYSize
-        incols = vrt.RasterXSize
-
-        # If a specific resolution is asked for.
-        if x_constraint:
-            outresx = inpixelx * incols / x_constraint
-            _LOG.info('Input pixel res %r, output pixel res %r', inpixelx, outresx)
-
-            outrows = int(math.ceil((float(inrows) / float(incols)) * x_constraint))
-
-            run_command([
-                "gdalwarp",
-                "--config", "GDAL_CACHEMAX", str(GDAL_CACHE_MAX_MB),
-                "-of", "VRT",
-                "-tr", str(outresx), str(outresx),
-                "-r", "near",
-                "-overwrite", file_to,
-                warp_to_file
-            ], work_dir)
-        else:
-            # Otherwise use a full resolution browse image.
-            outrows = inrows
-            x_constraint = incols
-            warp_to_file = file_to
-            outresx = inpixelx
-
-        _LOG.debug('Current GDAL cache max %rMB. Setting to %rMB', gdal.GetCacheMax() / 1024 / 1024, GDAL_CACHE_MAX_MB)
-        gdal.SetCacheMax(GDAL_CACHE_MAX_MB * 1024 * 1024)
-
-        # Open VRT file to array
-        vrt = gdal.Open(warp_to_file)
-        driver = gdal.GetDriverByName("GTiff")
-        outdataset = driver.Create(outtif, x_constraint, outrows, 3, gdalconst.GDT_Byte)
-
-        # Loop through bands and apply Scale and Offset
-        for band_number in (1, 2, 3):
-            band = vrt.GetRasterBand(band_number)
-
-            scale, offset = _calculate_scale_offset(nodata, band)
-
-            # Apply gain and offset
-            outdataset.GetRasterBand(band_number).WriteArray(
-                (numpy.ma.masked_less_equal(band.ReadAsArray(), nodata) * scale) + offset
-            )
-            _LOG.debug('Scale %r, offset %r', scale, offset)
 
-        # Must close datasets to flush to disk.
-        # noinspection PyUnusedLocal
-        outdataset = None
-        # noinspection PyUnusedLocal
-        vrt = None
+def _write_image(output_path, rgb):
+    """
+    Encode an rgb byte array in memory, and write it to the given path.
 
-        # GDAL Create doesn't support JPEG so we need to make a copy of the GeoTIFF
-        run_command(
-            [
-                "gdal_translate",
-                "--config", "GDAL_CACHEMAX", str(GDAL_CACHE_MAX_MB),
-                "-of", "JPEG",
-                outtif,
-                str(thumbnail_path)
-            ],
-            work_dir)
-
-        _LOG.debug('Cleaning work files')
-    finally:
-        # Clean up work files
-        if os.path.exists(work_dir):
-            shutil.rmtree(work_dir)
-
-    # Newer versions of GDAL create aux files due to the histogram. Clean them up.
-    for f in (red_file, blue_file, green_file):
-        f = pathlib.Path(f)
-        aux_file = f.with_name(f.name + '.aux.xml')
-        if aux_file.exists():
-            _LOG.info('Cleaning aux: %s', aux_file)
-            os.remove(str(aux_file.absolute()))
-
-    return x_constraint, outrows, outresx
+    The image format is chosen by the file suffix (see _BROWSE_DRIVERS)
+
+    :type output_path: pathlib.Path
+    :type rgb: numpy.ndarray
+    """
+    driver = _BROWSE_DRIVERS.get(output_path.suffix.lower())
+    if not driver:
+        raise ValueError('Unsupported browse image type %r (expected one of %r)' % (
+            output_path.name, sorted(_BROWSE_DRIVERS.keys())
+        ))
+
+    count, rows, cols = rgb.shape
+    # Browse images are plain pictures: we don't georeference them.
+    with warnings.catch_warnings(), rasterio.MemoryFile() as memory_file:
+        warnings.simplefilter('ignore', NotGeoreferencedWarning)
+        with memory_file.open(driver=driver, width=cols, height=rows, count=count, dtype='uint8') as output:
+            output.write(rgb)
+        output_path.write_bytes(memory_file.read())
+
+
+def _resize_nearest(array, rows, cols):
+    """
+    Nearest-neighbour resize of the last two dimensions of an array.
+
+    (pixel centres are sampled in the same way as GDAL's nearest resampling)
+
+    >>> _resize_nearest(numpy.arange(16).reshape(4, 4), 2, 2)
+    array([[ 5,  7],
+           [13, 15]])
+    """
+    in_rows, in_cols = array.shape[-2:]
+    if (in_rows, in_cols) == (rows, cols):
+        return array
+
+    row_indices = ((numpy.arange(rows) + 0.5) * in_rows / rows).astype(int)
+    col_indices = ((numpy.arange(cols) + 0.5) * in_cols / cols).astype(int)
+    return array[..., row_indices[:, None], col_indices]
+
+
+def _create_thumbnails(red_file, green_file, blue_file, outputs, nodata=-999, overwrite=True):
+    """
+    Create thumbnail images of multiple sizes using individual R, G, B images.
+
+    Each band is read once (at the largest requested size, using overviews if available)
+    and stretched once. Every output is then sampled from that single stretched image,
+    and encoded in memory. No intermediate files are written, and the input images are
+    not modified.
+
+    :param red_file: red band data file
+    :param green_file: green band data file
+    :param blue_file: blue band data file
+    :param outputs: A list of (output path, width). A width of None is a full resolution image.
+    :type outputs: list[(pathlib.Path, int)]
+    :param nodata: null/fill data value
+    :param overwrite: overwrite existing thumbnails?
+    :return: The (cols, rows, pixel res) of each output, in order. (None if skipped)
+    :rtype: list[(int, int, float)]
+
+    Thumbnail height is adjusted automatically to match the aspect ratio
+    of the input images.
+    """
+    nodata = int(nodata)
+
+    outputs = [(pathlib.Path(path).absolute(), x_constraint) for path, x_constraint in outputs]
+
+    with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MAX_MB):
+        with rasterio.open(str(red_file)) as red:
+            inpixelx = red.transform.a
+            inrows, incols = red.height, red.width
+
+        shapes = []
+        for thumbnail_path, x_constraint in outputs:
+            if thumbnail_path.exists() and not overwrite:
+                _LOG.warning('File already exists. Skipping creation of %s', thumbnail_path)
+                shapes.append(None)
+            # If a specific resolution is asked for.
+            elif x_constraint:
+                outresx = inpixelx * incols / x_constraint
+                _LOG.info('Input pixel res %r, output pixel res %r', inpixelx, outresx)
+                outrows = int(math.ceil((float(inrows) / float(incols)) * x_constraint))
+                shapes.append((x_constraint, outrows, outresx))
+            else:
+                # Otherwise use a full resolution browse image.
+                shapes.append((incols, inrows, inpixelx))
+
+        if not any(shapes):
+            return shapes
+
+        # Read at the largest size needed. (Any larger outputs are upsampled from full resolution.)
+        read_cols, read_rows, _ = max((shape for shape in shapes if shape), key=lambda shape: shape[0])
+        if read_cols > incols:
+            read_cols, read_rows = incols, inrows
+
+        rgb = numpy.empty((3, read_rows, read_cols), dtype='uint8')
+        for i, band_file in enumerate((red_file, green_file, blue_file)):
+            with rasterio.open(str(band_file)) as ds:
+                array = ds.read(1, out_shape=(read_rows, read_cols), resampling=Resampling.nearest)
+            rgb[i] = _stretch_to_bytes(array, nodata)
+
+    for (thumbnail_path, _), shape in zip(outputs, shapes):
+        if shape:
+            cols, rows, _ = shape
+            _write_image(thumbnail_path, _resize_nearest(rgb, rows, cols))
+
+    return shapes
 
 
 def create_typical_browse_metadata(dataset_driver, dataset, destination_directory):
@@ -275,34 +276,38 @@ def create_dataset_browse_images(
     if not dataset.browse:
         create_typical_browse_metadata(dataset_driver, dataset, target_directory)
 
-    # Create browse images based on the metadata.
-    for browse_id, browse_metadata in dataset.browse.items():
-        x_constraint = None
-        if browse_metadata.shape:
-            x_constraint = browse_metadata.shape.x
-
-        bands = dataset.image.bands
+    bands = dataset.image.bands
 
+    # Group browse images that use the same bands, so that each group is created from a single read.
+    browse_groups = {}
+    for browse_metadata in dataset.browse.values():
         necessary_bands = (browse_metadata.red_band, browse_metadata.green_band, browse_metadata.blue_band)
         if not all([bands.get(band) for band in necessary_bands]):
             raise ValueError(
                 'Some browse bands missing. Requires {!r}, has {!r}'
                 ''.format(necessary_bands, bands.keys())
             )
+        browse_groups.setdefault(necessary_bands, []).append(browse_metadata)
 
+    # Create browse images based on the metadata.
+    for necessary_bands, browse_metadatas in browse_groups.items():
         r_path, g_path, b_path = [bands[p].path for p in necessary_bands]
-        cols, rows, output_res = _create_thumbnail(
+        shapes = _create_thumbnails(
             r_path,
             g_path,
             b_path,
-            browse_metadata.path,
-            x_constraint=x_constraint
+            [
+                (browse_metadata.path, browse_metadata.shape.x if browse_metadata.shape else None)
+                for browse_metadata in browse_metadatas
+            ]
         )
-        # Update with the exact shape information.
-        browse_metadata.shape = ptype.Point(cols, rows)
-        browse_metadata.cell_size = output_res
 
-        after_file_creation(browse_metadata.path)
+        for browse_metadata, (cols, rows, output_res) in zip(browse_metadatas, shapes):
+            # Update with the exact shape information.
+            browse_metadata.shape = ptype.Point(cols, rows)
+            browse_metadata.cell_size = output_res
+
+            after_file_creation(browse_metadata.path)
 
     return dataset
 
@@ -0,0 +1,255 @@
+# coding=utf-8
+"""
+Choose lossless GeoTIFF compression settings for a band, by trialling candidate settings on samples of its data.
+
+Tuned settings can be cached per product and band (see `Tuner`), so that tuning runs once per product
+rather than once per scene.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy
+import rasterio
+import rasterio.windows
+from rasterio.errors import NotGeoreferencedWarning, RasterioError
+
+_LOG = logging.getLogger(__name__)
+
+# 'size': the smallest output (within the time budget, if any).
+# 'decode': the fastest to read back (within the time budget, if any).
+GOALS = ('size', 'decode')
+
+# Size (in pixels, both x and y) and number of windows sampled from each band.
+DEFAULT_SAMPLE_SIZE = 1024
+DEFAULT_SAMPLE_COUNT = 3
+
+
+class Trial(NamedTuple):
+    options: Dict
+    # Total compressed size of the samples, in bytes.
+    size: int
+    # Time to compress and decompress the samples, per megapixel.
+    encode_seconds: float
+    decode_seconds: float
+
+
+def candidate_options(dtype: str) -> List[Dict]:
+    """
+    Lossless GeoTIFF creation options worth trying for the given data type.
+
+    Codecs unsupported by the local GDAL build are skipped when trialled.
+
+    >>> candidates = candidate_options('uint16')
+    >>> {c['compress'] for c in candidates} == {'deflate', 'lzw', 'zstd', 'lerc'}
+    True
+    >>> sorted({c.get('predictor', 1) for c in candidate_options('float32')})
+    [1, 3]
+    """
+    predictor = 3 if numpy.dtype(dtype).kind == 'f' else 2
+
+    candidates = []
+    for block_size in (256, 512):
+        tiling = dict(tiled=True, blockxsize=block_size, blockysize=block_size)
+        candidates.extend([
+            *(dict(compress='deflate', predictor=predictor, zlevel=zlevel, **tiling) for zlevel in (1, 6, 9)),
+            dict(compress='lzw', predictor=predictor, **tiling),
+            *(dict(compress='zstd', predictor=predictor, zstd_level=level, **tiling) for level in (1, 9, 15)),
+            # Lerc is lossless with a zero error threshold. It doesn't use a predictor.
+            dict(compress='lerc', max_z_error=0, **tiling),
+        ])
+    return candidates
+
+
+def sample_windows(dataset: rasterio.DatasetReader,
+                   band: int = 1,
+                   count: int = DEFAULT_SAMPLE_COUNT,
+                   size: int = DEFAULT_SAMPLE_SIZE) -> List[numpy.ndarray]:
+    """
+    Read windows of the band spread along its diagonal.
+
+    (The diagonal avoids sampling only the empty corners of a typical scene.)
+    """
+    width, height = min(size, dataset.width), min(size, dataset.height)
+    samples = []
+    for i in range(count):
+        fraction = (i + 1) / (count + 1)
+        col_off = int(fraction * (dataset.width - width))
+        row_off = int(fraction * (dataset.height - height))
+        samples.append(dataset.read(band, window=rasterio.windows.Window(col_off, row_off, width, height)))
+    return samples
+
+
+def trial(samples: List[numpy.ndarray], options: Dict) -> Optional[Trial]:
+    """
+    Compress and decompress the samples with the given options.
+
+    :returns: The measured results, or None if the options aren't supported (or aren't lossless).
+    """
+    size = 0
+    encode_seconds = decode_seconds = 0.0
+    megapixels = sum(sample.size for sample in samples) / 1e6
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', NotGeoreferencedWarning)
+        for sample in samples:
+            with rasterio.MemoryFile() as memory_file:
+                start = time.perf_counter()
+                try:
+                    with memory_file.open(driver='GTiff',
+                                          width=sample.shape[1],
+                                          height=sample.shape[0],
+                                          count=1,
+                                          dtype=sample.dtype,
+                                          **options) as ds:
+                        ds.write(sample, 1)
+                except RasterioError:
+                    _LOG.debug('Unusable compression options %r', options, exc_info=True)
+                    return None
+                encode_seconds += time.perf_counter() - start
+                size += memory_file.getbuffer().nbytes
+
+                start = time.perf_counter()
+                with memory_file.open() as ds:
+                    # GDAL ignores unknown codecs, writing uncompressed data instead.
+                    if (ds.profile.get('compress') or '').lower() != options['compress'].lower():
+                        return None
+                    decoded = ds.read(1)
+                decode_seconds += time.perf_counter() - start
+
+            if not numpy.array_equal(decoded, sample):
+                _LOG.warning('Compression options %r are lossy. Skipping.', options)
+                return None
+
+    return Trial(options, size, encode_seconds / megapixels, decode_seconds / megapixels)
+
+
+def choose(trials: List[Trial], goal: str = 'size', time_budget: float = None) -> Trial:
+    """
+    Choose the best trial for the goal.
+
+    :param time_budget: Maximum compression time allowed, in seconds per megapixel (if any trial is within it)
+    """
+    if goal not in GOALS:
+        raise ValueError("Unknown compression goal {!r}. Expected one of {!r}".format(goal, GOALS))
+    if not trials:
+        raise ValueError("No usable compression trials")
+
+    if time_budget is not None:
+        within_budget = [t for t in trials if t.encode_seconds <= time_budget]
+        if within_budget:
+            trials = within_budget
+        else:
+            _LOG.warning('No compression options within time budget of %ss/megapixel', time_budget)
+
+    if goal == 'size':
+        return min(trials, key=lambda t: (t.size, t.encode_seconds))
+    return min(trials, key=lambda t: (t.decode_seconds, t.size))
+
+
+def tune(dataset: rasterio.DatasetReader,
+         band: int = 1,
+         goal: str = 'size',
+         time_budget: float = None,
+         candidates: List[Dict] = None) -> Dict:
+    """
+    Find the best lossless compression options for a band of the dataset.
+
+    :returns: GeoTIFF creation options.
+    """
+    samples = sample_windows(dataset, band=band)
+    if candidates is None:
+        candidates = candidate_options(dataset.dtypes[band - 1])
+
+    trials = [t for t in (trial(samples, options) for options in candidates) if t is not None]
+    best = choose(trials, goal=goal, time_budget=time_budget)
+    _LOG.info('Tuned compression (%s): %r (%.1f%% of uncompressed)',
+              goal, best.options, 100 * best.size / sum(sample.nbytes for sample in samples))
+    return best.options
+
+
+class TuningCache(object):
+    """
+    Tuned compression options, stored in a json file.
+
+    The file is reread before each write, and replaced atomically, so it can be shared by
+    concurrent processes. (Concurrent writers may occasionally lose an entry, which is
+    then tuned again.)
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read()
+            return self._entries.get(key)
+
+    def put(self, key: str, options: Dict):
+        with self._lock:
+            self._entries = self._read()
+            self._entries[key] = options
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.' + self.path.name, dir=str(self.path.parent))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._entries, f, indent=4, sort_keys=True)
+            os.replace(tmp_path, str(self.path))
+
+    def _read(self) -> Dict[str, Dict]:
+        if not self.path.exists():
+            return {}
+        with self.path.open('r') as f:
+            return json.load(f)
+
+    def __getstate__(self):
+        # Locks can't be pickled (for use in other processes). They'll get their own.
+        return dict(path=self.path)
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+class Tuner(object):
+    """
+    Tune compression options for bands, reusing previous results for the same product and band.
+
+    Keys identify a kind of band (such as 'LC08_L1TP/B1.TIF') so that results apply to every scene of
+    the product. Results are kept in memory, or in a `TuningCache` file if a path is given.
+    """
+
+    def __init__(self, goal: str = 'size', time_budget: float = None, cache_path: Path = None):
+        if goal not in GOALS:
+            raise ValueError("Unknown compression goal {!r}. Expected one of {!r}".format(goal, GOALS))
+        self.goal = goal
+        self.time_budget = time_budget
+        self.cache = TuningCache(cache_path) if cache_path else None
+        self._tuned = {}
+
+    def options_for(self, dataset: rasterio.DatasetReader, key: str, band: int = 1) -> Dict:
+        """
+        Get the compression options for a band of the dataset, tuning them if not yet known.
+        """
+        # Data types compress differently, so always distinguish them.
+        key = '{}:{}:{}'.format(self.goal, key, dataset.dtypes[band - 1])
+
+        options = self._tuned.get(key)
+        if options is None and self.cache is not None:
+            options = self.cache.get(key)
+        if options is None:
+            options = tune(dataset, band=band, goal=self.goal, time_budget=self.time_budget)
+            if self.cache is not None:
+                self.cache.put(key, options)
+        self._tuned[key] = options
+        return dict(options)
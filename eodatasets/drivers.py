@@ -122,11 +122,31 @@ class DatasetDriver(object):
 
         return browse_bands
 
-    def calculate_valid_data_region(self, path, mask_value=None):
+    def image_compression(self, dataset):
+        """
+        Options for compressing this product's images while packaging.
+
+        Products can override these to tune compression. The keys are arguments
+        to `eodatasets.package.compress_image()` (eg. compress='deflate', zlevel=6, tiled=True)
+
+        :type dataset: ptype.DatasetMetadata
+        :rtype: dict
+        """
+        return {}
+
+    def calculate_valid_data_region(self, path, mask_value=None, **kwargs):
+        """
+        The valid data region of the product's images. The images are decoded concurrently.
+
+        Options are passed to `valid_region.valid_region_geometry()` (eg. workers=4, num_threads=2)
+
+        :type path: Path
+        :rtype: dict
+        """
         image_files = [filename
                        for filename in path.rglob('*')
                        if self.include_file(filename)]
-        return valid_region.safe_valid_region(image_files, mask_value)
+        return valid_region.safe_valid_region(image_files, mask_value, **kwargs)
 
     def __eq__(self, other):
         if self.__class__ != other.__class__:
@@ -4,13 +4,13 @@ from __future__ import absolute_import
 import datetime
 import fnmatch
 import logging
-import re
 import xml.etree.cElementTree as ElementTree
 
 import dateutil.parser
 from pathlib import Path
 
 import eodatasets.type as ptype
+from . import mtl
 from .util import parse_type
 
 _LOG = logging.getLogger(__name__)
@@ -64,29 +64,9 @@ def _get_mtl(base_folder):
     return _get_file(base_folder, '*_MTL.txt')
 
 
-def _load_mtl(filename, root='L1_METADATA_FILE', pairs=r'(\w+)\s=\s(.*)'):
+def _load_mtl(filename, root='L1_METADATA_FILE'):
     """Parse an MTL file and return dict-of-dict's containing the metadata."""
-
-    def parse(lines, tree, level=0):
-        """Parse it"""
-        while lines:
-            line = lines.pop(0)
-            match = re.findall(pairs, line)
-            if match:
-                key, value = match[0]
-                if key == 'GROUP':
-                    tree[value] = {}
-                    parse(lines, tree[value], level + 1)
-                elif key == 'END_GROUP':
-                    break
-                else:
-                    tree[key.lower()] = parse_type(value)
-
-    tree = {}
-    with open(str(filename), 'r') as fo:
-        parse(fo.readlines(), tree)
-
-    return tree[root]
+    return mtl.load(filename, value_parser=parse_type, lowercase_groups=False)[root]
 
 
 def _read_mtl_band_filenames(mtl_):
@@ -0,0 +1,98 @@
+# coding=utf-8
+"""
+Parse USGS MTL metadata files (the "GROUP = ..." text format of Landsat Level 1 products).
+"""
+from __future__ import absolute_import
+
+import re
+
+# A "KEY = VALUE" line.
+_PAIR_RE = re.compile(r'(\w+)\s=\s(.*)')
+
+# Values starting with anything else can't be numbers, so we don't attempt to parse them as numbers.
+# (Includes the starts of "nan" and "inf", and whitespace, which int() and float() strip.)
+_NUMBER_START = frozenset('0123456789+-.nNiI \t\r\n')
+
+
+def parse_value(s):
+    """
+    Parse a value as an int or float if it looks like one, otherwise a string (without quotes).
+
+    >>> parse_value('"asdf"')
+    'asdf'
+    >>> parse_value("123")
+    123
+    >>> parse_value("3.14")
+    3.14
+    >>> parse_value("2016-01-21")
+    '2016-01-21'
+    >>> parse_value("")
+    ''
+    """
+    s = s.strip('"')
+    if s[:1] not in _NUMBER_START:
+        return s
+    for parser in (int, float):
+        try:
+            return parser(s)
+        except ValueError:
+            pass
+    return s
+
+
+def parse(lines, value_parser=parse_value, lowercase_groups=True):
+    """
+    Parse the lines of an MTL file into nested dicts, one per group.
+
+    Lines are read in a single pass, so this can be given an open file directly (in text or binary mode,
+    such as a tar member).
+
+    >>> parse(['GROUP = L1_METADATA_FILE', '  GROUP = PRODUCT_METADATA', '    WRS_PATH = 101',
+    ...        '    SPACECRAFT_ID = "LANDSAT_8"', '  END_GROUP = PRODUCT_METADATA', 'END_GROUP = L1_METADATA_FILE',
+    ...        'END'])
+    {'l1_metadata_file': {'product_metadata': {'wrs_path': 101, 'spacecraft_id': 'LANDSAT_8'}}}
+    >>> parse([b'GROUP = L1_METADATA_FILE', b'  CLOUD_COVER = 2.5'], lowercase_groups=False)
+    {'L1_METADATA_FILE': {'cloud_cover': 2.5}}
+
+    :param value_parser: Function to convert each (string) value.
+    :param lowercase_groups: Lowercase group names. (Field names are always lowercased)
+    :rtype: dict
+    """
+    tree = {}
+    # The groups we're within.
+    stack = [tree]
+    match_pair = _PAIR_RE.search
+
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+
+        match = match_pair(line)
+        if not match:
+            continue
+
+        key, value = match.groups()
+        if key == 'GROUP':
+            group = {}
+            stack[-1][value.lower() if lowercase_groups else value] = group
+            stack.append(group)
+        elif key == 'END_GROUP':
+            # A stray END_GROUP at the top level ends parsing.
+            if len(stack) == 1:
+                break
+            stack.pop()
+        else:
+            stack[-1][key.lower()] = value_parser(value)
+
+    return tree
+
+
+def load(path, **kwargs):
+    """
+    Parse the MTL file at the given path. (See parse() for options)
+
+    :type path: str or pathlib.Path
+    :rtype: dict
+    """
+    with open(str(path), 'r') as f:
+        return parse(f, **kwargs)
@@ -1,7 +1,14 @@
 from __future__ import absolute_import
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy
 import rasterio
+from affine import Affine
 from rasterio.errors import RasterioIOError
 import rasterio.features
+import rasterio.windows
 from scipy import ndimage
 import shapely.affinity
 import shapely.geometry
@@ -11,51 +18,213 @@ import logging
 
 _LOG = logging.getLogger(__name__)
 
+# Maximum size of each block of pixels read from an image. (The accumulated mask is one byte per output pixel.)
+DEFAULT_MAX_BLOCK_BYTES = 64 * 1024 * 1024
+
+# Number of images decoded concurrently. (rasterio releases the GIL while reading, so threads give us real
+# concurrency.) Memory use grows with each: a mask plus a block of pixels per image being read.
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Footprint methods:
+#   'shapes': polygonise the mask and take the convex hull of the union of shapes.
+#   'extents': take the convex hull of each row's first and last valid pixels. Same result, much faster.
+FOOTPRINT_METHODS = ('shapes', 'extents')
 
-def safe_valid_region(images, mask_value=None):
+
+def safe_valid_region(images, mask_value=None, **kwargs):
     try:
-        return valid_region(images, mask_value)
+        return valid_region(images, mask_value, **kwargs)
     except (OSError, RasterioIOError):
         return None
 
 
-def valid_region(images, mask_value=None):
-    mask = None
+def valid_region(images, mask_value=None, **kwargs):
+    """
+    Calculate the valid data region of the given images, as a GeoJSON-like dict.
+
+    See valid_region_geometry() for options.
+    """
+    geom = valid_region_geometry(images, mask_value, **kwargs)
+    if geom is None:
+        return None
+
+    output = shapely.geometry.mapping(geom)
+    output['coordinates'] = _to_lists(output['coordinates'])
+    return output
+
+
+def valid_region_geometry(images, mask_value=None,
+                          nodata=None,
+                          decimation=1,
+                          tolerance=1,
+                          max_block_bytes=DEFAULT_MAX_BLOCK_BYTES,
+                          method='shapes',
+                          workers=DEFAULT_WORKERS,
+                          num_threads=None):
+    """
+    Calculate the valid data region of the given images (a convex hull), in the images' CRS.
+
+    Images are read block-by-block, so memory use is bounded by the (decimated) mask size plus
+    `max_block_bytes` for each of the `workers`, regardless of the number of bands.
+
+    :param mask_value: Pixels are valid if they have all of these bits set. (otherwise: if not nodata)
+    :param nodata: Nodata value of the images. Default: the value recorded in each image.
+    :param decimation: Read at 1/decimation resolution in each dimension. The footprint may then be off by up
+                       to this many pixels, but is read much more quickly. Reads are made at the reduced
+                       resolution, so GDAL can use overviews (or JPEG2000 resolution levels, for powers
+                       of two) rather than decoding every pixel. (Overviews are smoothed, so edges of the
+                       footprint may spread outward by a further decimated pixel or two.)
+    :param tolerance: Distance (in full-resolution pixels) to buffer and simplify the footprint.
+    :param max_block_bytes: Maximum size of each block of pixels read.
+    :param method: How to calculate the hull from the mask, one of FOOTPRINT_METHODS.
+    :param workers: Number of images to decode concurrently.
+    :param num_threads: Threads used by GDAL to decode each image (GDAL_NUM_THREADS, such as for JPEG2000).
+                        Default: GDAL's setting.
+    :rtype: shapely.geometry.base.BaseGeometry
+    """
+    if method not in FOOTPRINT_METHODS:
+        raise ValueError("Unknown footprint method {!r}. Expected one of {!r}".format(method, FOOTPRINT_METHODS))
 
     if not images:
         _LOG.warning("No images: empty region")
         return None
 
-    for fname in images:
-        with rasterio.open(str(fname), 'r') as ds:
-            transform = ds.transform
-            img = ds.read(1)
+    mask, transform = _valid_data_mask(
+        images,
+        mask_value=mask_value,
+        nodata=nodata,
+        decimation=decimation,
+        max_block_bytes=max_block_bytes,
+        workers=workers,
+        num_threads=num_threads,
+    )
+    return _mask_footprint(mask, transform, tolerance=tolerance / decimation, method=method)
+
+
+def _valid_data_mask(images, mask_value=None, nodata=None, decimation=1, max_block_bytes=DEFAULT_MAX_BLOCK_BYTES,
+                     workers=DEFAULT_WORKERS, num_threads=None):
+    """
+    Accumulate a (possibly decimated) boolean mask of valid pixels across all images.
+
+    Images are decoded concurrently by up to `workers` threads, and each image's mask is merged
+    as soon as it's read.
+
+    :return: The mask, and the affine transform of its pixels (from the first image).
+    """
+    def read(fname):
+        return _image_mask(fname, mask_value=mask_value, nodata=nodata, decimation=decimation,
+                           max_block_bytes=max_block_bytes, num_threads=num_threads)
+
+    images = list(images)
+    mask = None
+    mask_transform = None
+
+    for i, fname, (image_mask, transform) in _read_all(read, images, workers):
+        if mask is None:
+            mask = image_mask
+        elif mask.shape != image_mask.shape:
+            raise ValueError(
+                "Images have differing shapes: {} is {!r}, expected {!r}".format(fname, image_mask.shape, mask.shape)
+            )
+        else:
+            mask |= image_mask
+
+        if i == 0:
+            mask_transform = transform
+
+    return mask, mask_transform
+
+
+def _read_all(read, images, workers):
+    """
+    Call read() for each image, using up to `workers` threads.
+
+    :return: (index, image, result) tuples, in order of completion.
+    """
+    if workers <= 1 or len(images) <= 1:
+        for i, fname in enumerate(images):
+            yield i, fname, read(fname)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(images))) as executor:
+        futures = {executor.submit(read, fname): (i, fname) for i, fname in enumerate(images)}
+        try:
+            for future in as_completed(futures):
+                i, fname = futures[future]
+                yield i, fname, future.result()
+        finally:
+            # Don't start reading remaining images if we've failed.
+            for future in futures:
+                future.cancel()
+
+
+def _image_mask(fname, mask_value=None, nodata=None, decimation=1, max_block_bytes=DEFAULT_MAX_BLOCK_BYTES,
+                num_threads=None):
+    """
+    Read the (possibly decimated) boolean mask of valid pixels of one image.
+
+    :return: The mask, and the affine transform of its pixels.
+    """
+    _LOG.info("Valid regions for %s", fname)
+    decoder_options = dict(GDAL_NUM_THREADS=str(num_threads)) if num_threads else {}
+
+    with rasterio.Env(**decoder_options), rasterio.open(str(fname), 'r') as ds:
+        mask_shape = (int(math.ceil(ds.height / decimation)), int(math.ceil(ds.width / decimation)))
+        mask = numpy.zeros(mask_shape, dtype=bool)
+        mask_transform = ds.transform * Affine.scale(
+            ds.width / mask_shape[1],
+            ds.height / mask_shape[0]
+        )
+
+        band_nodata = ds.nodata if nodata is None else nodata
+
+        for window, mask_rows in _row_strips(ds, decimation, max_block_bytes):
+            img = ds.read(1, window=window, out_shape=(mask_rows.stop - mask_rows.start, mask_shape[1]))
 
             if mask_value is not None:
-                new_mask = img & mask_value == mask_value
+                mask[mask_rows] |= img & mask_value == mask_value
+            elif band_nodata is None:
+                mask[mask_rows] = True
             else:
-                new_mask = img != ds.nodata
+                mask[mask_rows] |= img != band_nodata
 
-            if mask is None:
-                mask = new_mask
-            else:
-                mask |= new_mask
+    return mask, mask_transform
 
-    # apply a fill holes filter; reduces run time of the union function
-    # when there are lots of holes in the data eg NBART, PQ, and Landsat 7
-    mask = ndimage.binary_fill_holes(mask)
 
-    shapes = rasterio.features.shapes(mask.astype('uint8'), mask=mask)
-    shape = shapely.ops.unary_union([shapely.geometry.shape(shape) for shape, val in shapes if val == 1])
+def _row_strips(ds, decimation, max_block_bytes):
+    """
+    Split an image into strips of whole rows, each read within max_block_bytes.
+
+    Strips are aligned to the decimation factor, so that each maps onto whole rows of the output mask.
+
+    :return: Pairs of (input window, output mask row slice)
+    """
+    row_bytes = ds.width * numpy.dtype(ds.dtypes[0]).itemsize
+    strip_rows = max(1, max_block_bytes // row_bytes // decimation) * decimation
+
+    for row_off in range(0, ds.height, strip_rows):
+        height = min(strip_rows, ds.height - row_off)
+        mask_row_off = row_off // decimation
+        yield (
+            rasterio.windows.Window(0, row_off, ds.width, height),
+            slice(mask_row_off, mask_row_off + int(math.ceil(height / decimation)))
+        )
 
-    # convex hull
-    geom = shape.convex_hull
+
+def _mask_footprint(mask, transform, tolerance=1, method='shapes'):
+    """
+    Calculate the convex hull of the valid pixels of a mask, transformed into CRS coordinates.
+    """
+    if method == 'extents':
+        geom = _row_extents_hull(mask)
+    else:
+        geom = _shapes_hull(mask)
 
     # buffer by 1 pixel
-    geom = geom.buffer(1, join_style=3, cap_style=3)
+    geom = geom.buffer(tolerance, join_style=3, cap_style=3)
 
     # simplify with 1 pixel radius
-    geom = geom.simplify(1)
+    geom = geom.simplify(tolerance)
 
     # intersect with image bounding box
     geom = geom.intersection(shapely.geometry.box(0, 0, mask.shape[1], mask.shape[0]))
@@ -63,10 +232,47 @@ def valid_region(images, mask_value=None):
     # transform from pixel space into CRS space
     geom = shapely.affinity.affine_transform(geom, (transform.a, transform.b, transform.d,
                                                     transform.e, transform.xoff, transform.yoff))
+    return geom
 
-    output = shapely.geometry.mapping(geom)
-    output['coordinates'] = _to_lists(output['coordinates'])
-    return output
+
+def _shapes_hull(mask):
+    """
+    Convex hull (in pixel coordinates) of the polygonised valid pixels of a mask.
+    """
+    # apply a fill holes filter; reduces run time of the union function
+    # when there are lots of holes in the data eg NBART, PQ, and Landsat 7
+    mask = ndimage.binary_fill_holes(mask)
+
+    shapes = rasterio.features.shapes(mask.astype('uint8'), mask=mask)
+    shape = shapely.ops.unary_union([shapely.geometry.shape(shape) for shape, val in shapes if val == 1])
+
+    return shape.convex_hull
+
+
+def _row_extents_hull(mask):
+    """
+    Convex hull (in pixel coordinates) of the valid pixels of a mask, from each row's outermost valid pixels.
+
+    The hull of a set of pixels only depends on the first and last of each row, so we never need to build shapes.
+
+    >>> _row_extents_hull(numpy.array([[0, 1, 1, 0], [0, 0, 0, 0], [1, 0, 1, 0]], dtype=bool)).bounds
+    (0.0, 0.0, 3.0, 3.0)
+    >>> _row_extents_hull(numpy.zeros((2, 2), dtype=bool)).is_empty
+    True
+    """
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return shapely.geometry.Polygon()
+
+    valid_rows = mask[rows]
+    first = valid_rows.argmax(axis=1)
+    # One past the last valid pixel: its right-hand edge.
+    last = mask.shape[1] - valid_rows[:, ::-1].argmax(axis=1)
+
+    # The four corners of each row's outermost pixels.
+    xs = numpy.concatenate([first, first, last, last])
+    ys = numpy.concatenate([rows, rows + 1, rows, rows + 1])
+    return shapely.geometry.MultiPoint(numpy.column_stack([xs, ys]).astype('float64')).convex_hull
 
 
 def _to_lists(x):
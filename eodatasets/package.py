@@ -8,11 +8,13 @@ import shutil
 import socket
 import uuid
 from functools import partial
-from subprocess import check_call
 
 # flake8 doesn't recognise type hints as usage
 from pathlib import Path  # noqa: F401
 
+import rasterio
+import rasterio.shutil
+
 import eodatasets
 import eodatasets.type as ptype
 from eodatasets import serialise, verify, metadata, documents
@@ -24,6 +26,9 @@ _LOG = logging.getLogger(__name__)
 
 _RUNTIME_ID = uuid.uuid1()
 
+# GDAL block cache used while compressing imagery.
+GDAL_CACHE_MAX_MB = 512
+
 
 def init_locally_processed_dataset(directory, source_datasets, uuid_=None):
     """
@@ -90,7 +95,8 @@ def package_dataset(dataset_driver,
                     image_path,
                     target_path,
                     hard_link=False,
-                    additional_files=None):
+                    additional_files=None,
+                    compression_tuner=None):
     """
     Package the given dataset folder.
 
@@ -107,6 +113,8 @@ def package_dataset(dataset_driver,
     :type target_path: Path
     :param additional_files: Additional files to record in the package.
     :type additional_files: tuple[Path]
+    :param compression_tuner: Tune image compression settings for each kind of band (instead of the driver's)
+    :type compression_tuner: eodatasets.compression.Tuner
 
     :raises IncompletePackage: If not enough metadata can be extracted from the dataset.
     :return: The generated GA Dataset ID (ga_label)
@@ -135,16 +143,27 @@ def package_dataset(dataset_driver,
 
     def save_target_checksums_and_paths(source_path, target_paths):
         _LOG.debug('%r -> %r', source_path, target_paths)
-        checksums.add_files(target_paths)
+        # Plain copies were already checksummed as they were written.
+        checksums.add_files([path for path in target_paths if checksums.get_hash(path) is None])
         file_paths.extend(target_paths)
 
+    compress_options = dataset_driver.image_compression(dataset)
+    if compression_tuner is not None:
+        compress_options = dict(
+            compress_options,
+            tuner=compression_tuner,
+            tuning_key=partial(_tuning_key, dataset_driver.get_id(), dataset_driver.get_ga_label(dataset))
+        )
+
     prepare_target_imagery(
         image_path,
         destination_directory=package_directory,
         include_path=dataset_driver.include_file,
         translate_path=partial(dataset_driver.translate_path, dataset),
         after_file_copy=save_target_checksums_and_paths,
-        hard_link=hard_link
+        compress_options=compress_options,
+        hard_link=hard_link,
+        checksums=checksums
     )
 
     write_additional_files(additional_files, checksums, target_path)
@@ -195,8 +214,7 @@ def write_additional_files(additional_files, checksums, target_path):
         target_path = additional_directory.joinpath(path.name)
         if not target_path.parent.exists():
             target_path.parent.mkdir(parents=True)
-        shutil.copyfile(str(path.absolute()), str(target_path))
-        checksums.add_file(target_path)
+        checksums.add_hash(target_path, verify.copy_file_with_hash(path.absolute(), target_path))
 
 
 def prepare_target_imagery(
@@ -206,16 +224,24 @@ def prepare_target_imagery(
         translate_path=lambda p: p,
         after_file_copy=lambda source_path, final_path: None,
         compress_imagery=True,
-        hard_link=False):
+        hard_link=False,
+        checksums=None,
+        compress_options=None):
     """
     Copy a directory of files if not already there. Possibly compress images.
 
+    If `checksums` are given, files that are copied verbatim are checksummed from the bytes
+    as they're written, and recorded there (before `after_file_copy` is called).
+
     :type translate_path: (Path) -> Path
     :type source_directory: Path
     :type destination_directory: Path
     :type after_file_copy: Path -> None
     :type hard_link: bool
     :type compress_imagery: bool
+    :type checksums: eodatasets.verify.PackageChecksum
+    :param compress_options: Arguments to `compress_image()` for compressed images (default: lossless LZW)
+    :type compress_options: dict
     """
     if not destination_directory.exists():
         destination_directory.mkdir()
@@ -231,23 +257,34 @@ def prepare_target_imagery(
 
         absolute_target_path = destination_directory / rel_target_path
 
-        output_paths = _copy_file(source_file, absolute_target_path, compress_imagery, hard_link=hard_link)
+        output_paths = _copy_file(
+            source_file, absolute_target_path, compress_imagery,
+            hard_link=hard_link,
+            checksums=checksums,
+            compress_options=compress_options
+        )
 
         after_file_copy(source_file, output_paths)
 
 
-def _copy_file(source_path, destination_path, compress_imagery=True, hard_link=False):
+def _copy_file(source_path, destination_path, compress_imagery=True, hard_link=False,
+               checksums=None, compress_options=None):
     """
     Copy a file from source to destination if needed. Maybe apply compression.
 
     (it's generally faster to compress during a copy operation than as a separate step)
 
+    Checksums of verbatim copies are recorded in `checksums`, as they're calculated while copying.
+
     :type source_path: Path
     :type destination_path: Path
     :type compress_imagery: bool
     :type hard_link: bool
-    :return: Size in bytes of destination file.
-    :rtype int
+    :type checksums: eodatasets.verify.PackageChecksum
+    :param compress_options: Arguments to `compress_image()`
+    :type compress_options: dict
+    :return: Output file paths
+    :rtype: list[Path]
     """
 
     source_file = str(source_path)
@@ -267,27 +304,82 @@ def _copy_file(source_path, destination_path, compress_imagery=True, hard_link=F
     # If a tif image, compress it losslessly.
     elif suffix == '.tif' and compress_imagery:
         _LOG.info('Copying compressed %r -> %r', source_file, destination_file)
-        check_call(
-            [
-                'gdal_translate',
-                '--config', 'GDAL_CACHEMAX', '512',
-                '--config', 'TILED', 'YES',
-                '-co', 'COMPRESS=lzw',
-                '-co', 'predictor=2',
-                source_file, destination_file
-            ]
-        )
+        compress_image(source_path, destination_path, **(compress_options or {}))
         # If gdal output an IMD file, include it in the outputs.
         imd_file = destination_path.parent.joinpath('{}.IMD'.format(destination_path.stem))
         if imd_file.exists():
             output_paths.append(imd_file)
     else:
         _LOG.info('Copying %r -> %r', source_file, destination_file)
-        shutil.copyfile(source_file, destination_file)
+        if checksums is not None:
+            checksums.add_hash(destination_path, verify.copy_file_with_hash(source_file, destination_file))
+        else:
+            shutil.copyfile(source_file, destination_file)
 
     return output_paths
 
 
+def compress_image(source_path, destination_path,
+                   compress='lzw',
+                   predictor=2,
+                   zlevel=None,
+                   tiled=False,
+                   block_size=512,
+                   num_threads='ALL_CPUS',
+                   tuner=None,
+                   tuning_key=None,
+                   **creation_options):
+    """
+    Write a compressed GeoTIFF copy of an image, in-process.
+
+    This is equivalent to a gdal_translate call, without the cost of starting a new process (and
+    GDAL driver registration) for every band. The defaults match our historic packaging settings
+    (untiled, LZW with horizontal differencing).
+
+    :type source_path: Path
+    :type destination_path: Path
+    :param compress: GDAL compression codec (eg. 'lzw', 'deflate', 'zstd')
+    :param predictor: GDAL predictor (1: none, 2: horizontal differencing, 3: floating point)
+    :param zlevel: Deflate compression level, if using deflate.
+    :param tiled: Write a tiled GeoTIFF with blocks of block_size (rather than strips)
+    :type block_size: int
+    :param num_threads: Threads used by GDAL for compression ('ALL_CPUS' or a number).
+    :param tuner: Use compression settings tuned for this kind of band, rather than the above.
+    :type tuner: eodatasets.compression.Tuner
+    :param tuning_key: Function giving the tuning key of a destination path (default: its file name).
+    :param creation_options: Any other GeoTIFF creation options (eg. zstd_level)
+    """
+    if tuner is not None:
+        with rasterio.open(str(source_path)) as ds:
+            key = tuning_key(destination_path) if tuning_key else destination_path.name
+            options = dict(tuner.options_for(ds, key), num_threads=num_threads, **creation_options)
+    else:
+        options = dict(
+            compress=compress,
+            predictor=predictor,
+            num_threads=num_threads,
+            **creation_options
+        )
+        if zlevel is not None:
+            options['zlevel'] = zlevel
+        if tiled:
+            options.update(tiled='YES', blockxsize=block_size, blockysize=block_size)
+
+    with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MAX_MB):
+        rasterio.shutil.copy(str(source_path), str(destination_path), driver='GTiff', **options)
+
+
+def _tuning_key(product, label, destination_path):
+    """
+    Identify the kind of band in an output file, independent of its scene.
+
+    >>> label = 'LS8_OLITIRS_OTH_P51_GALPGS01-032_101_078_20141012'
+    >>> _tuning_key('ortho', label, Path('product/{}_B7.tif'.format(label)))
+    'ortho/_B7.tif'
+    """
+    return '{}/{}'.format(product, destination_path.name.replace(label, ''))
+
+
 class IncompletePackage(Exception):
     """
     Package is incomplete: (eg. Not enough metadata could be found.)
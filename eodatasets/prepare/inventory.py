@@ -0,0 +1,105 @@
+"""
+An inventory of a dataset's files, gathered in a single scan of the filesystem.
+
+Metadata operations are often the dominant cost on network filesystems (such as Lustre), so
+the prepare scripts scan each dataset once and reuse the results, rather than walking it repeatedly.
+"""
+import fnmatch
+import os
+import stat
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional
+
+
+class FileEntry(NamedTuple):
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def from_stat(cls, path: Path, st: os.stat_result) -> 'FileEntry':
+        return cls(path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class DatasetInventory(object):
+    """
+    The files of a dataset: a single file (such as a tar), or all files within a directory.
+
+    >>> import tempfile
+    >>> test_dir = Path(tempfile.mkdtemp())
+    >>> test_dir.joinpath('inner').mkdir()
+    >>> test_dir.joinpath('inner', 'LT05_MTL.txt').write_text('asdf\\n')
+    5
+    >>> test_dir.joinpath('B1.TIF').write_text('secondary\\n')
+    10
+    >>> inventory = DatasetInventory.scan(test_dir)
+    >>> inventory.total_size
+    15
+    >>> sorted(p.relative_to(test_dir).as_posix() for p in inventory.paths)
+    ['B1.TIF', 'inner/LT05_MTL.txt']
+    >>> inventory.find('MTL').relative_to(test_dir).as_posix()
+    'inner/LT05_MTL.txt'
+    >>> [p.name for p in inventory.glob('*_MTL*')]
+    ['LT05_MTL.txt']
+    >>> DatasetInventory.scan(test_dir / 'B1.TIF').total_size
+    10
+    """
+
+    def __init__(self, base_path: Path, base_stat: os.stat_result, files: List[FileEntry]):
+        self.base_path = base_path
+        # The stat() of the base path itself (the file, or the directory)
+        self.base_stat = base_stat
+        self.files = files
+
+    @classmethod
+    def scan(cls, base_path: Path) -> 'DatasetInventory':
+        base_stat = os.stat(str(base_path))
+        if not stat.S_ISDIR(base_stat.st_mode):
+            return cls(base_path, base_stat, [FileEntry.from_stat(base_path, base_stat)])
+
+        return cls(base_path, base_stat, list(_scan_files(base_path)))
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.base_stat.st_mode)
+
+    @property
+    def paths(self) -> List[Path]:
+        return [f.path for f in self.files]
+
+    @property
+    def total_size(self) -> int:
+        return sum(f.size for f in self.files)
+
+    def glob(self, pattern: str) -> List[Path]:
+        """
+        All files whose name matches the (fnmatch) pattern.
+        """
+        return [f.path for f in self.files if fnmatch.fnmatch(f.path.name, pattern)]
+
+    def find(self, s: str, suffix: str = 'txt') -> Optional[Path]:
+        """
+        The first file with a certain string in its name (like `ls_usgs_l1_prepare.find_in()`)
+        """
+        for f in self.files:
+            if s in f.path.name and f.path.name.endswith(suffix):
+                return f.path
+        return None
+
+    def add_file(self, path: Path):
+        """
+        Record a file newly written into the dataset.
+        """
+        self.files.append(FileEntry.from_stat(path, os.stat(str(path))))
+
+
+def _scan_files(directory: Path) -> Iterable[FileEntry]:
+    # Like os.walk, using the stat information that scandir already has (or can fetch once) for each entry.
+    with os.scandir(str(directory)) as entries:
+        for entry in entries:
+            path = directory / entry.name
+            if entry.is_dir():
+                yield from _scan_files(path)
+            else:
+                yield FileEntry.from_stat(path, entry.stat())
@@ -3,14 +3,17 @@ Ingest data from the command-line.
 """
 from __future__ import absolute_import
 
-import hashlib
 import logging
 import os
 import re
+import sys
 import tarfile
 import tempfile
 import uuid
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 import click
@@ -18,7 +21,9 @@ import yaml
 from osgeo import osr
 
 from eodatasets import verify
+from eodatasets.metadata import mtl
 from . import serialise
+from .inventory import DatasetInventory
 
 try:
     # flake8 doesn't recognise type hints as usage
@@ -57,27 +62,6 @@ LANDSAT_BANDS = [
     ('QUALITY', 'quality'),
 ]
 
-MTL_PAIRS_RE = re.compile(r'(\w+)\s=\s(.*)')
-
-
-def _parse_value(s):
-    # type: (str) -> Union[int, float, str]
-    """
-    >>> _parse_value("asdf")
-    'asdf'
-    >>> _parse_value("123")
-    123
-    >>> _parse_value("3.14")
-    3.14
-    """
-    s = s.strip('"')
-    for parser in [int, float]:
-        try:
-            return parser(s)
-        except ValueError:
-            pass
-    return s
-
 
 def find_in(path, s, suffix='txt'):
     # type: (Path, str, str) -> Optional[Path]
@@ -102,26 +86,6 @@ def find_in(path, s, suffix='txt'):
     return None
 
 
-def _parse_group(lines, key_transform=lambda s: s.lower()):
-    # type: (Iterable[Union[str, bytes]], Callable[[str], str]) -> dict
-    tree = {}
-
-    for line in lines:
-        # If line is bytes-like convert to str
-        if isinstance(line, bytes):
-            line = line.decode('utf-8')
-        match = MTL_PAIRS_RE.findall(line)
-        if match:
-            key, value = match[0]
-            if key == 'GROUP':
-                tree[key_transform(value)] = _parse_group(lines)
-            elif key == 'END_GROUP':
-                break
-            else:
-                tree[key_transform(key)] = _parse_value(value)
-    return tree
-
-
 def get_geo_ref_points(info):
     # type: (Dict) -> Dict
     return {
@@ -168,27 +132,28 @@ def get_satellite_band_names(sat, instrument, file_name):
     return sat_img
 
 
-def get_mtl_content(acquisition_path):
-    # type: (Path) -> Tuple[Dict, str]
+def get_mtl_content(acquisition_path, inventory=None):
+    # type: (Path, Optional[DatasetInventory]) -> Tuple[Dict, str]
     """
     Find MTL file; return it parsed as a dict with its filename.
+
+    :param inventory: The dataset's files, if already scanned.
     """
-    if not acquisition_path.exists():
+    if inventory is None and not acquisition_path.exists():
         raise RuntimeError("Missing path '{}'".format(acquisition_path))
 
     if acquisition_path.is_file() and tarfile.is_tarfile(str(acquisition_path)):
         with tarfile.open(str(acquisition_path), 'r') as tp:
-            try:
-                internal_file = next(filter(lambda memb: '_MTL' in memb.name, tp.getmembers()))
-                filename = Path(internal_file.name).stem
-                with tp.extractfile(internal_file) as fp:
-                    return read_mtl(fp), filename
-            except StopIteration:
+            internal_file = _find_tar_mtl(tp)
+            if internal_file is None:
                 raise RuntimeError(
                     "MTL file not found in {}".format(str(acquisition_path))
                 )
+            filename = Path(internal_file.name).stem
+            with tp.extractfile(internal_file) as fp:
+                return read_mtl(fp), filename
     else:
-        path = find_in(acquisition_path, 'MTL')
+        path = inventory.find('MTL') if inventory else find_in(acquisition_path, 'MTL')
         if not path:
             raise RuntimeError("No MTL file")
 
@@ -197,42 +162,32 @@ def get_mtl_content(acquisition_path):
             return read_mtl(fp), filename
 
 
+def _find_tar_mtl(tp):
+    # type: (tarfile.TarFile) -> Optional[tarfile.TarInfo]
+    """
+    Find the MTL member of a tar, reading no further through the tar than needed.
+
+    (Our recompressed tars store the MTL first, so only its header needs to be read.)
+    """
+    for member in tp:
+        if '_MTL' in member.name:
+            return member
+    return None
+
+
 def read_mtl(fp):
-    return _parse_group(fp)['l1_metadata_file']
+    return mtl.parse(fp)['l1_metadata_file']
 
 
-def _file_size_bytes(path: Path) -> int:
+def prepare_dataset(base_path, write_checksum=True, inventory=None):
+    # type: (Path, bool, Optional[DatasetInventory]) -> Optional[Dict]
     """
-    Total file size for the given file/directory.
-
-    >>> import tempfile
-    >>> test_dir = Path(tempfile.mkdtemp())
-    >>> inner_dir = test_dir.joinpath('inner')
-    >>> inner_dir.mkdir()
-    >>> test_file = Path(inner_dir / 'test.txt')
-    >>> test_file.write_text('asdf\\n')
-    5
-    >>> Path(inner_dir / 'other.txt').write_text('secondary\\n')
-    10
-    >>> _file_size_bytes(test_file)
-    5
-    >>> _file_size_bytes(inner_dir)
-    15
-    >>> _file_size_bytes(test_dir)
-    15
+    :param inventory: The dataset's files, if already scanned. (otherwise they're scanned here)
     """
-    if path.is_file():
-        return path.stat().st_size
-
-    return sum(
-        _file_size_bytes(p)
-        for p in path.iterdir()
-    )
+    if inventory is None:
+        inventory = DatasetInventory.scan(base_path)
 
-
-def prepare_dataset(base_path, write_checksum=True):
-    # type: (Path, bool) -> Optional[Dict]
-    mtl_doc, mtl_filename = get_mtl_content(base_path)
+    mtl_doc, mtl_filename = get_mtl_content(base_path, inventory=inventory)
 
     if not mtl_doc:
         return None
@@ -244,12 +199,18 @@ def prepare_dataset(base_path, write_checksum=True):
             logging.warning("Checksum path exists. Not touching it. %r", checksum_path)
         else:
             checksum = verify.PackageChecksum()
-            checksum.add_file(base_path)
+            if inventory.is_dir:
+                checksum.add_files(inventory.paths, expand_directories=False)
+            else:
+                checksum.add_file(base_path)
             checksum.write(checksum_path)
+            # It's within directory datasets, so counts towards their size.
+            if inventory.is_dir:
+                inventory.add_file(checksum_path)
         additional['checksum_sha1'] = str(relative_path(base_path, checksum_path))
 
     return prepare_dataset_from_mtl(
-        _file_size_bytes(base_path),
+        inventory.total_size,
         mtl_doc,
         mtl_filename,
         additional_props=additional
@@ -378,10 +339,10 @@ def resolve_absolute_offset(dataset_path, metadata_path, offset):
 def yaml_checkums_correctly(output_yaml, data_path):
     with output_yaml.open() as yaml_f:
         logging.info("Running checksum comparison")
+        checksum_sha1 = verify.calculate_file_sha1(data_path)
         # It can match any dataset in the yaml.
         for doc in yaml.safe_load_all(yaml_f):
             yaml_sha1 = doc['checksum_sha1']
-            checksum_sha1 = hashlib.sha1(data_path.open('rb').read()).hexdigest()
             if checksum_sha1 == yaml_sha1:
                 return True
 
@@ -418,37 +379,49 @@ def yaml_checkums_correctly(output_yaml, data_path):
     help="Embed absolute paths in the metadata document (not recommended)",
     default=False
 )
-def main(output, datasets, check_checksum, force_absolute_paths, newer_than):
-    # type: (str, List[str], bool, bool, datetime) -> None
+@click.option(
+    '--checksum-cache',
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Cache checksums in this SQLite file, so that unchanged files aren't reread on later runs"
+)
+@click.option(
+    '--jobs',
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of datasets to prepare concurrently (in separate processes)"
+)
+@click.option(
+    '--ordered/--unordered',
+    help="Report results in input order (rather than as each dataset completes)",
+    default=False
+)
+def main(output, datasets, check_checksum, force_absolute_paths, newer_than, checksum_cache, jobs, ordered):
+    # type: (str, List[str], bool, bool, datetime, Optional[str], int, bool) -> None
 
     output = Path(output)
 
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
                         level=logging.INFO)
 
-    for ds in datasets:
-        ds_path = _normalise_dataset_path(Path(ds))
-        (mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime) = os.stat(ds)
-        create_date = datetime.utcfromtimestamp(ctime)
-        if newer_than and (create_date <= newer_than):
-            logging.info(
-                "Creation time {} older than start date {:%Y-%m-%d %H:%M} ...SKIPPING {}".format(
-                    newer_than - create_date, newer_than, ds_path.name
-                )
-            )
-            continue
-
-        logging.info("Processing %s", ds_path)
-        output_yaml = output / '{}.yaml'.format(_dataset_name(ds_path))
+    if checksum_cache:
+        # (Set in the environment, so it's inherited by worker processes)
+        verify.use_checksum_cache(Path(checksum_cache))
 
-        logging.info("Output %s", output_yaml)
-        if output_yaml.exists():
-            logging.info("Output already exists %s", output_yaml)
-            if check_checksum and yaml_checkums_correctly(output_yaml, ds_path):
-                logging.info("Dataset preparation already done...SKIPPING %s", ds_path.name)
-                continue
+    prepare = partial(
+        _prepare_path_safely,
+        output=output,
+        check_checksum=check_checksum,
+        force_absolute_paths=force_absolute_paths,
+        newer_than=newer_than,
+    )
 
-        prepare_and_write(ds_path, output_yaml, use_absolute_paths=force_absolute_paths)
+    counts = Counter()
+    failures = []
+    for ds, (status, error) in _map_datasets(prepare, datasets, jobs, ordered=ordered):
+        counts[status] += 1
+        if error:
+            failures.append((ds, error))
 
     # delete intermediate MTL files for archive datasets in output folder
     output_mtls = list(output.rglob('*MTL.txt'))
@@ -458,14 +431,111 @@ def main(output, datasets, check_checksum, force_absolute_paths, newer_than):
         except OSError:
             pass
 
+    logging.info(
+        "Prepared %s datasets, skipped %s, %s failures",
+        counts['prepared'], counts['skipped'], counts['failed']
+    )
+    if failures:
+        for ds, error in failures:
+            logging.error("Failed %s: %s", ds, error)
+        sys.exit(1)
+
+
+def _prepare_path(ds, output, check_checksum=False, force_absolute_paths=False, newer_than=None):
+    # type: (str, Path, bool, bool, Optional[datetime]) -> str
+    """
+    Prepare a single input dataset path into the output directory.
+
+    :return: The status: 'prepared' or 'skipped'
+    """
+    inventory = _scan_dataset(Path(ds))
+    ds_path = inventory.base_path
+    # The input path as given, not the normalised dataset path (they differ for MTL and symlinked inputs).
+    create_date = datetime.utcfromtimestamp(os.stat(ds).st_ctime)
+    if newer_than and (create_date <= newer_than):
+        logging.info(
+            "Creation time {} older than start date {:%Y-%m-%d %H:%M} ...SKIPPING {}".format(
+                newer_than - create_date, newer_than, ds_path.name
+            )
+        )
+        return 'skipped'
+
+    logging.info("Processing %s", ds_path)
+    output_yaml = output / '{}.yaml'.format(_dataset_name(ds_path))
+
+    logging.info("Output %s", output_yaml)
+    if output_yaml.exists():
+        logging.info("Output already exists %s", output_yaml)
+        if check_checksum and yaml_checkums_correctly(output_yaml, ds_path):
+            logging.info("Dataset preparation already done...SKIPPING %s", ds_path.name)
+            return 'skipped'
+
+    prepare_and_write(ds_path, output_yaml, use_absolute_paths=force_absolute_paths, inventory=inventory)
+    return 'prepared'
+
+
+def _prepare_path_safely(ds, **kwargs):
+    """
+    Prepare a single input dataset path, catching (and logging) any failure.
+
+    :return: The status ('prepared', 'skipped' or 'failed'), and the error message if failed.
+    """
+    try:
+        return _prepare_path(ds, **kwargs), None
+    except Exception as e:
+        logging.exception("Failed to prepare %s", ds)
+        return 'failed', '{}: {}'.format(type(e).__name__, e)
+
+
+def _map_datasets(prepare, datasets, jobs, ordered=False):
+    # type: (Callable[[str], Tuple[str, Optional[str]]], Iterable[str], int, bool) -> Iterable[Tuple[str, Tuple]]
+    """
+    Prepare each dataset, yielding each dataset and its result.
+
+    With multiple jobs, datasets are prepared in a process pool, with at most twice as many
+    datasets submitted as there are jobs (so that huge dataset lists aren't all queued up front).
+    Results are yielded in input order if `ordered`, otherwise as they complete.
+    """
+    if jobs <= 1:
+        for ds in datasets:
+            yield ds, prepare(ds)
+        return
+
+    max_in_flight = jobs * 2
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for ds in datasets:
+            pending.append((ds, executor.submit(prepare, ds)))
+            while len(pending) >= max_in_flight:
+                yield from _take_results(pending, ordered)
+        while pending:
+            yield from _take_results(pending, ordered)
+
+
+def _take_results(pending, ordered):
+    # type: (deque, bool) -> List[Tuple[str, Tuple]]
+    """
+    Wait for the next result(s) of the pending (dataset, future) pairs, removing them.
+    """
+    if ordered:
+        ds, future = pending.popleft()
+        return [(ds, future.result())]
+
+    done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+    finished = [(ds, future) for ds, future in pending if future in done]
+    for item in finished:
+        pending.remove(item)
+    return [(ds, future.result()) for ds, future in finished]
+
 
 def prepare_and_write(ds_path,
                       output_yaml_path,
                       use_absolute_paths=False,
-                      write_checksum=True):
-    # type: (Path, Path, bool, bool) -> None
+                      write_checksum=True,
+                      inventory=None):
+    # type: (Path, Path, bool, bool, Optional[DatasetInventory]) -> None
 
-    doc = prepare_dataset(ds_path, write_checksum=write_checksum)
+    doc = prepare_dataset(ds_path, write_checksum=write_checksum, inventory=inventory)
 
     if use_absolute_paths:
         for band in doc['image']['bands'].values():
@@ -500,18 +570,26 @@ def _normalise_dataset_path(input_path: Path) -> Path:
     ...
     ValueError: No MTL files within input path .... Not a dataset?
     """
+    return _scan_dataset(input_path).base_path
+
+
+def _scan_dataset(input_path: Path) -> DatasetInventory:
+    """
+    Normalise the dataset path (see `_normalise_dataset_path()`), and scan its files.
+    """
     input_path = normalise_nci_symlinks(input_path)
     if input_path.is_file():
         if '.tar' in input_path.suffixes:
-            return input_path
+            return DatasetInventory.scan(input_path)
         input_path = input_path.parent
 
-    mtl_files = list(input_path.rglob('*_MTL*'))
+    inventory = DatasetInventory.scan(input_path)
+    mtl_files = inventory.glob('*_MTL*')
     if not mtl_files:
         raise ValueError("No MTL files within input path '{}'. Not a dataset?".format(input_path))
     if len(mtl_files) > 1:
         raise ValueError("Multiple MTL files in a single dataset (got path: {})".format(input_path))
-    return input_path
+    return inventory
 
 
 def normalise_nci_symlinks(input_path: Path) -> Path:
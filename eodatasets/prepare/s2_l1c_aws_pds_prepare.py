@@ -18,19 +18,14 @@ example usage:
 """
 from __future__ import absolute_import
 
-import hashlib
 import json
 import logging
 import os
 import uuid
 from pathlib import Path
 from typing import Tuple, List, Dict, Optional
-from xml.etree import ElementTree
 
 import click
-import rasterio
-import rasterio.features
-import shapely.affinity
 import shapely.geometry
 import shapely.ops
 import yaml
@@ -38,6 +33,9 @@ from checksumdir import dirhash
 from osgeo import osr
 from rasterio.errors import RasterioIOError
 
+from eodatasets.metadata.valid_region import FOOTPRINT_METHODS, valid_region_geometry
+from eodatasets.prepare.xmlextract import ATTRIB, ELEMENT, Field, Schema
+
 os.environ["CPL_ZIP_ENCODING"] = "UTF-8"
 SRC_BUCKET = 'sentinel-s2-l1c'
 SRC_REGION = 'eu-central-1'
@@ -49,63 +47,84 @@ PLATFORM_MAPPING = {
     'Sentinel-2B': 'SENTINEL_2B'
 }
 
-
-def safe_valid_region(images, mask_value=None):
+# Fields read from the tile metadata (metadata.xml)
+TILE_SCHEMA = Schema(
+    solar_irradiance=Field('//SOLAR_IRRADIANCE', get=ELEMENT, multiple=True),
+    cloud_coverage=Field('.//*/CLOUDY_PIXEL_PERCENTAGE'),
+    degraded_msi_data_percentage=Field('.//*/DEGRADED_MSI_DATA_PERCENTAGE'),
+    sensing_time=Field('./*/SENSING_TIME'),
+    tile_id=Field('./*/TILE_ID'),
+    datastrip_id=Field('./*/DATASTRIP_ID'),
+    downlink_priority=Field('./*/DOWNLINK_PRIORITY'),
+    station=Field('./*/Archiving_Info/ARCHIVING_CENTRE'),
+    archiving_time=Field('./*/Archiving_Info/ARCHIVING_TIME'),
+    sun_zenith_angle=Field('./*/Tile_Angles/Mean_Sun_Angle/ZENITH_ANGLE'),
+    sun_azimuth_angle=Field('./*/Tile_Angles/Mean_Sun_Angle/AZIMUTH_ANGLE'),
+    viewing_incidence_angles=Field('//Mean_Viewing_Incidence_Angle', get=ELEMENT, multiple=True),
+    cs_code=Field('./*/Tile_Geocoding/HORIZONTAL_CS_CODE'),
+    nrows=Field('./*/Tile_Geocoding/Size[@resolution="10"]/NROWS'),
+    ncols=Field('./*/Tile_Geocoding/Size[@resolution="10"]/NCOLS'),
+    ulx=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULX'),
+    uly=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULY'),
+    xdim=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/XDIM'),
+    ydim=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/YDIM'),
+)
+
+# Fields read from the datastrip metadata. (All single values, so parsing stops once they're found)
+DATASTRIP_SCHEMA = Schema(
+    datatake_id=Field('./*/Datatake_Info', get=ATTRIB),
+    platform=Field('.//*/SPACECRAFT_NAME'),
+    datatake_type=Field('.//*/DATATAKE_TYPE'),
+    datatake_sensing_start=Field('.//*/DATATAKE_SENSING_START'),
+    orbit=Field('.//*/SENSING_ORBIT_NUMBER'),
+    orbit_direction=Field('.//*/SENSING_ORBIT_DIRECTION'),
+    reflectance_conversion=Field('.//*/Reflectance_Conversion/U'),
+    degraded_anc_data_percentage=Field('.//*/DEGRADED_ANC_DATA_PERCENTAGE'),
+    creation_dt=Field('./*/Processing_Info/UTC_DATE_TIME'),
+)
+
+# The report of a quality-check file (in the qi folders)
+QUALITY_REPORT_SCHEMA = Schema(
+    report=Field('.//*/{http://gs2.esa.int/DATA_STRUCTURE/olqcReport}report', get=ATTRIB),
+)
+
+
+def safe_valid_region(images, mask_value=None, **kwargs):
     """
     Safely return valid data region for input images based on mask value and input image path
     """
     try:
-        return valid_region(images, mask_value)
+        return valid_region(images, mask_value, **kwargs)
     except (OSError, RasterioIOError):
         return None
 
 
-def valid_region(images, mask_value=None):
+def valid_region(images, mask_value=None, **kwargs):
     """
     Return valid data region for input images based on mask value and input image path
+
+    Options are those of `valid_region.valid_region_geometry()`, such as:
+
+    - method: Footprint method, one of valid_region.FOOTPRINT_METHODS ('extents' is much faster)
+    - decimation: Read the images at 1/decimation resolution. Powers of two are decoded directly
+      from the JPEG2000 resolution levels, skipping most of the decoding work.
+    - tolerance: Distance (in full-resolution pixels) to buffer and simplify the footprint.
+    - workers, num_threads: Number of bands decoded concurrently, and GDAL decoding threads for each band.
     """
-    mask = None
-    for fname in images:
-        logging.info("Valid regions for %s", fname)
-        # ensure formats match
-        with rasterio.open(str(fname), 'r') as dataset:
-            transform = dataset.transform
-            img = dataset.read(1)
-            if mask_value is not None:
-                new_mask = img & mask_value == mask_value
-            else:
-                new_mask = img != 0
-            if mask is None:
-                mask = new_mask
-            else:
-                mask |= new_mask
-    shapes = rasterio.features.shapes(mask.astype('uint8'), mask=mask)
-    shape = shapely.ops.unary_union([shapely.geometry.shape(shape) for shape, val in shapes if val == 1])
-
-    # convex hull
-    geom = shape.convex_hull
-    # buffer by 1 pixel
-    geom = geom.buffer(1, join_style=3, cap_style=3)
-    # simplify with 1 pixel radius
-    geom = geom.simplify(1)
-    # intersect with image bounding box
-    geom = geom.intersection(shapely.geometry.box(0, 0, mask.shape[1], mask.shape[0]))
-    # transform from pixel space into CRS space
-    geom = shapely.affinity.affine_transform(geom, (transform.a, transform.b, transform.d,
-                                                    transform.e, transform.xoff, transform.yoff))
-    return geom
-
-
-def get_geo_ref_points(root):
+    # Sentinel-2 images have a nodata value of zero (which isn't recorded in the JPEG2000 files)
+    return valid_region_geometry(images, mask_value, nodata=0, **kwargs)
+
+
+def get_geo_ref_points(tile):
     """
-    Returns dictionary of bounding coordinates from given xml
+    Returns dictionary of bounding coordinates from the given tile metadata fields (see TILE_SCHEMA)
     """
-    nrows = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NROWS')[0].text)
-    ncols = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NCOLS')[0].text)
-    ulx = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULX')[0].text)
-    uly = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULY')[0].text)
-    xdim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/XDIM')[0].text)
-    ydim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/YDIM')[0].text)
+    nrows = int(tile['nrows'])
+    ncols = int(tile['ncols'])
+    ulx = int(tile['ulx'])
+    uly = int(tile['uly'])
+    xdim = int(tile['xdim'])
+    ydim = int(tile['ydim'])
     return {
         'ul': {'x': ulx, 'y': uly},
         'ur': {'x': ulx + ncols * abs(xdim), 'y': uly},
@@ -162,11 +181,29 @@ def get_tile_info(path):
         return tile_info.get('path')
 
 
-def prepare_dataset(path, datastrip_path=None):
-    # type: (Path, Optional[Path]) -> List[Dict]
+def get_quality_flag(report_path):
+    # type: (Path) -> Optional[str]
+    """
+    The global status of a quality-check report.
+    """
+    return QUALITY_REPORT_SCHEMA.extract(report_path)['report'].get('globalStatus')
+
+
+def dataset_checksum(path):
+    # type: (Path) -> str
+    """
+    The sha1 checksum of a granule's dataset: a hash of all files in the granule's parent directory.
+    """
+    return dirhash(path.parent, 'sha1')
+
+
+def prepare_dataset(path, datastrip_path=None, checksum_sha1=None, footprint_options=None):
+    # type: (Path, Optional[Path], Optional[str], Optional[Dict]) -> List[Dict]
     """
     :param path: Path to the root of the granule/tile data
     :param datastrip_path: Path to the root of the datastrip metadata
+    :param checksum_sha1: The dataset's checksum, if already calculated (see `dataset_checksum()`)
+    :param footprint_options: Options for calculating the valid data region (see `valid_region()`)
 
     Returns yaml content based on content found at input file path
 
@@ -175,14 +212,15 @@ def prepare_dataset(path, datastrip_path=None):
 
     returns a list of dictionaries containing the metadata for a granule
     """
-    root = ElementTree.parse(path / "metadata.xml").getroot()
+    tile = TILE_SCHEMA.extract(path / "metadata.xml")
     # Set the path to the datastrip metadata to be rooted at the granule
     # for backwards compatibility
     if not datastrip_path:
         datastrip_path = path / 'datastrip'
-    root_datastrip = ElementTree.parse(datastrip_path / 'metadata.xml').getroot()
+    datastrip = DATASTRIP_SCHEMA.extract(datastrip_path / 'metadata.xml')
     size_bytes = sum(os.path.getsize(p) for p in os.scandir(path))
-    checksum_sha1 = dirhash(path.parent, 'sha1')
+    if checksum_sha1 is None:
+        checksum_sha1 = dataset_checksum(path)
 
     # Get the datastrip metadata url and generated a deterministic src uuid
     datastrip_metadata, persisted_uuid = get_datastrip_info(path)
@@ -190,60 +228,36 @@ def prepare_dataset(path, datastrip_path=None):
     # Get the tile path for src information
     tile_path = get_tile_info(path)
 
-    datatake_id = root_datastrip.findall('./*/Datatake_Info')[0].attrib
-    platform = root_datastrip.findall('.//*/SPACECRAFT_NAME')[0].text
+    datatake_id = datastrip['datatake_id']
+    platform = datastrip['platform']
 
     # Update to GA's platform naming convention
     if platform in PLATFORM_MAPPING:
         platform = PLATFORM_MAPPING[platform]
 
-    datatake_type = root_datastrip.findall('.//*/DATATAKE_TYPE')[0].text
-    datatake_sensing_start = root_datastrip.findall('.//*/DATATAKE_SENSING_START')[0].text
-    orbit = root_datastrip.findall('.//*/SENSING_ORBIT_NUMBER')[0].text
-    orbit_direction = root_datastrip.findall('.//*/SENSING_ORBIT_DIRECTION')[0].text
+    datatake_type = datastrip['datatake_type']
+    datatake_sensing_start = datastrip['datatake_sensing_start']
+    orbit = datastrip['orbit']
+    orbit_direction = datastrip['orbit_direction']
     product_format = {
         'name': 's2_aws_pds'
     }
 
-    reflectance_conversion = root_datastrip.findall('.//*/Reflectance_Conversion/U')[0].text
+    reflectance_conversion = datastrip['reflectance_conversion']
     solar_irradiance = []
-    for irradiance in root.iter('SOLAR_IRRADIANCE'):
+    for irradiance in tile['solar_irradiance']:
         band_irradiance = irradiance.attrib
         band_irradiance['value'] = irradiance.text
         solar_irradiance.append(band_irradiance)
-    cloud_coverage = float(root.findall('.//*/CLOUDY_PIXEL_PERCENTAGE')[0].text)
-    degraded_anc_data_percentage = float(root_datastrip.findall('.//*/DEGRADED_ANC_DATA_PERCENTAGE')[0].text)
-    degraded_msi_data_percentage = float(root.findall('.//*/DEGRADED_MSI_DATA_PERCENTAGE')[0].text)
-
-    sensor_quality_flag = (
-        ElementTree.parse(path / 'qi' / 'SENSOR_QUALITY.xml').getroot()
-        .find('.//*/{http://gs2.esa.int/DATA_STRUCTURE/olqcReport}report')
-        .attrib.get('globalStatus')
-    )
-
-    geometric_quality_flag = (
-        ElementTree.parse(path / 'qi' / 'GEOMETRIC_QUALITY.xml').getroot()
-        .find('.//*/{http://gs2.esa.int/DATA_STRUCTURE/olqcReport}report')
-        .attrib.get('globalStatus')
-    )
-
-    general_quality_flag = (
-        ElementTree.parse(path / 'qi' / 'GENERAL_QUALITY.xml').getroot()
-        .find('.//*/{http://gs2.esa.int/DATA_STRUCTURE/olqcReport}report')
-        .attrib.get('globalStatus')
-    )
-
-    format_quality_flag = (
-        ElementTree.parse(path / 'qi' / 'FORMAT_CORRECTNESS.xml').getroot()
-        .find('.//*/{http://gs2.esa.int/DATA_STRUCTURE/olqcReport}report')
-        .attrib.get('globalStatus')
-    )
-
-    radiometric_quality_flag = (
-        ElementTree.parse(path / 'datastrip' / 'qi' / 'RADIOMETRIC_QUALITY_report.xml').getroot()
-        .find('.//*/{http://gs2.esa.int/DATA_STRUCTURE/olqcReport}report')
-        .attrib.get('globalStatus')
-    )
+    cloud_coverage = float(tile['cloud_coverage'])
+    degraded_anc_data_percentage = float(datastrip['degraded_anc_data_percentage'])
+    degraded_msi_data_percentage = float(tile['degraded_msi_data_percentage'])
+
+    sensor_quality_flag = get_quality_flag(path / 'qi' / 'SENSOR_QUALITY.xml')
+    geometric_quality_flag = get_quality_flag(path / 'qi' / 'GEOMETRIC_QUALITY.xml')
+    general_quality_flag = get_quality_flag(path / 'qi' / 'GENERAL_QUALITY.xml')
+    format_quality_flag = get_quality_flag(path / 'qi' / 'FORMAT_CORRECTNESS.xml')
+    radiometric_quality_flag = get_quality_flag(path / 'datastrip' / 'qi' / 'RADIOMETRIC_QUALITY_report.xml')
 
     _imgs_in_directory = [p.name for p in path.glob('B??.jp2')]
     _img_ids = [
@@ -260,34 +274,33 @@ def prepare_dataset(path, datastrip_path=None):
     # Not required for Zip method - uses granule metadata
     img_data_path = path
 
-    sensing_time = root.findall('./*/SENSING_TIME')[0].text
+    sensing_time = tile['sensing_time']
     images_sixty_list = []
     sixty_list = ['B01.jp2', 'B09.jp2', 'B10.jp2']
     for image in images:
         for item in sixty_list:
             if item in image:
                 images_sixty_list.append(img_data_path / image)
-    tile_id = root.findall('./*/TILE_ID')[0].text
+    tile_id = tile['tile_id']
     mgrs_reference = tile_id.split('_')[9]
-    datastrip_id = root.findall('./*/DATASTRIP_ID')[0].text
-    downlink_priority = root.findall('./*/DOWNLINK_PRIORITY')[0].text
-    sensing_time = root.findall('./*/SENSING_TIME')[0].text
-    station = root.findall('./*/Archiving_Info/ARCHIVING_CENTRE')[0].text
-    archiving_time = root.findall('./*/Archiving_Info/ARCHIVING_TIME')[0].text
-    sun_zenith_angle = float(root.findall('./*/Tile_Angles/Mean_Sun_Angle/ZENITH_ANGLE')[0].text)
-    sun_azimuth_angle = float(root.findall('./*/Tile_Angles/Mean_Sun_Angle/AZIMUTH_ANGLE')[0].text)
+    datastrip_id = tile['datastrip_id']
+    downlink_priority = tile['downlink_priority']
+    station = tile['station']
+    archiving_time = tile['archiving_time']
+    sun_zenith_angle = float(tile['sun_zenith_angle'])
+    sun_azimuth_angle = float(tile['sun_azimuth_angle'])
     viewing_zenith_azimuth_angle = []
-    for viewing_incidence in root.iter('Mean_Viewing_Incidence_Angle'):
+    for viewing_incidence in tile['viewing_incidence_angles']:
         view_incidence = viewing_incidence.attrib
         zenith_value = float(viewing_incidence.find('ZENITH_ANGLE').text)
         azimuth_value = float(viewing_incidence.find('AZIMUTH_ANGLE').text)
         view_incidence.update({'unit': 'degree', 'measurement': {'zenith': {'value': zenith_value},
                                                                  'azimith': {'value': azimuth_value}}})
         viewing_zenith_azimuth_angle.append(view_incidence)
-    cs_code = root.findall('./*/Tile_Geocoding/HORIZONTAL_CS_CODE')[0].text
+    cs_code = tile['cs_code']
     spatial_ref = osr.SpatialReference()
     spatial_ref.SetFromUserInput(cs_code)
-    geo_ref_points = get_geo_ref_points(root)
+    geo_ref_points = get_geo_ref_points(tile)
     img_dict = {}
     for image in images:
         img_path = 's3://{src_bucket}/{tile_path}/{image}'.format(
@@ -302,7 +315,7 @@ def prepare_dataset(path, datastrip_path=None):
         'id': str(persisted_uuid),
         'processing_level': 'Level-1C',
         'product_type': 'level1',
-        'creation_dt': root_datastrip.findall('./*/Processing_Info/UTC_DATE_TIME')[0].text,
+        'creation_dt': datastrip['creation_dt'],
         'datatake_id': datatake_id,
         'datatake_type': datatake_type,
         'datatake_sensing_start': datatake_sensing_start,
@@ -332,7 +345,7 @@ def prepare_dataset(path, datastrip_path=None):
                     'coordinates':
                         shapely.geometry.mapping(
                             shapely.ops.unary_union([
-                                safe_valid_region(images_sixty_list)
+                                safe_valid_region(images_sixty_list, **(footprint_options or {}))
 
                             ])
                         )['coordinates'],
@@ -368,8 +381,17 @@ def prepare_dataset(path, datastrip_path=None):
                 type=click.Path(exists=True, readable=True, writable=False),
                 nargs=-1)
 @click.option('--checksum/--no-checksum', help="Checksum the input dataset to confirm match", default=False)
-def main(output, datasets, checksum):
+@click.option('--footprint-method', type=click.Choice(FOOTPRINT_METHODS), default='shapes',
+              help="How to calculate the valid data footprint's convex hull: from the polygonised valid "
+                   "pixels ('shapes'), or from each row's valid extents ('extents': same hull, much faster)")
+@click.option('--footprint-decimation', type=click.IntRange(min=1), default=1,
+              help="Read bands at 1/N resolution to calculate the valid data footprint. "
+                   "Much faster (especially powers of two), but the footprint may be off by a few times N pixels")
+@click.option('--footprint-tolerance', type=click.FloatRange(min=0), default=1.0,
+              help="Distance (in pixels) to buffer and simplify the valid data footprint")
+def main(output, datasets, checksum, footprint_method, footprint_decimation, footprint_tolerance):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+    footprint_options = dict(method=footprint_method, decimation=footprint_decimation, tolerance=footprint_tolerance)
 
     for dataset in datasets:
         (mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime) = os.stat(dataset)
@@ -382,15 +404,17 @@ def main(output, datasets, checksum):
         output_path = Path(output)
         yaml_path = output_path.joinpath(path.name + '.yaml')
         logging.info("Output %s", yaml_path)
+        # Calculated at most once, and reused for the document.
+        checksum_sha1 = None
         if os.path.exists(yaml_path):
             logging.info("Output already exists %s", yaml_path)
             with open(yaml_path) as f:
                 if checksum:
                     logging.info("Running checksum comparison")
+                    checksum_sha1 = dataset_checksum(path)
                     datamap = yaml.safe_load_all(f)
                     for data in datamap:
                         yaml_sha1 = data['checksum_sha1']
-                        checksum_sha1 = hashlib.sha1(open(path, 'rb').read()).hexdigest()
                     if checksum_sha1 == yaml_sha1:
                         logging.info("Dataset preparation already done...SKIPPING")
                         continue
@@ -398,7 +422,7 @@ def main(output, datasets, checksum):
                     logging.info("Dataset preparation already done...SKIPPING")
                     continue
 
-        documents = prepare_dataset(path)
+        documents = prepare_dataset(path, checksum_sha1=checksum_sha1, footprint_options=footprint_options)
         if documents:
             logging.info("Writing %s dataset(s) into %s", len(documents), yaml_path)
             with open(yaml_path, 'w') as stream:
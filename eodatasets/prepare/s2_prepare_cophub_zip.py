@@ -7,77 +7,114 @@ hosted by Australian Copernicus Data Hub - http://www.copernicus.gov.au/
 """
 from __future__ import absolute_import
 
-import hashlib
 import logging
 import os
 import uuid
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Iterable
-from xml.etree import ElementTree
 
 import click
-import rasterio
-import rasterio.features
-import shapely.affinity
 import shapely.geometry
 import shapely.ops
 import yaml
 from osgeo import osr
 from rasterio.errors import RasterioIOError
 
+from eodatasets import verify
+from eodatasets.metadata.valid_region import FOOTPRINT_METHODS, valid_region_geometry
+
 from . import serialise
+from .xmlextract import ATTRIB, ELEMENT, Field, Schema
 
 os.environ["CPL_ZIP_ENCODING"] = "UTF-8"
 
 ESA_UUID_NAMESPACE = uuid.UUID('5138b9d8-ecd9-41f7-8602-3a295daeeee4')
 
-
-def safe_valid_region(images, mask_value=None):
+# Older (PDMC) archives contain many granules, each needing its own valid data region.
+DEFAULT_GRANULE_WORKERS = min(4, os.cpu_count() or 1)
+
+_QA_INSPECTIONS = './*/Quality_Control_Checks/Quality_Inspections'
+
+# Fields read from the product metadata (MTD_MSIL1C.xml)
+PRODUCT_SCHEMA = Schema(
+    product_start_time=Field('./*/Product_Info/PRODUCT_START_TIME'),
+    product_stop_time=Field('./*/Product_Info/PRODUCT_STOP_TIME'),
+    product_uri=Field('./*/Product_Info/PRODUCT_URI'),
+    level=Field('./*/Product_Info/PROCESSING_LEVEL'),
+    product_type=Field('./*/Product_Info/PRODUCT_TYPE'),
+    processing_baseline=Field('./*/Product_Info/PROCESSING_BASELINE'),
+    ct_time=Field('./*/Product_Info/GENERATION_TIME'),
+    datatake_id=Field('./*/Product_Info/Datatake', get=ATTRIB),
+    platform=Field('./*/Product_Info/*/SPACECRAFT_NAME'),
+    datatake_type=Field('./*/Product_Info/*/DATATAKE_TYPE'),
+    datatake_sensing_start=Field('./*/Product_Info/*/DATATAKE_SENSING_START'),
+    orbit=Field('./*/Product_Info/*/SENSING_ORBIT_NUMBER'),
+    orbit_direction=Field('./*/Product_Info/*/SENSING_ORBIT_DIRECTION'),
+    product_format=Field('./*/Product_Info/*/PRODUCT_FORMAT'),
+    granules=Field('./*/Product_Info/Product_Organisation/Granule_List/Granules', get=ELEMENT, multiple=True),
+    granule=Field('./*/Product_Info/Product_Organisation/Granule_List/Granule', get=ELEMENT, multiple=True),
+    special_values=Field('./*/Product_Image_Characteristics/Special_Values/SPECIAL_VALUE_INDEX', multiple=True),
+    reflectance_conversion=Field('./*/Product_Image_Characteristics/Reflectance_Conversion/U'),
+    solar_irradiance=Field('//SOLAR_IRRADIANCE', get=ELEMENT, multiple=True),
+    cloud_coverage=Field('./*/Cloud_Coverage_Assessment'),
+    degraded_anc_data_percentage=Field('./*/Technical_Quality_Assessment/DEGRADED_ANC_DATA_PERCENTAGE'),
+    degraded_msi_data_percentage=Field('./*/Technical_Quality_Assessment/DEGRADED_MSI_DATA_PERCENTAGE'),
+    sensor_quality_flag=Field(_QA_INSPECTIONS + '/SENSOR_QUALITY_FLAG', optional=True),
+    general_quality_flag=Field(_QA_INSPECTIONS + '/GENERAL_QUALITY_FLAG', optional=True),
+    geometric_quality_flag=Field(_QA_INSPECTIONS + '/GEOMETRIC_QUALITY_FLAG', optional=True),
+    format_quality_flag=Field(_QA_INSPECTIONS + '/FORMAT_CORRECTNESS_FLAG', optional=True),
+    radiometric_quality_flag=Field(_QA_INSPECTIONS + '/RADIOMETRIC_QUALITY_FLAG', optional=True),
+)
+
+# Fields read from each granule's tile metadata (MTD_TL.xml)
+TILE_SCHEMA = Schema(
+    sensing_time=Field('./*/SENSING_TIME'),
+    qi_band=Field('./*/PVI_FILENAME'),
+    tile_id=Field('./*/TILE_ID'),
+    datastrip_id=Field('./*/DATASTRIP_ID'),
+    downlink_priority=Field('./*/DOWNLINK_PRIORITY'),
+    station=Field('./*/Archiving_Info/ARCHIVING_CENTRE'),
+    archiving_time=Field('./*/Archiving_Info/ARCHIVING_TIME'),
+    sun_zenith_angle=Field('./*/Tile_Angles/Mean_Sun_Angle/ZENITH_ANGLE'),
+    sun_azimuth_angle=Field('./*/Tile_Angles/Mean_Sun_Angle/AZIMUTH_ANGLE'),
+    viewing_incidence_angles=Field('//Mean_Viewing_Incidence_Angle', get=ELEMENT, multiple=True),
+    cs_code=Field('./*/Tile_Geocoding/HORIZONTAL_CS_CODE'),
+    nrows=Field('./*/Tile_Geocoding/Size[@resolution="10"]/NROWS'),
+    ncols=Field('./*/Tile_Geocoding/Size[@resolution="10"]/NCOLS'),
+    ulx=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULX'),
+    uly=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULY'),
+    xdim=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/XDIM'),
+    ydim=Field('./*/Tile_Geocoding/Geoposition[@resolution="10"]/YDIM'),
+)
+
+
+def safe_valid_region(images, mask_value=None, **kwargs):
     """
     Safely return valid data region for input images based on mask value and input image path
     """
     try:
-        return valid_region(images, mask_value)
+        return valid_region(images, mask_value, **kwargs)
     except (OSError, RasterioIOError):
         return None
 
 
-def valid_region(images, mask_value=None):
+def valid_region(images, mask_value=None, **kwargs):
     """
     Return valid data region for input images based on mask value and input image path
+
+    Options are those of `valid_region.valid_region_geometry()`, such as:
+
+    - method: Footprint method, one of valid_region.FOOTPRINT_METHODS ('extents' is much faster)
+    - decimation: Read the images at 1/decimation resolution. Powers of two are decoded directly
+      from the JPEG2000 resolution levels, skipping most of the decoding work.
+    - tolerance: Distance (in full-resolution pixels) to buffer and simplify the footprint.
+    - workers, num_threads: Number of bands decoded concurrently, and GDAL decoding threads for each band.
     """
-    mask = None
-    for fname in images:
-        logging.info("Valid regions for %s", fname)
-        # ensure formats match
-        with rasterio.open(str(fname), 'r') as dataset:
-            transform = dataset.transform
-            img = dataset.read(1)
-            if mask_value is not None:
-                new_mask = img & mask_value == mask_value
-            else:
-                new_mask = img != 0
-            if mask is None:
-                mask = new_mask
-            else:
-                mask |= new_mask
-    shapes = rasterio.features.shapes(mask.astype('uint8'), mask=mask)
-    shape = shapely.ops.unary_union([shapely.geometry.shape(shape) for shape, val in shapes if val == 1])
-    type(shapes)
-    # convex hull
-    geom = shape.convex_hull
-    # buffer by 1 pixel
-    geom = geom.buffer(1, join_style=3, cap_style=3)
-    # simplify with 1 pixel radius
-    geom = geom.simplify(1)
-    # intersect with image bounding box
-    geom = geom.intersection(shapely.geometry.box(0, 0, mask.shape[1], mask.shape[0]))
-    # transform from pixel space into CRS space
-    geom = shapely.affinity.affine_transform(geom, (transform.a, transform.b, transform.d,
-                                                    transform.e, transform.xoff, transform.yoff))
-    return geom
+    # Sentinel-2 images have a nodata value of zero (which isn't recorded in the JPEG2000 files)
+    return valid_region_geometry(images, mask_value, nodata=0, **kwargs)
 
 
 def _to_lists(x):
@@ -89,16 +126,16 @@ def _to_lists(x):
     return x
 
 
-def get_geo_ref_points(root):
+def get_geo_ref_points(tile):
     """
-    Returns dictionary of bounding coordinates from given xml
+    Returns dictionary of bounding coordinates from the given tile metadata fields (see TILE_SCHEMA)
     """
-    nrows = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NROWS')[0].text)
-    ncols = int(root.findall('./*/Tile_Geocoding/Size[@resolution="10"]/NCOLS')[0].text)
-    ulx = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULX')[0].text)
-    uly = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/ULY')[0].text)
-    xdim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/XDIM')[0].text)
-    ydim = int(root.findall('./*/Tile_Geocoding/Geoposition[@resolution="10"]/YDIM')[0].text)
+    nrows = int(tile['nrows'])
+    ncols = int(tile['ncols'])
+    ulx = int(tile['ulx'])
+    uly = int(tile['uly'])
+    xdim = int(tile['xdim'])
+    ydim = int(tile['ydim'])
     return {
         'ul': {'x': ulx, 'y': uly},
         'ur': {'x': ulx + ncols * abs(xdim), 'y': uly},
@@ -121,9 +158,13 @@ def get_coords(geo_ref_points, spatial_ref):
     return {key: transform(p) for key, p in geo_ref_points.items()}
 
 
-def prepare_dataset(path):
+def prepare_dataset(path, checksum_sha1=None, footprint_options=None, granule_workers=DEFAULT_GRANULE_WORKERS):
     """
     Returns yaml content based on content found at input file path
+
+    :param checksum_sha1: The sha1 of the input zip, if already calculated.
+    :param footprint_options: Options for calculating the valid data region (see `valid_region()`)
+    :param granule_workers: Number of granules to prepare concurrently (one document per granule, in order)
     """
     if path.suffix == '.zip':
         z = zipfile.ZipFile(str(path))
@@ -138,14 +179,15 @@ def prepare_dataset(path):
             pattern = pattern.replace('PRD_MSIL1C', 'MTD_SAFL1C')
             pattern = pattern.replace('.zip', '.xml')
             xmlzipfiles = [s for s in z.namelist() if pattern in s]
-        mtd_xml = z.read(xmlzipfiles[0])
-        root = ElementTree.XML(mtd_xml)
-        checksum_sha1 = hashlib.sha1(open(str(path), 'rb').read()).hexdigest()
+        with z.open(xmlzipfiles[0]) as mtd_xml:
+            product = PRODUCT_SCHEMA.extract(mtd_xml)
+        if checksum_sha1 is None:
+            checksum_sha1 = verify.calculate_file_sha1(path)
         size_bytes = os.path.getsize(str(path))
     else:
-        root = ElementTree.parse(str(path)).getroot()
-    product_start_time = root.findall('./*/Product_Info/PRODUCT_START_TIME')[0].text
-    product_stop_time = root.findall('./*/Product_Info/PRODUCT_STOP_TIME')[0].text
+        product = PRODUCT_SCHEMA.extract(path)
+    product_start_time = product['product_start_time']
+    product_stop_time = product['product_stop_time']
     # Looks like sometimes the stop time is before the start time....maybe just set them to be the same
     start_time = datetime.strptime(product_start_time, "%Y-%m-%dT%H:%M:%S.%fZ")
     stop_time = datetime.strptime(product_stop_time, "%Y-%m-%dT%H:%M:%S.%fZ")
@@ -153,64 +195,58 @@ def prepare_dataset(path):
         dummy = product_stop_time
         product_stop_time = product_start_time
         product_start_time = dummy
-    product_uri = Path(root.findall('./*/Product_Info/PRODUCT_URI')[0].text)
-    level = root.findall('./*/Product_Info/PROCESSING_LEVEL')[0].text
-    product_type = root.findall('./*/Product_Info/PRODUCT_TYPE')[0].text
-    processing_baseline = root.findall('./*/Product_Info/PROCESSING_BASELINE')[0].text
-    ct_time = root.findall('./*/Product_Info/GENERATION_TIME')[0].text
-    datatake_id = root.findall('./*/Product_Info/Datatake')[0].attrib
-    platform = root.findall('./*/Product_Info/*/SPACECRAFT_NAME')[0].text
-    datatake_type = root.findall('./*/Product_Info/*/DATATAKE_TYPE')[0].text
-    datatake_sensing_start = root.findall('./*/Product_Info/*/DATATAKE_SENSING_START')[0].text
-    orbit = root.findall('./*/Product_Info/*/SENSING_ORBIT_NUMBER')[0].text
-    orbit_direction = root.findall('./*/Product_Info/*/SENSING_ORBIT_DIRECTION')[0].text
-    product_format = root.findall('./*/Product_Info/*/PRODUCT_FORMAT')[0].text
+    product_uri = Path(product['product_uri'])
+    level = product['level']
+    product_type = product['product_type']
+    processing_baseline = product['processing_baseline']
+    ct_time = product['ct_time']
+    datatake_id = product['datatake_id']
+    platform = product['platform']
+    datatake_type = product['datatake_type']
+    datatake_sensing_start = product['datatake_sensing_start']
+    orbit = product['orbit']
+    orbit_direction = product['orbit_direction']
+    product_format = product['product_format']
     if product_format == 'SAFE':
         product_format = 'SAFE_COMPACT'
-    null = root.findall('./*/Product_Image_Characteristics/Special_Values/SPECIAL_VALUE_INDEX')[0].text
-    saturated = root.findall('./*/Product_Image_Characteristics/Special_Values/SPECIAL_VALUE_INDEX')[1].text
-    reflectance_conversion = root.findall('./*/Product_Image_Characteristics/Reflectance_Conversion/U')[0].text
+    null = product['special_values'][0]
+    saturated = product['special_values'][1]
+    reflectance_conversion = product['reflectance_conversion']
     solar_irradiance = []
-    for irradiance in root.iter('SOLAR_IRRADIANCE'):
+    for irradiance in product['solar_irradiance']:
         band_irradiance = irradiance.attrib
         band_irradiance['value'] = irradiance.text
         solar_irradiance.append(band_irradiance)
-    cloud_coverage = float(root.findall('./*/Cloud_Coverage_Assessment')[0].text)
-    degraded_anc_data_percentage = float(
-        root.findall('./*/Technical_Quality_Assessment/DEGRADED_ANC_DATA_PERCENTAGE')[0].text
-    )
-    degraded_msi_data_percentage = float(
-        root.findall('./*/Technical_Quality_Assessment/DEGRADED_MSI_DATA_PERCENTAGE')[0].text
-    )
-    try:
-        qa_inspections_offset = './*/Quality_Control_Checks/Quality_Inspections'
-        sensor_quality_flag = root.findall(qa_inspections_offset + '/SENSOR_QUALITY_FLAG')[0].text
-        general_quality_flag = root.findall(qa_inspections_offset + '/GENERAL_QUALITY_FLAG')[0].text
-        geometric_quality_flag = root.findall(qa_inspections_offset + '/GEOMETRIC_QUALITY_FLAG')[0].text
-        format_quality_flag = root.findall(qa_inspections_offset + '/FORMAT_CORRECTNESS_FLAG')[0].text
-        radiometric_quality_flag = root.findall(qa_inspections_offset + '/RADIOMETRIC_QUALITY_FLAG')[0].text
-    except IndexError:
-        sensor_quality_flag = ""
-        general_quality_flag = ""
-        geometric_quality_flag = ""
-        format_quality_flag = ""
-        radiometric_quality_flag = ""
+    cloud_coverage = float(product['cloud_coverage'])
+    degraded_anc_data_percentage = float(product['degraded_anc_data_percentage'])
+    degraded_msi_data_percentage = float(product['degraded_msi_data_percentage'])
+    quality_flags = [
+        product['sensor_quality_flag'],
+        product['general_quality_flag'],
+        product['geometric_quality_flag'],
+        product['format_quality_flag'],
+        product['radiometric_quality_flag'],
+    ]
+    if None in quality_flags:
+        quality_flags = [""] * len(quality_flags)
+    (sensor_quality_flag, general_quality_flag, geometric_quality_flag,
+     format_quality_flag, radiometric_quality_flag) = quality_flags
     # Assume multiple granules
     single_granule_archive = False
     granules = {granule.get('granuleIdentifier'): [imid.text for imid in granule.findall('IMAGE_ID')]
-                for granule in root.findall('./*/Product_Info/Product_Organisation/Granule_List/Granules')}
+                for granule in product['granules']}
     if not granules:
         single_granule_archive = True
         granules = {granule.get('granuleIdentifier'): [imid.text for imid in granule.findall('IMAGE_FILE')]
-                    for granule in root.findall('./*/Product_Info/Product_Organisation/Granule_List/Granule')}
+                    for granule in product['granule']}
         if not [] in granules.values():
             single_granule_archive = True
         else:
             granules = {granule.get('granuleIdentifier'): [imid.text for imid in granule.findall('IMAGE_ID')]
-                        for granule in root.findall('./*/Product_Info/Product_Organisation/Granule_List/Granule')}
+                        for granule in product['granule']}
             single_granule_archive = False
-    documents = []
-    for granule_id, images in granules.items():
+
+    def prepare_granule(granule_id, images):
         images_ten_list = []
         images_twenty_list = []
         images_sixty_list = []
@@ -218,23 +254,26 @@ def prepare_dataset(path):
         img_data_path = str(path.parent.joinpath('GRANULE', granule_id, 'IMG_DATA'))
         if not path.suffix == '.zip':
             gran_path = str(path.parent.joinpath('GRANULE', granule_id, granule_id[:-7].replace('MSI', 'MTD') + '.xml'))
-            root = ElementTree.parse(gran_path).getroot()
+            tile = TILE_SCHEMA.extract(gran_path)
         else:
-            xmlzipfiles = [s for s in z.namelist() if 'MTD_TL.xml' in s]
-            if xmlzipfiles == []:
-                pattern = granule_id.replace('MSI', 'MTD')
-                pattern = pattern.replace('_N' + processing_baseline, '.xml')
-                xmlzipfiles = [s for s in z.namelist() if pattern in s]
-            mtd_xml = z.read(xmlzipfiles[0])
-            root = ElementTree.XML(mtd_xml)
+            # Granules may be prepared concurrently, so each opens the zip with its own handle.
+            with zipfile.ZipFile(str(path)) as granule_zip:
+                names = granule_zip.namelist()
+                xmlzipfiles = [s for s in names if 'MTD_TL.xml' in s]
+                if xmlzipfiles == []:
+                    pattern = granule_id.replace('MSI', 'MTD')
+                    pattern = pattern.replace('_N' + processing_baseline, '.xml')
+                    xmlzipfiles = [s for s in names if pattern in s]
+                with granule_zip.open(xmlzipfiles[0]) as mtd_xml:
+                    tile = TILE_SCHEMA.extract(mtd_xml)
             img_data_path = str(path) + '!/'
-            img_data_path = 'zip://' + img_data_path + str(z.namelist()[0])
+            img_data_path = 'zip://' + img_data_path + str(names[0])
             # for earlier versions of zip archive - use GRANULES
             if single_granule_archive is False:
                 img_data_path = img_data_path + str(Path('GRANULE').joinpath(granule_id, 'IMG_DATA'))
-        sensing_time = root.findall('./*/SENSING_TIME')[0].text
+        sensing_time = tile['sensing_time']
         # Add the QA band
-        qi_band = root.findall('./*/PVI_FILENAME')[0].text
+        qi_band = tile['qi_band']
         qi_band = qi_band.replace('.jp2', '')
         images.append(qi_band)
         for image in images:
@@ -250,27 +289,26 @@ def prepare_dataset(path):
             for item in sixty_list:
                 if item in image:
                     images_sixty_list.append(os.path.join(img_data_path, image + ".jp2"))
-        tile_id = root.findall('./*/TILE_ID')[0].text
+        tile_id = tile['tile_id']
         mgrs_reference = tile_id.split('_')[9]
-        datastrip_id = root.findall('./*/DATASTRIP_ID')[0].text
-        downlink_priority = root.findall('./*/DOWNLINK_PRIORITY')[0].text
-        sensing_time = root.findall('./*/SENSING_TIME')[0].text
-        station = root.findall('./*/Archiving_Info/ARCHIVING_CENTRE')[0].text
-        archiving_time = root.findall('./*/Archiving_Info/ARCHIVING_TIME')[0].text
-        sun_zenith_angle = float(root.findall('./*/Tile_Angles/Mean_Sun_Angle/ZENITH_ANGLE')[0].text)
-        sun_azimuth_angle = float(root.findall('./*/Tile_Angles/Mean_Sun_Angle/AZIMUTH_ANGLE')[0].text)
+        datastrip_id = tile['datastrip_id']
+        downlink_priority = tile['downlink_priority']
+        station = tile['station']
+        archiving_time = tile['archiving_time']
+        sun_zenith_angle = float(tile['sun_zenith_angle'])
+        sun_azimuth_angle = float(tile['sun_azimuth_angle'])
         viewing_zenith_azimuth_angle = []
-        for viewing_incidence in root.iter('Mean_Viewing_Incidence_Angle'):
+        for viewing_incidence in tile['viewing_incidence_angles']:
             view_incidence = viewing_incidence.attrib
             zenith_value = float(viewing_incidence.find('ZENITH_ANGLE').text)
             azimuth_value = float(viewing_incidence.find('AZIMUTH_ANGLE').text)
             view_incidence.update({'unit': 'degree', 'measurement': {'zenith': {'value': zenith_value},
                                                                      'azimith': {'value': azimuth_value}}})
             viewing_zenith_azimuth_angle.append(view_incidence)
-        cs_code = root.findall('./*/Tile_Geocoding/HORIZONTAL_CS_CODE')[0].text
+        cs_code = tile['cs_code']
         spatial_ref = osr.SpatialReference()
         spatial_ref.SetFromUserInput(cs_code)
-        geo_ref_points = get_geo_ref_points(root)
+        geo_ref_points = get_geo_ref_points(tile)
         img_dict = {}
         for image in images:
             if image[-3:] in ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B08', 'B8A', 'B09', 'B10', 'B11', 'B12',
@@ -282,7 +320,7 @@ def prepare_dataset(path):
                 img_path = img_path.replace('IMG_DATA', 'QI_DATA')
                 band_label = 'PVI'
             img_dict[band_label] = {'path': img_path, 'layer': 1}
-        documents.append({
+        return {
             'id': str(uuid.uuid5(ESA_UUID_NAMESPACE, path.name)),
             'processing_level': level,
             'product_type': product_type,
@@ -320,7 +358,7 @@ def prepare_dataset(path):
                         'coordinates': _to_lists(
                             shapely.geometry.mapping(
                                 shapely.ops.unary_union([
-                                    safe_valid_region(images_sixty_list)
+                                    safe_valid_region(images_sixty_list, **(footprint_options or {}))
 
                                 ])
                             )['coordinates']),
@@ -348,8 +386,25 @@ def prepare_dataset(path):
             },
 
             'lineage': {'source_datasets': {}},
-        })
-    return documents
+        }
+
+    return _map_granules(prepare_granule, granules.items(), workers=granule_workers)
+
+
+def _map_granules(prepare_granule, granules, workers=1):
+    """
+    Prepare each (granule_id, images) pair using up to `workers` threads.
+
+    Granule documents are returned in the same order as the granules, regardless of which finish first.
+
+    (Most of the work is decoding images for the valid data region, during which GDAL releases the GIL.)
+    """
+    granules = list(granules)
+    if workers <= 1 or len(granules) <= 1:
+        return [prepare_granule(granule_id, images) for granule_id, images in granules]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(granules))) as executor:
+        return list(executor.map(prepare_granule, *zip(*granules)))
 
 
 def absolutify_paths(doc, path):
@@ -371,7 +426,12 @@ def archive_yaml(yaml_path, output):
     os.rename(yaml_path, (os.path.join(archive_path, os.path.basename(yaml_path))))
 
 
-def _process_datasets(output_dir: Path, datasets: Iterable[Path], do_checksum: bool, newer_than: datetime):
+def _process_datasets(output_dir: Path,
+                      datasets: Iterable[Path],
+                      do_checksum: bool,
+                      newer_than: datetime,
+                      footprint_options: dict = None,
+                      granule_workers: int = DEFAULT_GRANULE_WORKERS):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
     for dataset_path in datasets:
@@ -388,15 +448,17 @@ def _process_datasets(output_dir: Path, datasets: Iterable[Path], do_checksum: b
             output_path = Path(output_dir)
             yaml_path = output_path.joinpath(dataset_path.name + '.yaml')
             logging.info("Output %s", yaml_path)
+            # Calculated at most once, and reused for the document.
+            checksum_sha1 = None
             if os.path.exists(str(yaml_path)):
                 logging.info("Output already exists %s", yaml_path)
                 with open(str(yaml_path)) as f:
                     if do_checksum:
                         logging.info("Running checksum comparison")
+                        checksum_sha1 = verify.calculate_file_sha1(dataset_path)
                         datamap = yaml.load_all(f)
                         for data in datamap:
                             yaml_sha1 = data['checksum_sha1']
-                            checksum_sha1 = hashlib.sha1(dataset_path.open('rb').read()).hexdigest()
                         if checksum_sha1 == yaml_sha1:
                             logging.info("Dataset preparation already done...SKIPPING")
                             continue
@@ -406,7 +468,9 @@ def _process_datasets(output_dir: Path, datasets: Iterable[Path], do_checksum: b
                     else:
                         logging.info("Dataset preparation already done...SKIPPING")
                         continue
-            documents = prepare_dataset(dataset_path)
+            documents = prepare_dataset(dataset_path, checksum_sha1=checksum_sha1,
+                                        footprint_options=footprint_options,
+                                        granule_workers=granule_workers)
             if documents:
                 logging.info("Writing %s dataset(s) into %s", len(documents), yaml_path)
                 with open(str(yaml_path), 'w') as stream:
@@ -442,11 +506,26 @@ example usage:
 @click.option('--checksum/--no-checksum', help="Checksum the input dataset to confirm match", default=False)
 @click.option('--newer-than', 'date', type=serialise.ClickDatetime(), default=datetime.now(),
               help="Enter file creation start date for data preparation")
-def main(output_dir, datasets, checksum, date, dataset_listing_files):
-    # type: (str, Iterable[str], bool, datetime, Iterable[str]) -> None
+@click.option('--footprint-method', type=click.Choice(FOOTPRINT_METHODS), default='shapes',
+              help="How to calculate the valid data footprint's convex hull: from the polygonised valid "
+                   "pixels ('shapes'), or from each row's valid extents ('extents': same hull, much faster)")
+@click.option('--footprint-decimation', type=click.IntRange(min=1), default=1,
+              help="Read bands at 1/N resolution to calculate the valid data footprint. "
+                   "Much faster (especially powers of two), but the footprint may be off by a few times N pixels")
+@click.option('--footprint-tolerance', type=click.FloatRange(min=0), default=1.0,
+              help="Distance (in pixels) to buffer and simplify the valid data footprint")
+@click.option('--granule-workers', type=click.IntRange(min=1), default=DEFAULT_GRANULE_WORKERS,
+              help="Number of granules to prepare concurrently (for multi-granule archives)")
+def main(output_dir, datasets, checksum, date, dataset_listing_files, footprint_method, footprint_decimation,
+         footprint_tolerance, granule_workers):
+    # type: (str, Iterable[str], bool, datetime, Iterable[str], str, int, float, int) -> None
 
     datasets = [Path(p) for p in datasets]
     for listing_file in dataset_listing_files:
         datasets.extend(_read_paths_from_file(Path(listing_file)))
 
-    return _process_datasets(Path(output_dir), datasets, checksum, date)
+    return _process_datasets(Path(output_dir), datasets, checksum, date,
+                             footprint_options=dict(method=footprint_method,
+                                                    decimation=footprint_decimation,
+                                                    tolerance=footprint_tolerance),
+                             granule_workers=granule_workers)
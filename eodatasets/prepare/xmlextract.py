@@ -0,0 +1,257 @@
+"""
+Extract a fixed set of fields from an XML document in a single streaming pass.
+
+Rather than parsing a whole document into a tree and then searching it again for each field
+(with many `findall()` calls), a schema of all required fields is compiled once, and matched against
+each element as the document is parsed. Parsing stops early once every field has been found.
+
+Paths use the subset of ElementTree's syntax that our metadata scripts need:
+
+    './*/Product_Info/PRODUCT_URI'          children, from the root ('*' matches any tag)
+    './/*/SPACECRAFT_NAME'                  './/' matches any (grand)parents below the root
+    './*/Size[@resolution="10"]/NROWS'      attribute predicates
+    '//SOLAR_IRRADIANCE'                    any element with the tag, including the root (like `root.iter()`)
+"""
+import re
+from typing import Dict, IO, List, NamedTuple, Tuple, Union
+from xml.etree import ElementTree
+
+from pathlib import Path
+
+# What to return for each matching element
+TEXT = 'text'
+ATTRIB = 'attrib'
+# The element itself, with its children.
+ELEMENT = 'element'
+
+# Path separators, except within namespaces (such as "{http://gs2.esa.int/DATA_STRUCTURE/olqcReport}report")
+_STEPS_RE = re.compile(r'(?:\{[^}]*\}|[^/])+')
+_STEP_RE = re.compile(r'^(?P<tag>[^\[]+)(?:\[@(?P<attr>[\w:]+)="(?P<value>[^"]*)"\])?$')
+
+
+class Field(NamedTuple):
+    path: str
+    get: str = TEXT
+    # Return all matches, as a list. (otherwise the first)
+    multiple: bool = False
+    # If a single field isn't found, return None rather than failing.
+    optional: bool = False
+
+
+class _Step(NamedTuple):
+    tag: str
+    attr: Tuple[str, str] = None
+
+    def matches(self, tag, attrib):
+        if self.tag != '*' and self.tag != tag:
+            return False
+        return self.attr is None or attrib.get(self.attr[0]) == self.attr[1]
+
+
+class _Pattern(NamedTuple):
+    name: str
+    field: Field
+    steps: List[_Step]
+    # Minimum depth of a matching element (the root is depth 0)
+    min_depth: int
+    # Otherwise the element must be at exactly min_depth.
+    any_depth: bool
+
+    def matches(self, stack):
+        depth = len(stack) - 1
+        if depth < self.min_depth or (depth > self.min_depth and not self.any_depth):
+            return False
+        return all(
+            step.matches(tag, attrib)
+            for step, (tag, attrib) in zip(reversed(self.steps), reversed(stack))
+        )
+
+
+class Schema(object):
+    """
+    A compiled set of named fields to extract.
+
+    >>> schema = Schema(
+    ...     uri=Field('./*/Info/URI'),
+    ...     rows=Field('./*/Size[@resolution="10"]/NROWS'),
+    ...     bands=Field('//BAND', get=ATTRIB, multiple=True),
+    ...     missing=Field('.//*/MISSING', optional=True),
+    ... )
+    >>> import io
+    >>> schema.extract(io.BytesIO(b'''<Doc><General><Info><URI>a.zip</URI></Info>
+    ...     <Size resolution="20"><NROWS>5</NROWS></Size><Size resolution="10"><NROWS>10</NROWS></Size>
+    ...     </General><BAND id="1"/><BAND id="2"/></Doc>'''))
+    {'uri': 'a.zip', 'rows': '10', 'bands': [{'id': '1'}, {'id': '2'}], 'missing': None}
+    >>> schema.extract(io.BytesIO(b'<Doc/>'))
+    Traceback (most recent call last):
+    ...
+    ValueError: No element './*/Info/URI' (for uri) in document
+    """
+
+    def __init__(self, **fields: Field):
+        self.fields = fields
+        self._patterns_by_tag = {}
+        for name, field in fields.items():
+            pattern = _compile(name, field)
+            self._patterns_by_tag.setdefault(pattern.steps[-1].tag, []).append(pattern)
+
+        self._wildcard_patterns = self._patterns_by_tag.pop('*', [])
+
+        # We can only stop early if we're not collecting every match of any field.
+        self.can_finish_early = not any(f.multiple for f in fields.values())
+
+    def extract(self, source: Union[str, Path, IO]) -> Dict:
+        """
+        Extract the fields from the given document (a path or open binary file).
+
+        :raises ValueError: if a (non-optional) single field isn't found.
+        """
+        extraction = _Extraction(self)
+        parser = ElementTree.XMLParser(target=extraction)
+        try:
+            if isinstance(source, (str, Path)):
+                with open(str(source), 'rb') as f:
+                    _feed(parser, f)
+            else:
+                _feed(parser, source)
+            parser.close()
+        except _Finished:
+            pass
+
+        found = extraction.found
+        for name, field in self.fields.items():
+            if name not in found:
+                if not field.optional:
+                    raise ValueError("No element {!r} (for {}) in document".format(field.path, name))
+                found[name] = None
+        return {name: found[name] for name in self.fields}
+
+    def matching_patterns(self, stack):
+        """
+        The patterns matched by the last element of the stack (a list of (tag, attrib) from the root)
+        """
+        candidates = self._patterns_by_tag.get(stack[-1][0], ())
+        if self._wildcard_patterns:
+            candidates = list(candidates) + self._wildcard_patterns
+        return [pattern for pattern in candidates if pattern.matches(stack)]
+
+
+class _Finished(Exception):
+    pass
+
+
+class _Extraction(object):
+    """
+    An XMLParser target that collects a schema's fields as the document is parsed.
+
+    No tree is built, other than for the elements of ELEMENT fields.
+    """
+
+    def __init__(self, schema: Schema):
+        self.schema = schema
+        self.found = {name: [] for name, field in schema.fields.items() if field.multiple}
+        self.remaining = len(schema.fields) - len(self.found)
+
+        # The (tag, attrib) of each element from the root to the current element.
+        self.stack = []
+        # For each of those elements: the fields it matched, and its text (collected only if needed).
+        self.matches = []
+        # The text of the current element, if needed, and we're still before its first child.
+        self.text = None
+
+        # Builds the tree of an element we're keeping whole (an ELEMENT field), if within one.
+        self.builder = None
+        self.builder_depth = None
+
+    def start(self, tag, attrib):
+        self.stack.append((tag, attrib))
+
+        patterns = self.schema.matching_patterns(self.stack)
+        if not patterns:
+            self.matches.append(None)
+            self.text = None
+        else:
+            self.text = [] if any(p.field.get == TEXT for p in patterns) else None
+            self.matches.append((patterns, self.text))
+            if self.builder is None and any(p.field.get == ELEMENT for p in patterns):
+                self.builder = ElementTree.TreeBuilder()
+                self.builder_depth = len(self.stack)
+
+        if self.builder is not None:
+            self.builder.start(tag, attrib)
+
+    def data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+        if self.builder is not None:
+            self.builder.data(data)
+
+    def end(self, tag):
+        # Any further data is the tail of this element, not text of its parent.
+        self.text = None
+
+        element = None
+        if self.builder is not None:
+            element = self.builder.end(tag)
+            if len(self.stack) == self.builder_depth:
+                self.builder = None
+
+        _, attrib = self.stack.pop()
+        matched = self.matches.pop()
+        if matched is None:
+            return
+
+        patterns, text = matched
+        for pattern in patterns:
+            get = pattern.field.get
+            if get == TEXT:
+                value = ''.join(text) if text else None
+            elif get == ATTRIB:
+                value = dict(attrib)
+            else:
+                value = element
+
+            if pattern.field.multiple:
+                self.found[pattern.name].append(value)
+            elif pattern.name not in self.found:
+                self.found[pattern.name] = value
+                self.remaining -= 1
+
+        if self.remaining == 0 and self.schema.can_finish_early:
+            raise _Finished()
+
+    def close(self):
+        pass
+
+
+def _feed(parser, f, chunk_size=64 * 1024):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+
+
+def _compile(name, field):
+    # type: (str, Field) -> _Pattern
+    path = field.path
+    if path.startswith('//'):
+        # Like root.iter(): the root itself, or any descendant.
+        steps, min_depth, any_depth = path[2:], 0, True
+    elif path.startswith('.//'):
+        # Any descendant of the root (not the root itself).
+        steps, min_depth, any_depth = path[3:], 1, True
+    elif path.startswith('./'):
+        steps, min_depth, any_depth = path[2:], 1, False
+    else:
+        raise ValueError("Unsupported path {!r} for field {}".format(path, name))
+
+    compiled_steps = []
+    for step in _STEPS_RE.findall(steps):
+        m = _STEP_RE.match(step)
+        if not m:
+            raise ValueError("Unsupported path step {!r} for field {}".format(step, name))
+        attr = (m.group('attr'), m.group('value')) if m.group('attr') else None
+        compiled_steps.append(_Step(m.group('tag'), attr))
+
+    return _Pattern(name, field, compiled_steps, min_depth + len(compiled_steps) - 1, any_depth)
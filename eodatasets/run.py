@@ -7,6 +7,7 @@ from __future__ import absolute_import
 import logging
 import shutil
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
 
 from pathlib import Path
@@ -19,7 +20,9 @@ _LOG = logging.getLogger(__name__)
 def package_newly_processed_data_folder(driver, input_data_paths, destination_path, parent_dataset_paths,
                                         metadata_expand_fn=None,
                                         hard_link=False,
-                                        additional_files=None):
+                                        additional_files=None,
+                                        workers=1,
+                                        compression_tuner=None):
     """
     Package an input folder. This is assumed to have just been packaged on the current host.
 
@@ -34,12 +37,18 @@ def package_newly_processed_data_folder(driver, input_data_paths, destination_pa
 
     Set hard_link=True to hard link instead of copy unmodified files to the output directory (a large speedup)
 
+    Set workers above 1 to package multiple datasets concurrently in separate processes.
+
+    Give a compression_tuner to compress images with settings tuned for each kind of band.
+
     :type driver: eodatasets.drivers.DatasetDriver
     :type input_data_paths: list[pathlib.Path]
     :type destination_path: pathlib.Path
     :type metadata_expand_fn: (eodatasets.type.DatasetMetadata) -> None
     :type parent_dataset_paths: list[pathlib.Path]
     :type hard_link: bool
+    :type workers: int
+    :type compression_tuner: eodatasets.compression.Tuner
 
     :param additional_files: Additional files to record in the package.
     :type additional_files: list[Path]
@@ -50,14 +59,18 @@ def package_newly_processed_data_folder(driver, input_data_paths, destination_pa
         package.init_locally_processed_dataset,
         hard_link=hard_link,
         metadata_expand_fn=metadata_expand_fn,
-        additional_files=additional_files
+        additional_files=additional_files,
+        workers=workers,
+        compression_tuner=compression_tuner
     )
 
 
 def package_existing_data_folder(driver, input_data_paths, destination_path, parent_dataset_paths,
                                  metadata_expand_fn=None,
                                  additional_files=None,
-                                 hard_link=False):
+                                 hard_link=False,
+                                 workers=1,
+                                 compression_tuner=None):
     """
     Package an input folder of possibly unknown origin.
 
@@ -68,6 +81,10 @@ def package_existing_data_folder(driver, input_data_paths, destination_path, par
 
     Set hard_link=True to hard link instead of copy unmodified files to the output directory (a large speedup)
 
+    Set workers above 1 to package multiple datasets concurrently in separate processes.
+
+    Give a compression_tuner to compress images with settings tuned for each kind of band.
+
     :type driver: eodatasets.drivers.DatasetDriver
     :type input_data_paths: list[pathlib.Path]
     :type destination_path: pathlib.Path
@@ -78,6 +95,8 @@ def package_existing_data_folder(driver, input_data_paths, destination_path, par
     :type additional_files: tuple[Path]
 
     :type hard_link: bool
+    :type workers: int
+    :type compression_tuner: eodatasets.compression.Tuner
     :return:
     """
     return _package_folder(
@@ -86,7 +105,9 @@ def package_existing_data_folder(driver, input_data_paths, destination_path, par
         package.init_existing_dataset,
         hard_link=hard_link,
         metadata_expand_fn=metadata_expand_fn,
-        additional_files=additional_files
+        additional_files=additional_files,
+        workers=workers,
+        compression_tuner=compression_tuner
     )
 
 
@@ -103,12 +124,17 @@ def _package_folder(driver, input_data_paths, destination_path, source_datasets,
                     init_dataset,
                     metadata_expand_fn=None,
                     hard_link=True,
-                    additional_files=None):
+                    additional_files=None,
+                    workers=1,
+                    compression_tuner=None):
     """
     Package a folder into a destination directory as the dataset id. The output is written atomically.
 
     Output is moved into place atomically once fully written.
 
+    With more than one worker, datasets are packaged concurrently in a process pool. All arguments
+    must then be picklable (eg. metadata_expand_fn cannot be a lambda).
+
     :type driver: eodatasets.drivers.DatasetDriver
     :type input_data_paths: list[pathlib.Path]
     :type destination_path: pathlib.Path
@@ -116,49 +142,95 @@ def _package_folder(driver, input_data_paths, destination_path, source_datasets,
     :type metadata_expand_fn: (eodatasets.type.DatasetMetadata) -> None
     :type init_dataset: callable
     :type hard_link: bool
+    :type workers: int
+    :type compression_tuner: eodatasets.compression.Tuner
 
     :param additional_files: Additional files to record in the package.
     :type additional_files: tuple[Path]
 
     :return: list of (created packages, already existing packages)
     """
-    created_packages = []
-    existing_packages = []
-
-    for dataset_folder in input_data_paths:
-        dataset_folder = Path(dataset_folder)
-
-        with temp_dir(prefix='.packagetmp.', base_dir=destination_path) as temp_output_dir:
-            dataset = init_dataset(dataset_folder, source_datasets)
-            if metadata_expand_fn is not None:
-                metadata_expand_fn(dataset)
-
-            dataset_id = package.package_dataset(  # Also updates dataset
-                dataset_driver=driver,
-                dataset=dataset,
-                image_path=dataset_folder,
-                target_path=temp_output_dir,
-                hard_link=hard_link,
-                additional_files=additional_files
-            )
-
-            # Output package permissions should match the parent dir.
-            shutil.copymode(str(destination_path), str(temp_output_dir))
-            packaged_path = destination_path / dataset_id
-
-            if packaged_path.exists():
-                _LOG.warning('Package already exists: %r', packaged_path)
-                existing_packages.append(packaged_path)
-                shutil.rmtree(str(temp_output_dir), ignore_errors=True)
-            else:
-                # Move finished folder into place.
-                temp_output_dir.rename(packaged_path)
-                created_packages.append(packaged_path)
-                _LOG.info('Completed package %r', packaged_path)
-
+    package_args = dict(
+        driver=driver,
+        destination_path=destination_path,
+        source_datasets=source_datasets,
+        init_dataset=init_dataset,
+        metadata_expand_fn=metadata_expand_fn,
+        hard_link=hard_link,
+        additional_files=additional_files,
+        compression_tuner=compression_tuner,
+    )
+    dataset_folders = [Path(p) for p in input_data_paths]
+
+    if workers > 1 and len(dataset_folders) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(dataset_folders))) as executor:
+            futures = [
+                executor.submit(_package_dataset_folder, dataset_folder, **package_args)
+                for dataset_folder in dataset_folders
+            ]
+            # Collect in input order, so results match a sequential run.
+            results = [future.result() for future in futures]
+    else:
+        results = [
+            _package_dataset_folder(dataset_folder, **package_args)
+            for dataset_folder in dataset_folders
+        ]
+
+    created_packages = [path for path, was_created in results if was_created]
+    existing_packages = [path for path, was_created in results if not was_created]
     return created_packages, existing_packages
 
 
+def _package_dataset_folder(dataset_folder, driver, destination_path, source_datasets,
+                            init_dataset,
+                            metadata_expand_fn=None,
+                            hard_link=True,
+                            additional_files=None,
+                            compression_tuner=None):
+    """
+    Package a single dataset folder into the destination directory.
+
+    (A top-level function so that it can be run in a worker process.)
+
+    :type dataset_folder: pathlib.Path
+    :return: The package path, and whether it was newly created (False if it already existed)
+    :rtype: (pathlib.Path, bool)
+    """
+    with temp_dir(prefix='.packagetmp.', base_dir=destination_path) as temp_output_dir:
+        dataset = init_dataset(dataset_folder, source_datasets)
+        if metadata_expand_fn is not None:
+            metadata_expand_fn(dataset)
+
+        dataset_id = package.package_dataset(  # Also updates dataset
+            dataset_driver=driver,
+            dataset=dataset,
+            image_path=dataset_folder,
+            target_path=temp_output_dir,
+            hard_link=hard_link,
+            additional_files=additional_files,
+            compression_tuner=compression_tuner
+        )
+
+        # Output package permissions should match the parent dir.
+        shutil.copymode(str(destination_path), str(temp_output_dir))
+        packaged_path = destination_path / dataset_id
+
+        # Move finished folder into place.
+        # (We don't check for an existing package beforehand: another worker could create one in between.
+        # Renaming onto an existing, non-empty package fails, so the rename itself is our check.)
+        try:
+            temp_output_dir.rename(packaged_path)
+        except OSError:
+            if not packaged_path.exists():
+                raise
+            _LOG.warning('Package already exists: %r', packaged_path)
+            shutil.rmtree(str(temp_output_dir), ignore_errors=True)
+            return packaged_path, False
+
+        _LOG.info('Completed package %r', packaged_path)
+        return packaged_path, True
+
+
 @contextmanager
 def temp_dir(prefix="", base_dir=None):
     temp_output_dir = Path(tempfile.mkdtemp(prefix=prefix, dir=str(base_dir)))
@@ -5,7 +5,7 @@ from __future__ import absolute_import
 import click
 from pathlib import Path
 
-from eodatasets import run as run_package, drivers
+from eodatasets import run as run_package, drivers, compression
 from eodatasets.scripts import init_logging
 
 
@@ -27,6 +27,20 @@ from eodatasets.scripts import init_logging
               type=click.Path(exists=True, readable=True, writable=False),
               multiple=True,
               help='Additional file to note in the package (eg. a useful log file).')
+@click.option('--workers',
+              type=click.IntRange(min=1),
+              default=1,
+              help='Number of datasets to package concurrently (each in its own process).')
+@click.option('--auto-tune',
+              type=click.Choice(compression.GOALS),
+              help='Choose image compression settings for each kind of band by trialling them on samples, '
+                   'for the smallest output or fastest reads.')
+@click.option('--tuning-time-budget',
+              type=float,
+              help='Maximum compression time allowed when auto-tuning (seconds per megapixel)')
+@click.option('--tuning-cache',
+              type=click.Path(dir_okay=False, writable=True),
+              help='File to store auto-tuned settings, so they are tuned once per product and band.')
 @click.argument('package_type',
                 type=click.Choice(drivers.PACKAGE_DRIVERS.keys()))
 @click.argument('dataset',
@@ -35,12 +49,21 @@ from eodatasets.scripts import init_logging
 @click.argument('destination',
                 type=click.Path(exists=True, readable=True, writable=True),
                 nargs=1)
-def run(parent, debug, hard_link, newly_processed, package_type, dataset, destination, add_file):
+def run(parent, debug, hard_link, newly_processed, package_type, dataset, destination, add_file, workers,
+        auto_tune, tuning_time_budget, tuning_cache):
     """
     Package the given imagery folders.
     """
     init_logging(debug)
 
+    compression_tuner = None
+    if auto_tune:
+        compression_tuner = compression.Tuner(
+            goal=auto_tune,
+            time_budget=tuning_time_budget,
+            cache_path=Path(tuning_cache) if tuning_cache else None
+        )
+
     if newly_processed:
         run_package.package_newly_processed_data_folder(
             driver=drivers.PACKAGE_DRIVERS[package_type],
@@ -48,7 +71,9 @@ def run(parent, debug, hard_link, newly_processed, package_type, dataset, destin
             destination_path=Path(destination),
             parent_dataset_paths=[Path(p) for p in parent],
             hard_link=hard_link,
-            additional_files=tuple(Path(p) for p in add_file)
+            additional_files=tuple(Path(p) for p in add_file),
+            workers=workers,
+            compression_tuner=compression_tuner
         )
     else:
         run_package.package_existing_data_folder(
@@ -57,7 +82,9 @@ def run(parent, debug, hard_link, newly_processed, package_type, dataset, destin
             destination_path=Path(destination),
             parent_dataset_paths=[Path(p) for p in parent],
             hard_link=hard_link,
-            additional_files=tuple(Path(p) for p in add_file)
+            additional_files=tuple(Path(p) for p in add_file),
+            workers=workers,
+            compression_tuner=compression_tuner
         )
 
 
@@ -5,26 +5,38 @@ Repackage a USGS Collection-1 tar for faster read access.
 They arrive as a *.tar.gz with inner uncompressed tiffs, which Josh's tests have found to be too slow to read.
 
 We compress the inner tiffs and store them in an uncompressed tar. This allows random reads within the files.
-We also append a checksum file at the end of the tar.
+We also append a checksum file and a member index (see eodatasets.tarindex) at the end of the tar, and
+write the index beside it.
 """
+import collections
 import copy
+import hashlib
 import io
 import json
+import os
+import queue
+import shutil
 import stat
 import sys
 import tarfile
 import tempfile
+import threading
 import traceback
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+)
+from contextlib import contextmanager
 from functools import partial
 from pathlib import Path
-from typing import List, Iterable, Tuple, Callable, IO, Dict
+from typing import List, Iterable, Tuple, Callable, IO, Dict, Optional, Set, Union
 
 import click
 import numpy
 import rasterio
 from click import secho, echo
 
-from eodatasets.verify import PackageChecksum
+from eodatasets import compression, tarindex
+from eodatasets.verify import PackageChecksum, calculate_file_sha1, DEFAULT_HASH_BLOCK_SIZE
 
 _PREDICTOR_TABLE = {
     'int8': 2,
@@ -39,6 +51,16 @@ _PREDICTOR_TABLE = {
     'float64': 3
 }
 
+# Files larger than this (in bytes) are spooled to disk, rather than held in memory while being recompressed.
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# How many members of a streamed tar can be decompressed ahead of their use.
+_STREAM_READ_AHEAD = 2
+
+# Non-tif members of a streamed tar up to this size are held in memory until they're written (such as the MTL),
+# larger ones are spooled to disk.
+_SMALL_MEMBER_BYTES = 1024 * 1024
+
 # The info of a file, and a method to open the file for reading.
 ReadableMember = Tuple[tarfile.TarInfo, Callable[[], IO]]
 
@@ -85,13 +107,121 @@ def _create_tarinfo(path: Path, name=None) -> tarfile.TarInfo:
     return info
 
 
-def _tar_members(in_tar: tarfile.TarFile) -> Iterable[ReadableMember]:
-    """Get readable files (members) from a tar"""
-    members: List[tarfile.TarInfo] = in_tar.getmembers()
+def _stream_tar_members(
+        tar_path: Path,
+        spool_dir: Path,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+) -> Iterable[ReadableMember]:
+    """
+    Get readable files (members) from a (compressed) tar, reading it in a single forward pass.
+
+    Decompression runs on a background thread, so it continues while earlier members are being
+    processed. Tifs are given to the compressors as-is: read into memory if they're within the memory
+    budget (see `_InMemoryMember`), otherwise spooled to a file in spool_dir (see `_SpooledMember`).
+    Other files are spooled until they're opened: in memory if small, otherwise to a temporary file.
+
+    The caller owns the spooled tif files that it's given (and spool_dir, which should be removed
+    afterwards in case of errors).
+    """
+    read_members = queue.Queue(maxsize=_STREAM_READ_AHEAD)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                read_members.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read_tar():
+        try:
+            with tarfile.open(str(tar_path), 'r|*') as in_tar:
+                for member in in_tar:
+                    if stopped.is_set():
+                        return
+                    contents = None
+                    if member.isfile():
+                        input_fp = in_tar.extractfile(member)
+                        if not _is_tif(member.name):
+                            contents = _spool(input_fp, min(memory_budget, _SMALL_MEMBER_BYTES))
+                        elif member.size <= memory_budget:
+                            contents = _InMemoryMember(input_fp.read())
+                        else:
+                            contents = _SpooledMember(_spool_to_file(input_fp, spool_dir))
+                    put((member, contents))
+            put(None)
+        except Exception as e:
+            put(e)
+
+    reader = threading.Thread(target=read_tar, name=f'read-{tar_path.name}', daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = read_members.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+
+            member, contents = item
+            if isinstance(contents, (_InMemoryMember, _SpooledMember)) or contents is None:
+                yield member, contents
+            else:
+                yield member, (lambda spool=contents: spool)
+    finally:
+        stopped.set()
+        reader.join()
+        # Clean up any spooled members that weren't reached.
+        while not read_members.empty():
+            item = read_members.get_nowait()
+            if isinstance(item, tuple) and hasattr(item[1], 'close'):
+                item[1].close()
+
+
+class _InMemoryMember(object):
+    """
+    Opens a member whose contents are already in memory.
+
+    (Tifs can use the contents directly, rather than reading a second copy of them.)
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
 
-    for member in members:
-        # We return a lambda/callable so that the file isn't opened until it's needed.
-        yield member, partial(in_tar.extractfile, member)
+    def __call__(self) -> IO:
+        return io.BytesIO(self.data)
+
+
+class _SpooledMember(object):
+    """
+    Opens a member that has been spooled to a (named) temporary file.
+
+    (Tifs can use the file directly, rather than copying it again.)
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def __call__(self) -> IO:
+        return self.path.open('rb')
+
+    def close(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _spool(input_fp: IO, max_memory: int) -> IO:
+    """
+    Copy a file object to a temporary file, held in memory if within max_memory bytes.
+    """
+    # (A SpooledTemporaryFile with a max_size of zero would never roll over to disk.)
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory) if max_memory > 0 else tempfile.TemporaryFile()
+    shutil.copyfileobj(input_fp, spool, DEFAULT_HASH_BLOCK_SIZE)
+    spool.seek(0)
+    return spool
 
 
 def _folder_members(path: Path, base_path: Path = None) -> Iterable[ReadableMember]:
@@ -129,13 +259,7 @@ def repackage_tar(
         return True
 
     try:
-        members = list(input_files)
-
-        # Add the MTL file to the beginning of the output tar, so it can be accessed faster.
-        # This slows down this repackage a little, as we're seeking/decompressing the input stream an extra time.
-        _reorder_tar_members(members, input_path.name)
-
-        _create_tar_with_files(input_path, members, output_tar_path, **compress_args)
+        members = _create_tar_with_files(input_path, input_files, output_tar_path, **compress_args)
 
         _log_completion(members, input_path, output_tar_path)
     except Exception as e:
@@ -151,114 +275,278 @@ def repackage_tar(
 
 def _create_tar_with_files(
         input_path: Path,
-        members: List[ReadableMember],
+        members: Iterable[ReadableMember],
         output_tar_path: Path,
+        workers: int = 1,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
         **compress_args,
-) -> None:
+) -> List[tarfile.TarInfo]:
     """
     Package and compress the given input files to a new tar path.
 
+    Members are read once, in the given order. Tifs are recompressed concurrently by `workers` threads,
+    and all members are written to the output in their original order, except for the MTL, which is
+    written first.
+
+    Each tif (input or output) is held in memory if it's within `memory_budget` bytes,
+    otherwise it's spooled to a temporary file. Until the MTL has been written, finished tifs can't be
+    written either, so their outputs are always spooled to temporary files.
+
     The output tar path is written atomically, so on failure it will only exist if complete.
+
+    :returns: The input members
     """
 
     out_dir: Path = output_tar_path.parent
     out_dir.mkdir(parents=True, exist_ok=True)
 
     verify = PackageChecksum()
+    index: List[tarindex.IndexEntry] = []
+    input_members: List[tarfile.TarInfo] = []
+
+    # Streamed members have an unknown total count and size.
+    member_count = len(members) if isinstance(members, list) else None
+    total_size = sum(member.size for member, _ in members) if member_count is not None else None
 
     # Use a temporary file so that we can move to the output path atomically.
     with tempfile.TemporaryDirectory(prefix='.extract-', dir=str(out_dir)) as tmpdir:
         tmpdir = Path(tmpdir).absolute()
         tmp_out_tar = tmpdir.joinpath(output_tar_path.name)
 
-        with tarfile.open(tmp_out_tar, 'w') as out_tar:
-            with click.progressbar(label=input_path.name,
-                                   length=sum(member.size for member, _ in members)) as progress:
-                file_number = 0
-                for readable_member in members:
-                    file_number += 1
-                    progress.label = f"{input_path.name} ({file_number:2d}/{len(members)})"
-
-                    _recompress_tar_member(
-                        readable_member,
-                        out_tar,
-                        compress_args,
-                        verify,
-                        tmpdir
-                    )
-
-                    member, _ = readable_member
+        with tarfile.open(tmp_out_tar, 'w') as out_tar, ThreadPoolExecutor(max_workers=workers) as executor:
+            # Progress is counted in bytes as each member is written, so the bar itself is never iterated
+            # (which would count members too). Click only needs the members when the total is unknown.
+            with click.progressbar(
+                    members if total_size is None else None,
+                    length=total_size,
+                    label=input_path.name,
+                    # Streamed: show the bytes written so far.
+                    show_pos=total_size is None,
+            ) as progress:
+                # Members waiting for their turn to be written, in order. Their contents are either a
+                # recompression Future (tifs), a method to open them (other files), or None (directories).
+                pending = collections.deque()
+                # Add the MTL file to the beginning of the output tar, so it can be accessed faster.
+                # Nothing else can be written until we've found it.
+                mtl_written = False
+
+                def write_member(member, new_member, contents):
+                    if contents is None:
+                        # Typically a directory entry.
+                        out_tar.addfile(new_member)
+                    elif isinstance(contents, Future):
+                        contents, hash_ = contents.result()
+                        if isinstance(contents, Path):
+                            new_member.size = contents.stat().st_size
+                            with contents.open('rb') as f:
+                                index.append(tarindex.add_indexed_member(out_tar, new_member, f, hash_))
+                            contents.unlink()
+                        else:
+                            new_member.size = len(contents)
+                            index.append(tarindex.add_indexed_member(out_tar, new_member, io.BytesIO(contents), hash_))
+                        verify.add_hash(tmpdir / new_member.name, hash_)
+                        del contents
+                    else:
+                        # Copy unchanged into target (typically text/metadata files), hashing as we go.
+                        with contents() as input_fp:
+                            hashing_fp = _HashingReader(input_fp)
+                            entry = tarindex.add_indexed_member(out_tar, new_member, hashing_fp, sha1=None)
+                        verify.add_hash(tmpdir / new_member.name, hashing_fp.hexdigest())
+                        index.append(entry._replace(sha1=hashing_fp.hexdigest()))
                     progress.update(member.size)
 
+                def write_pending(max_pending=0):
+                    if not mtl_written:
+                        # We can't write anything yet, but we can limit how many tifs are compressing at once.
+                        unfinished = [c for _, _, c in pending if isinstance(c, Future) and not c.done()]
+                        while len(unfinished) > max_pending:
+                            wait(unfinished, return_when=FIRST_COMPLETED)
+                            unfinished = [f for f in unfinished if not f.done()]
+                        return
+
+                    while len(pending) > max_pending:
+                        write_member(*pending.popleft())
+
+                for file_number, (member, open_member) in enumerate(members, start=1):
+                    progress.label = f"{input_path.name} ({file_number:2d}/{member_count or '?'})"
+                    input_members.append(member)
+
+                    new_member = copy.copy(member)
+                    # Copy with a minimum 664 permission, which is used by USGS tars.
+                    # (some of our repacked datasets have only user read permission.)
+                    new_member.mode = new_member.mode | 0o664
+
+                    if member.size == 0:
+                        contents = None
+                    elif _is_tif(member.name):
+                        if isinstance(open_member, _InMemoryMember):
+                            file_contents = open_member.data
+                        elif isinstance(open_member, _SpooledMember):
+                            # Already a temporary file of our own: recompression will consume it.
+                            file_contents = open_member.path
+                        else:
+                            with open_member() as input_fp:
+                                if member.size > memory_budget:
+                                    file_contents = _spool_to_file(input_fp, tmpdir)
+                                else:
+                                    file_contents = input_fp.read()
+                        contents = executor.submit(
+                            _recompress_tif,
+                            member.name,
+                            file_contents,
+                            tmpdir,
+                            # Outputs waiting for the MTL would otherwise accumulate in memory.
+                            memory_budget if mtl_written else 0,
+                            compress_args,
+                        )
+                        del file_contents
+                    else:
+                        contents = open_member
+
+                    if not mtl_written and _is_mtl(member):
+                        write_member(member, new_member, contents)
+                        mtl_written = True
+                    else:
+                        pending.append((member, new_member, contents))
+
+                    # Limit how many tifs are held in memory at once.
+                    write_pending(max_pending=workers * 2)
+
+                if not mtl_written:
+                    formatted_members = '\n\t'.join(m.name for m in input_members)
+                    raise ValueError(f"No MTL file found in package {input_path.name}. Have:\n\t{formatted_members}")
+                write_pending()
+
             # Append sha1 checksum file
             checksum_path = tmpdir / 'package.sha1'
             verify.write(checksum_path)
             checksum_path.chmod(0o664)
-            out_tar.add(checksum_path, checksum_path.name)
+            with checksum_path.open('rb') as f:
+                index.append(tarindex.add_indexed_member(
+                    out_tar,
+                    out_tar.gettarinfo(str(checksum_path), checksum_path.name),
+                    f,
+                    calculate_file_sha1(checksum_path)
+                ))
+
+            # Append the member index, and write it beside the tar.
+            index_path = tmpdir / tarindex.INDEX_MEMBER_NAME
+            tarindex.write_index(index, index_path)
+            index_path.chmod(0o664)
+            out_tar.add(index_path, index_path.name)
+
+        # Match the lower r/w permission bits to the output folder.
+        # (Temp directories default to 700 otherwise.)
+        tmp_out_tar.chmod(out_dir.stat().st_mode & 0o777)
+        # Our output tar is complete. Move it into place.
+        tmp_out_tar.rename(output_tar_path)
+        # Only then the sidecar index, so that an index is never left beside a missing (or older) tar.
+        index_path.rename(tarindex.sidecar_path(output_tar_path))
+
+    return input_members
+
+
+class _HashingReader(object):
+    """
+    Wrap a readable file, calculating a hash of everything read through it.
+
+    (So a file can be checksummed while it's streamed elsewhere, without reading it twice.)
+    """
+
+    def __init__(self, fp: IO, hash_fn=hashlib.sha1):
+        self._fp = fp
+        self._hash = hash_fn()
+
+    def read(self, size=-1) -> bytes:
+        data = self._fp.read(size)
+        self._hash.update(data)
+        return data
 
-            # Match the lower r/w permission bits to the output folder.
-            # (Temp directories default to 700 otherwise.)
-            tmp_out_tar.chmod(out_dir.stat().st_mode & 0o777)
-            # Our output tar is complete. Move it into place.
-            tmp_out_tar.rename(output_tar_path)
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
 
 
-def _recompress_tar_member(
-        readable_member: ReadableMember,
-        out_tar: tarfile.TarFile,
+def _recompress_tif(
+        name: str,
+        file_contents: Union[bytes, Path],
+        tmpdir: Path,
+        memory_budget: int,
         compress_args: Dict,
-        verify: PackageChecksum,
-        tmpdir: Path
-):
-    member, open_member = readable_member
-
-    new_member = copy.copy(member)
-    # Copy with a minimum 664 permission, which is used by USGS tars.
-    # (some of our repacked datasets have only user read permission.)
-    new_member.mode = new_member.mode | 0o664
-
-    # If it's a tif, check whether it's compressed.
-    if member.name.lower().endswith('.tif'):
-        input_fp = open_member()
-        with rasterio.open(input_fp) as ds:
-            if not ds.profile.get('compress'):
-                # No compression: let's compress it
-                with rasterio.MemoryFile(filename=member.name) as memory_file:
-                    try:
-                        _recompress_image(ds, memory_file, **compress_args)
-                    except Exception:
-                        secho(f"Error during {member.name}", bold=True)
-                        raise
-                    new_member.size = memory_file.getbuffer().nbytes
-                    out_tar.addfile(new_member, memory_file)
-
-                    # Image has been written. Seek to beginning to take a checksum.
-                    memory_file.seek(0)
-                    verify.add(memory_file, tmpdir / new_member.name)
-                    return
-            else:
-                # It's already compressed, we'll fall through and copy it verbatim.
-                input_fp.close()
+) -> Tuple[Union[bytes, Path], str]:
+    """
+    Compress a tif, if it's not already compressed.
 
-    if member.size == 0:
-        # Typically a directory entry.
-        out_tar.addfile(new_member)
-        return
+    The tif is given either in memory or as a (temporary) file. The output is written to memory if
+    its uncompressed size is within the memory budget, otherwise to a temporary file. (An already
+    compressed tif is returned as given, unless it's in memory and larger than the budget.)
 
-    # Copy unchanged into target (typically text/metadata files).
-    file_contents = open_member().read()
-    out_tar.addfile(new_member, io.BytesIO(file_contents))
-    verify.add(io.BytesIO(file_contents), tmpdir / new_member.name)
-    del file_contents
+    :returns: The new contents of the file (bytes or a temporary file), and their sha1 hash.
+    """
+    with _open_tif(file_contents) as ds:
+        if not ds.profile.get('compress'):
+            # No compression: let's compress it
+            uncompressed_size = ds.width * ds.height * ds.count * numpy.dtype(ds.dtypes[0]).itemsize
+            try:
+                if uncompressed_size > memory_budget:
+                    output_path = _temp_path(tmpdir)
+                    _recompress_image(ds, output_path, tuning_key=_tuning_key(name), **compress_args)
+                    new_contents = output_path
+                else:
+                    with rasterio.MemoryFile(filename=name) as memory_file:
+                        _recompress_image(ds, memory_file, tuning_key=_tuning_key(name), **compress_args)
+                        new_contents = memory_file.read()
+            except Exception:
+                secho(f"Error during {name}", bold=True)
+                raise
+
+            if isinstance(file_contents, Path):
+                file_contents.unlink()
+            file_contents = new_contents
+        # Otherwise it's already compressed, we'll copy it verbatim.
+
+    if isinstance(file_contents, bytes) and len(file_contents) > memory_budget:
+        output_path = _temp_path(tmpdir)
+        output_path.write_bytes(file_contents)
+        return output_path, hashlib.sha1(file_contents).hexdigest()
+
+    if isinstance(file_contents, Path):
+        return file_contents, calculate_file_sha1(file_contents)
+    return file_contents, hashlib.sha1(file_contents).hexdigest()
+
+
+@contextmanager
+def _open_tif(file_contents: Union[bytes, Path]) -> Iterable[rasterio.DatasetReader]:
+    if isinstance(file_contents, Path):
+        with rasterio.open(str(file_contents)) as ds:
+            yield ds
+    else:
+        with rasterio.MemoryFile(file_contents) as input_file, input_file.open() as ds:
+            yield ds
 
 
-def _log_skip(input_path: Path, output_tar: Path, reason: str, extra: dict = None):
+def _spool_to_file(input_fp: IO, tmpdir: Path) -> Path:
+    """
+    Copy a file object to a new temporary file.
+    """
+    path = _temp_path(tmpdir)
+    with path.open('wb') as f:
+        shutil.copyfileobj(input_fp, f, DEFAULT_HASH_BLOCK_SIZE)
+    return path
+
+
+def _temp_path(tmpdir: Path) -> Path:
+    fd, path = tempfile.mkstemp(prefix='.spool-', suffix='.tif', dir=str(tmpdir))
+    os.close(fd)
+    return Path(path)
+
+
+def _log_skip(input_path: Path, output_tar: Optional[Path], reason: str, extra: dict = None):
     secho(
         json.dumps(
             dict(
                 name=str(input_path.name),
                 status=f'skip.{reason}',
-                out_path=str(output_tar.absolute()),
+                out_path=str(output_tar.absolute()) if output_tar else None,
                 in_path=str(input_path.absolute()),
                 **(extra or {})
             )
@@ -266,14 +554,14 @@ def _log_skip(input_path: Path, output_tar: Path, reason: str, extra: dict = Non
     )
 
 
-def _log_completion(input_files: List[ReadableMember], input_path: Path, output_tar: Path):
-    users = {(member.uname, member.gname) for member, _ in input_files}
+def _log_completion(input_files: List[tarfile.TarInfo], input_path: Path, output_tar: Path):
+    users = {(member.uname, member.gname) for member in input_files}
     secho(
         json.dumps(
             dict(
                 name=str(input_path.name),
                 status='complete',
-                in_size=sum(m.size for m, _ in input_files),
+                in_size=sum(m.size for m in input_files),
                 in_count=len(input_files),
                 # The user/group give us a hint as to whether this was repackaged outside of USGS.
                 in_users=list(users),
@@ -285,32 +573,49 @@ def _log_completion(input_files: List[ReadableMember], input_path: Path, output_
     )
 
 
-def _reorder_tar_members(members: List[ReadableMember], identifier: str):
+def _tuning_key(member_name: str) -> str:
     """
-    Put the (tiny) MTL file at the beginning of the tar so that it's always quick to read.
+    Identify the kind of band in a member, independent of its scene (for reusing tuned compression settings).
+
+    >>> _tuning_key('LT05_L1GS_092091_19910506_20170126_01_T2_B1.TIF')
+    'LT05_L1GS/B1.TIF'
+    >>> _tuning_key('gap_mask/LE07_L1GT_091080_20080114_20161231_01_T2_GM_B6_VCID_1.TIF')
+    'LE07_L1GT/gap_mask/GM_B6_VCID_1.TIF'
+    >>> _tuning_key('unusual.tif')
+    'unusual.tif'
     """
-    # Find MTL
-    for i, (member, _) in enumerate(members):
-        if '_MTL' in member.path:
-            mtl_index = i
-            break
-    else:
-        formatted_members = '\n\t'.join(m.name for m, _ in members)
-        raise ValueError(f"No MTL file found in package {identifier}. Have:\n\t{formatted_members}")
+    directory, _, file_name = member_name.rpartition('/')
+    parts = file_name.split('_')
+    # Collection-1 names: the first seven fields identify the scene, the first two its product.
+    if len(parts) <= 7:
+        return member_name
+    return '/'.join(part for part in ('_'.join(parts[:2]), directory, '_'.join(parts[7:])) if part)
+
+
+def _is_mtl(member: tarfile.TarInfo) -> bool:
+    return '_MTL' in member.path
+
 
-    # Move to front
-    mtl_item = members.pop(mtl_index)
-    members.insert(0, mtl_item)
+def _is_tif(name: str) -> bool:
+    return name.lower().endswith('.tif')
 
 
 def _recompress_image(
         input_image: rasterio.DatasetReader,
-        output_fp: rasterio.MemoryFile,
+        output: Union[rasterio.MemoryFile, Path],
         zlevel=9,
         block_size=(512, 512),
+        num_threads=None,
+        tuner: compression.Tuner = None,
+        tuning_key: str = None,
 ):
     """
-    Read an image from given file pointer, and write as a compressed GeoTIFF.
+    Read an image from given file pointer, and write as a compressed GeoTIFF to the given output.
+
+    If a tuner is given, its compression settings for the tuning key are used instead of
+    deflate with the given zlevel and block size.
+
+    The image is copied one output block at a time, so it's never wholly loaded into memory.
     """
     # noinspection PyUnusedLocal
 
@@ -320,20 +625,32 @@ def _recompress_image(
         raise ValueError(f"Expecting one-band-per-tif input (USGS packages). "
                          f"Input has multiple layers {repr(input_image.indexes)}")
 
-    array: numpy.ndarray = input_image.read(1)
     profile = input_image.profile
-    profile.update(
-        driver='GTiff',
-        predictor=_PREDICTOR_TABLE[array.dtype.name],
-        compress='deflate',
-        zlevel=zlevel,
-        blockxsize=block_size_x,
-        blockysize=block_size_y,
-        tiled=True,
-    )
+    if tuner is not None:
+        # Settings tuned for this kind of band replace our defaults.
+        profile.update(driver='GTiff', **tuner.options_for(input_image, tuning_key))
+    else:
+        profile.update(
+            driver='GTiff',
+            predictor=_PREDICTOR_TABLE[input_image.dtypes[0]],
+            compress='deflate',
+            zlevel=zlevel,
+            blockxsize=block_size_x,
+            blockysize=block_size_y,
+            tiled=True,
+        )
+    if num_threads:
+        # Compress blocks of the image in parallel.
+        profile.update(num_threads=num_threads)
 
-    with output_fp.open(**profile) as output_dataset:
-        output_dataset.write(array, 1)
+    if isinstance(output, rasterio.MemoryFile):
+        output_dataset = output.open(**profile)
+    else:
+        output_dataset = rasterio.open(str(output), 'w', **profile)
+
+    with output_dataset:
+        for _, window in output_dataset.block_windows(1):
+            output_dataset.write(input_image.read(1, window=window), 1, window=window)
         # Copy gdal metadata
         output_dataset.update_tags(**input_image.tags())
         output_dataset.update_tags(1, **input_image.tags(1))
@@ -346,45 +663,187 @@ def _recompress_image(
               help="Deflate compression level.")
 @click.option("--block-size", type=int, default=512,
               help="Compression block size (both x and y)")
+@click.option("--workers", type=click.IntRange(min=1), default=1,
+              help="Number of files to compress concurrently (within each dataset)")
+@click.option("--memory-budget", type=click.IntRange(min=0), default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+              help="Largest image (MB, uncompressed) to recompress in memory. Larger images use temporary files.")
+@click.option("--jobs", type=click.IntRange(min=1), default=1,
+              help="Number of datasets to repackage concurrently")
+@click.option("--manifest", type=click.Path(dir_okay=False, writable=True),
+              help="A log of finished inputs (json lines). Inputs already completed in it are skipped, "
+                   "and new results are appended.")
+@click.option("--auto-tune", type=click.Choice(compression.GOALS),
+              help="Choose compression settings for each kind of band by trialling them on samples, "
+                   "for the smallest output or fastest reads. (Replaces --zlevel and --block-size)")
+@click.option("--tuning-time-budget", type=float,
+              help="Maximum compression time allowed when auto-tuning (seconds per megapixel)")
+@click.option("--tuning-cache", type=click.Path(dir_okay=False, writable=True),
+              help="File to store auto-tuned settings, so they're tuned once per product and band")
 @click.argument("paths", nargs=-1, type=click.Path(exists=True, readable=True))
-def main(paths: List[str], output_base: str, zlevel: int, block_size: int):
+def main(paths: List[str],
+         output_base: str,
+         zlevel: int,
+         block_size: int,
+         workers: int,
+         memory_budget: int,
+         jobs: int,
+         manifest: str,
+         auto_tune: str,
+         tuning_time_budget: float,
+         tuning_cache: str):
     base_output_path = Path(output_base)
-    with rasterio.Env():
+    # Share the available cpus between concurrent files, each compressing its blocks in parallel.
+    num_threads = max(1, (os.cpu_count() or 1) // (workers * jobs))
 
-        total = failures = 0
+    paths = [Path(path) for path in paths]
+    if manifest:
+        manifest = Path(manifest)
+        completed = _read_manifest(manifest)
         for path in paths:
-            total += 1
-            path = Path(path)
-
-            # Input is either a tar.gz file, or a directory containing an MTL (already extracted)
-            if path.suffix.lower() == '.gz':
-                with tarfile.open(str(path), 'r') as in_tar:
-                    success = repackage_tar(
-                        path,
-                        _tar_members(in_tar),
-                        _output_tar_path(base_output_path, path),
-                        zlevel=zlevel,
-                        block_size=(block_size, block_size),
-                    )
-
-            elif path.is_dir():
-                success = repackage_tar(
-                    path,
-                    _folder_members(path),
-                    _output_tar_path_from_directory(base_output_path, path),
-                    zlevel=zlevel,
-                    block_size=(block_size, block_size),
-                )
-            else:
-                raise ValueError(f"Expected either tar.gz or a dataset folder. Got: {path}")
+            if str(path.absolute()) in completed:
+                _log_skip(path, None, 'manifest')
+        paths = [path for path in paths if str(path.absolute()) not in completed]
+
+    tuner = None
+    if auto_tune:
+        tuner = compression.Tuner(
+            goal=auto_tune,
+            time_budget=tuning_time_budget,
+            cache_path=Path(tuning_cache) if tuning_cache else None,
+        )
+
+    repackage = partial(
+        _repackage_path,
+        base_output_path=base_output_path,
+        zlevel=zlevel,
+        block_size=(block_size, block_size),
+        workers=workers,
+        memory_budget=memory_budget * 1024 * 1024,
+        num_threads=num_threads,
+        tuner=tuner,
+    )
 
+    total = failures = 0
+    with _open_manifest(manifest) as manifest_file:
+        for path, success in _map_paths(repackage, paths, jobs):
+            total += 1
             if not success:
                 failures += 1
+            if manifest_file:
+                _append_manifest(manifest_file, path, success)
 
     echo(f"Completed {total-failures} datasets. {failures} failures.")
     sys.exit(failures)
 
 
+def _map_paths(repackage: Callable[[Path], bool], paths: List[Path], jobs: int) -> Iterable[Tuple[Path, bool]]:
+    """
+    Repackage each path, yielding each path and whether it succeeded (in order of completion).
+
+    An unexpected error in one path (including a crashed worker process) is logged and counted as a
+    failure of that path, rather than abandoning the other paths.
+    """
+    if jobs <= 1:
+        for path in paths:
+            try:
+                success = repackage(path)
+            except Exception as e:
+                _log_skip(path, None, 'error', extra=dict(traceback=_format_exception(e)))
+                success = False
+            yield path, success
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(repackage, path): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                success = future.result()
+            except Exception as e:
+                _log_skip(path, None, 'error', extra=dict(traceback=_format_exception(e)))
+                success = False
+            yield path, success
+
+
+def _repackage_path(
+        path: Path,
+        base_output_path: Path,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        **compress_args,
+) -> bool:
+    """
+    Repackage a single input dataset path into the output base directory.
+    """
+    with rasterio.Env():
+        # Input is either a tar.gz file, or a directory containing an MTL (already extracted)
+        if path.suffix.lower() == '.gz':
+            # (Large tifs are spooled here. It's removed with anything left over after a failure.)
+            with tempfile.TemporaryDirectory(prefix='.spool-') as spool_dir:
+                return repackage_tar(
+                    path,
+                    _stream_tar_members(path, Path(spool_dir), memory_budget),
+                    _output_tar_path(base_output_path, path),
+                    memory_budget=memory_budget,
+                    **compress_args,
+                )
+
+        elif path.is_dir():
+            return repackage_tar(
+                path,
+                _folder_members(path),
+                _output_tar_path_from_directory(base_output_path, path),
+                memory_budget=memory_budget,
+                **compress_args,
+            )
+        else:
+            raise ValueError(f"Expected either tar.gz or a dataset folder. Got: {path}")
+
+
+def _read_manifest(manifest_path: Path) -> Set[str]:
+    """
+    Get the (absolute) input paths that have been completed according to a manifest.
+
+    The latest entry for each path wins, so inputs that failed and later succeeded are complete.
+    """
+    if not manifest_path.exists():
+        return set()
+
+    statuses = {}
+    with manifest_path.open('r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A partially-written line from an interrupted run.
+                continue
+            statuses[entry['in_path']] = entry['status']
+
+    return {in_path for in_path, status in statuses.items() if status == 'complete'}
+
+
+@contextmanager
+def _open_manifest(manifest_path: Optional[Path]):
+    if not manifest_path:
+        yield None
+        return
+
+    with manifest_path.open('a') as f:
+        yield f
+
+
+def _append_manifest(manifest_file: IO, path: Path, success: bool):
+    manifest_file.write(
+        json.dumps(
+            dict(
+                in_path=str(path.absolute()),
+                status='complete' if success else 'failed',
+            )
+        ) + '\n'
+    )
+    # Flush each entry, so that they survive an interrupted run.
+    manifest_file.flush()
+
+
 def _format_exception(e: BaseException):
     """
     Shamelessly stolen from stdlib's logging module.
@@ -0,0 +1,144 @@
+"""
+A member index for uncompressed tars, allowing random access to members without reading through the tar.
+
+The index lists each file's data offset, size, sha1 checksum and name, as tab-separated lines
+(similar to our package.sha1 checksum files).
+
+It's written both as a sidecar file beside the tar ("<name>.tar.index"), and as the final
+member of the tar itself, so it can be found by reading only the end of the tar.
+"""
+import tarfile
+from pathlib import Path
+from typing import Dict, IO, Iterable, NamedTuple, Optional
+
+# Name of the index member within a tar.
+INDEX_MEMBER_NAME = 'package.index'
+
+# Suffix of the sidecar index file, appended to the tar's name.
+SIDECAR_SUFFIX = '.index'
+
+# How much of the end of a tar to search for the index member (if there's no sidecar).
+_TAIL_SEARCH_BYTES = 1024 * 1024
+
+
+class IndexEntry(NamedTuple):
+    name: str
+    # Offset of the member's data in the tar (past its header)
+    offset: int
+    size: int
+    sha1: str
+
+    @classmethod
+    def from_line(cls, line: str) -> 'IndexEntry':
+        offset, size, sha1, name = line.rstrip('\n').split('\t', 3)
+        return cls(name, int(offset), int(size), sha1)
+
+    def to_line(self) -> str:
+        return f'{self.offset}\t{self.size}\t{self.sha1}\t{self.name}\n'
+
+
+def add_indexed_member(tar: tarfile.TarFile,
+                       member: tarfile.TarInfo,
+                       fileobj: IO,
+                       sha1: Optional[str]) -> IndexEntry:
+    """
+    Add a file to a tar being written, returning its index entry.
+
+    (The sha1 may be None if not yet known, such as when hashing while streaming, and replaced afterwards.)
+    """
+    tar.addfile(member, fileobj)
+    # The tar's offset is now past the member's data, which is padded to a whole number of blocks.
+    padded_size = -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+    return IndexEntry(member.name, tar.offset - padded_size, member.size, sha1)
+
+
+def write_index(entries: Iterable[IndexEntry], output_file: Path):
+    with output_file.open('w') as f:
+        for entry in entries:
+            f.write(entry.to_line())
+
+
+def sidecar_path(tar_path: Path) -> Path:
+    return tar_path.with_name(tar_path.name + SIDECAR_SUFFIX)
+
+
+def read_index(tar_path: Path) -> Dict[str, IndexEntry]:
+    """
+    Read the member index of a tar, from its sidecar file if present, otherwise from the end of the tar.
+
+    :raises ValueError: if the tar has no index.
+    """
+    sidecar = sidecar_path(tar_path)
+    if sidecar.exists():
+        return _parse_index(sidecar.read_text())
+
+    contents = _read_trailing_index(tar_path)
+    if contents is None:
+        raise ValueError(f"No member index found for tar {tar_path}")
+    return _parse_index(contents)
+
+
+def vsi_path(tar_path: Path, name: str, index: Dict[str, IndexEntry] = None) -> str:
+    """
+    Get a GDAL path for reading a member of the tar directly.
+
+    >>> vsi_path(Path('/tmp/LT05.tar'), 'B1.TIF', {'B1.TIF': IndexEntry('B1.TIF', 1536, 120, 'abc')})
+    '/vsisubfile/1536_120,/tmp/LT05.tar'
+    """
+    entry = _get_entry(tar_path, name, index)
+    return f'/vsisubfile/{entry.offset}_{entry.size},{tar_path}'
+
+
+def read_member(tar_path: Path, name: str, index: Dict[str, IndexEntry] = None) -> bytes:
+    """
+    Read the contents of a member of the tar, with a single seek.
+    """
+    entry = _get_entry(tar_path, name, index)
+    with tar_path.open('rb') as f:
+        f.seek(entry.offset)
+        return f.read(entry.size)
+
+
+def _get_entry(tar_path: Path, name: str, index: Optional[Dict[str, IndexEntry]]) -> IndexEntry:
+    if index is None:
+        index = read_index(tar_path)
+    try:
+        return index[name]
+    except KeyError:
+        raise KeyError(f"No member {name!r} in tar {tar_path}") from None
+
+
+def _parse_index(contents: str) -> Dict[str, IndexEntry]:
+    entries = (IndexEntry.from_line(line) for line in contents.splitlines() if line)
+    return {entry.name: entry for entry in entries}
+
+
+def _read_trailing_index(tar_path: Path) -> Optional[str]:
+    """
+    Find the index member near the end of the tar, without reading through the tar's other members.
+
+    Tar headers are aligned to blocks, so we check each block of the tail (backwards) for the index's header.
+    """
+    header_prefix = INDEX_MEMBER_NAME.encode('utf-8') + b'\0'
+
+    with tar_path.open('rb') as f:
+        f.seek(0, 2)
+        tar_size = f.tell()
+        tail_offset = max(0, tar_size - _TAIL_SEARCH_BYTES) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+        f.seek(tail_offset)
+        tail = f.read()
+
+    for block_offset in range((len(tail) // tarfile.BLOCKSIZE - 1) * tarfile.BLOCKSIZE, -1, -tarfile.BLOCKSIZE):
+        block = tail[block_offset:block_offset + tarfile.BLOCKSIZE]
+        if not block.startswith(header_prefix):
+            continue
+        try:
+            member = tarfile.TarInfo.frombuf(block, tarfile.ENCODING, 'surrogateescape')
+        except tarfile.HeaderError:
+            continue
+
+        data_offset = block_offset + tarfile.BLOCKSIZE
+        if member.name == INDEX_MEMBER_NAME and data_offset + member.size <= len(tail):
+            return tail[data_offset:data_offset + member.size].decode('utf-8')
+
+    return None
@@ -2,16 +2,36 @@
 from __future__ import absolute_import
 
 import binascii
+import collections
+import functools
 import hashlib
 import logging
+import os
+import sqlite3
+import threading
+import time
 # PyLint doesn't recognise many distutils functions when in virtualenv. Not worth the effort.
 # pylint: disable=no-name-in-module
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from distutils import spawn
 from pathlib import Path
 
 _LOG = logging.getLogger(__name__)
 
+# Large reads keep us bound by disk bandwidth rather than syscalls (especially on lustre).
+DEFAULT_HASH_BLOCK_SIZE = 1024 * 1024
+
+# hashlib releases the GIL while hashing, so threads give us real concurrency.
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# Path of a checksum cache to use by default, if set (see `use_checksum_cache()`).
+CHECKSUM_CACHE_ENV_VAR = 'EODATASETS_CHECKSUM_CACHE'
+
+# Files modified more recently than this (in nanoseconds) aren't cached: a further write within the
+# filesystem's timestamp granularity could change their contents without changing their mtime.
+_CACHE_MIN_AGE_NS = 2 * 1000 * 1000 * 1000
+
 
 def find_exe(name):
     """
@@ -27,57 +47,263 @@ def find_exe(name):
     return executable
 
 
-def calculate_file_sha1(filename):
+def calculate_file_sha1(filename, use_cache=True):
     """
     :type filename: str or Path
     :rtype: str
     """
-    return calculate_file_hash(filename, hash_fn=hashlib.sha1)
+    return calculate_file_hash(filename, hash_fn=hashlib.sha1, use_cache=use_cache)
 
 
-def calculate_file_hash(filename, hash_fn=hashlib.sha1, block_size=4096):
+def calculate_file_hash(filename, hash_fn=hashlib.sha1, block_size=DEFAULT_HASH_BLOCK_SIZE, use_cache=True):
     """
     Calculate the hash of the contents of a given file path.
+
+    The checksum cache is used, if enabled (see `use_checksum_cache()`).
+
     :type filename: str or Path
     :param block_size: Number of bytes to read at a time. (for performance: doesn't affect result)
     :param hash_fn: hashlib function to use. (typically sha1 or md5)
+    :param use_cache: Whether to use the checksum cache. Disable it when verifying contents: the
+                      cache can't see changes that keep the file's size and modification time (bit rot).
     :return: String of hex characters.
     :rtype: str
     """
-    with Path(filename).open('rb') as f:
-        return calculate_hash(f, hash_fn, block_size)
+    def _calculate():
+        with Path(filename).open('rb') as f:
+            return calculate_hash(f, hash_fn, block_size)
+
+    cache = get_checksum_cache() if use_cache else None
+    if cache is None:
+        return _calculate()
+    return cache.get_or_calculate(filename, hash_fn().name, _calculate)
 
 
-def calculate_hash(f, hash_fn=hashlib.sha1, block_size=4096):
+def calculate_hash(f, hash_fn=hashlib.sha1, block_size=DEFAULT_HASH_BLOCK_SIZE):
+    """
+    Calculate the hash of all remaining data in an open (binary) file object.
+
+    :param block_size: Number of bytes to read at a time. (for performance: doesn't affect result)
+    :return: String of hex characters.
+    :rtype: str
+    """
     m = hash_fn()
 
-    while True:
-        d = f.read(block_size)
-        if not d:
-            break
-        m.update(d)
+    # Read into one reusable buffer where possible, rather than allocating a new bytes object per block.
+    readinto = getattr(f, 'readinto', None)
+    if readinto is not None:
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        while True:
+            count = readinto(buffer)
+            if not count:
+                break
+            m.update(view[:count])
+    else:
+        while True:
+            d = f.read(block_size)
+            if not d:
+                break
+            m.update(d)
+
+    return binascii.hexlify(m.digest()).decode('ascii')
+
+
+def copy_file_with_hash(source, destination, hash_fn=hashlib.sha1, block_size=DEFAULT_HASH_BLOCK_SIZE):
+    """
+    Copy the contents of a file (like `shutil.copyfile()`), calculating its hash from the copied bytes.
+
+    This avoids reading the file a second time to checksum it.
+
+    :type source: str or Path
+    :type destination: str or Path
+    :param hash_fn: hashlib function to use. (typically sha1 or md5)
+    :param block_size: Number of bytes to read at a time. (for performance: doesn't affect result)
+    :return: String of hex characters.
+    :rtype: str
+    """
+    m = hash_fn()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with Path(source).open('rb') as in_f, Path(destination).open('wb') as out_f:
+        while True:
+            count = in_f.readinto(buffer)
+            if not count:
+                break
+            out_f.write(view[:count])
+            m.update(view[:count])
 
     return binascii.hexlify(m.digest()).decode('ascii')
 
 
 # 16K seems to be the sweet spot in performance on my machine.
-def calculate_file_crc32(filename, block_size=1024 * 16):
+def calculate_file_crc32(filename, block_size=1024 * 16, use_cache=True):
     """
     Calculate the crc32 of the contents of a given file path.
     :type filename: str or Path
     :param block_size: Number of bytes to read at a time. (for performance: doesn't affect result)
+    :param use_cache: Whether to use the checksum cache (see `calculate_file_hash()`)
     :return: String of hex characters.
     :rtype: str
     """
-    m = 0
-    with Path(filename).open('rb') as f:
-        while True:
-            d = f.read(block_size)
-            if not d:
-                break
-            m = binascii.crc32(d, m)
+    def _calculate():
+        m = 0
+        with Path(filename).open('rb') as f:
+            while True:
+                d = f.read(block_size)
+                if not d:
+                    break
+                m = binascii.crc32(d, m)
+
+        return "%08x" % (m & 0xFFFFFFFF)
+
+    cache = get_checksum_cache() if use_cache else None
+    if cache is None:
+        return _calculate()
+    return cache.get_or_calculate(filename, 'crc32', _calculate)
+
+
+class ChecksumCache(object):
+    """
+    A persistent cache of file checksums, stored in an SQLite database.
+
+    Entries are keyed on the identity of the file (device, inode, size and modification time), so
+    unchanged files can be "checksummed" with a single stat(), and any change to a file invalidates its entry.
+
+    The database can be shared by concurrent threads and processes.
+    """
+
+    def __init__(self, path):
+        """
+        :type path: str or Path
+        """
+        self.path = Path(path)
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute(
+                'create table if not exists checksum ('
+                '  device integer not null,'
+                '  inode integer not null,'
+                '  algorithm text not null,'
+                '  size integer not null,'
+                '  mtime_ns integer not null,'
+                '  hash text not null,'
+                '  primary key (device, inode, algorithm)'
+                ')'
+            )
+
+    def _connection(self):
+        """
+        The connection for the current thread and process (sqlite connections can't be shared).
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(str(self.path), timeout=60)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, file_path, algorithm):
+        """
+        Get the cached checksum of a file, or None if unknown (or the file has changed).
+
+        :type file_path: str or Path
+        :param algorithm: Name of the checksum algorithm, such as 'sha1', 'md5' or 'crc32'.
+        :rtype: str or None
+        """
+        return self._lookup(os.stat(str(file_path)), algorithm)
+
+    def put(self, file_path, algorithm, hash_, stat=None):
+        """
+        Record the checksum of a file.
+
+        :param stat: The file's stat() result from before it was read (otherwise the current one).
+        """
+        stat = stat or os.stat(str(file_path))
+        if time.time() * 1e9 - stat.st_mtime_ns < _CACHE_MIN_AGE_NS:
+            return
+        with self._connection() as connection:
+            connection.execute(
+                'insert or replace into checksum (device, inode, algorithm, size, mtime_ns, hash) '
+                'values (?, ?, ?, ?, ?, ?)',
+                (stat.st_dev, stat.st_ino, algorithm, stat.st_size, stat.st_mtime_ns, hash_)
+            )
+
+    def get_or_calculate(self, file_path, algorithm, calculate):
+        """
+        Get the cached checksum of a file, calling `calculate()` (and caching the result) if unknown.
+
+        :type calculate: () -> str
+        :rtype: str
+        """
+        stat = os.stat(str(file_path))
+        hash_ = self._lookup(stat, algorithm)
+        if hash_ is not None:
+            _LOG.debug('Cached checksum for %r', file_path)
+            return hash_
+
+        hash_ = calculate()
+        # Don't cache if the file changed while we were reading it.
+        if _same_file_version(stat, os.stat(str(file_path))):
+            self.put(file_path, algorithm, hash_, stat=stat)
+        return hash_
+
+    def _lookup(self, stat, algorithm):
+        row = self._connection().execute(
+            'select hash from checksum where device=? and inode=? and algorithm=? and size=? and mtime_ns=?',
+            (stat.st_dev, stat.st_ino, algorithm, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def __getstate__(self):
+        # Connections can't be pickled (for use in other processes). They'll open their own.
+        return dict(path=self.path)
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+def _same_file_version(stat1, stat2):
+    return (stat1.st_dev, stat1.st_ino, stat1.st_size, stat1.st_mtime_ns) == \
+           (stat2.st_dev, stat2.st_ino, stat2.st_size, stat2.st_mtime_ns)
 
-    return "%08x" % (m & 0xFFFFFFFF)
+
+_CHECKSUM_CACHE = None
+
+
+def use_checksum_cache(path):
+    """
+    Cache the checksums calculated by this module in the given SQLite file (or stop caching, if None).
+
+    Caching can also be enabled with the EODATASETS_CHECKSUM_CACHE environment variable
+    (which is inherited by worker processes).
+
+    :type path: str or Path or None
+    :rtype: ChecksumCache or None
+    """
+    global _CHECKSUM_CACHE
+    _CHECKSUM_CACHE = ChecksumCache(path) if path else None
+    if path:
+        os.environ[CHECKSUM_CACHE_ENV_VAR] = str(path)
+    else:
+        os.environ.pop(CHECKSUM_CACHE_ENV_VAR, None)
+    return _CHECKSUM_CACHE
+
+
+def get_checksum_cache():
+    """
+    The active checksum cache, if any.
+
+    :rtype: ChecksumCache or None
+    """
+    global _CHECKSUM_CACHE
+    path = os.environ.get(CHECKSUM_CACHE_ENV_VAR)
+    if not path:
+        return None
+    if _CHECKSUM_CACHE is None or str(_CHECKSUM_CACHE.path) != path:
+        _CHECKSUM_CACHE = ChecksumCache(path)
+    return _CHECKSUM_CACHE
 
 
 class PackageChecksum(object):
@@ -85,10 +311,15 @@ class PackageChecksum(object):
     Incrementally build a checksum file for a package.
 
     (By building incrementally we can better take advantage of filesystem caching)
+
+    Multiple files given at once (`add_files()`, directories, `iteratively_verify()`) are
+    hashed concurrently using up to `workers` threads.
     """
 
-    def __init__(self):
+    def __init__(self, workers=DEFAULT_HASH_WORKERS, block_size=DEFAULT_HASH_BLOCK_SIZE):
         self._file_hashes = {}
+        self.workers = workers
+        self.block_size = block_size
 
     def add_file(self, file_path):
         """
@@ -102,6 +333,22 @@ class PackageChecksum(object):
             hash_ = self._checksum(file_path)
             self._append_hash(file_path, hash_)
 
+    def add_hash(self, file_path, hash_):
+        """
+        Record an already-known checksum for a file (such as one calculated while copying it).
+        :type file_path: Path
+        :type hash_: str
+        """
+        self._append_hash(file_path, hash_)
+
+    def get_hash(self, file_path):
+        """
+        Get the recorded checksum of a file, or None if it hasn't been added.
+        :type file_path: Path
+        :rtype: str or None
+        """
+        return self._file_hashes.get(Path(file_path).absolute())
+
     def add(self, fd: typing.IO, name=None):
         """
         Add a checksum, reading the data from an open file descriptor.
@@ -111,22 +358,67 @@ class PackageChecksum(object):
             raise ValueError("No usable name for checksummed file descriptor")
 
         _LOG.info('Checksumming %r', name)
-        hash_ = calculate_hash(fd)
+        hash_ = calculate_hash(fd, block_size=self.block_size)
         _LOG.debug('%r -> %r', name, hash_)
         self._append_hash(name, hash_)
 
-    def _checksum(self, file_path):
+    def _checksum(self, file_path, use_cache=True):
         _LOG.info('Checksumming %r', file_path)
-        hash_ = calculate_file_hash(file_path)
+        hash_ = calculate_file_hash(file_path, block_size=self.block_size, use_cache=use_cache)
         _LOG.debug('%r -> %r', file_path, hash_)
         return hash_
 
+    def _checksum_all(self, file_paths, use_cache=True):
+        """
+        Lazily yield the checksum of each given file, in order.
+
+        Only a few files are read ahead of those yielded (twice the number of workers), so a
+        caller that stops early doesn't read the rest.
+
+        :type file_paths: list[Path]
+        :type use_cache: bool
+        :rtype: typing.Iterable[str]
+        """
+        checksum = functools.partial(self._checksum, use_cache=use_cache)
+        if self.workers <= 1 or len(file_paths) <= 1:
+            yield from (checksum(path) for path in file_paths)
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(file_paths))) as executor:
+            futures = collections.deque()
+            try:
+                for path in file_paths:
+                    futures.append(executor.submit(checksum, path))
+                    if len(futures) >= self.workers * 2:
+                        yield futures.popleft().result()
+                while futures:
+                    yield futures.popleft().result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
     def _append_hash(self, file_path, hash_):
         self._file_hashes[Path(file_path).absolute()] = hash_
 
-    def add_files(self, file_paths):
+    def add_files(self, file_paths, expand_directories=True):
+        """
+        Add files to the checksum list (recursing into directories), hashing them concurrently.
+        :type file_paths: typing.Iterable[Path]
+        :param expand_directories: Check each path for directories. (Skip if the paths are known to be files,
+                                   to save a stat() per file)
+        :rtype: None
+        """
+        files = list(self._expand_directories(file_paths) if expand_directories else file_paths)
+        for path, hash_ in zip(files, self._checksum_all(files)):
+            self._append_hash(path, hash_)
+
+    @classmethod
+    def _expand_directories(cls, file_paths):
         for path in file_paths:
-            self.add_file(path)
+            if path.is_dir():
+                yield from cls._expand_directories(path.iterdir())
+            else:
+                yield path
 
     def write(self, output_file: typing.Union[Path, str]):
         """
@@ -166,10 +458,13 @@ class PackageChecksum(object):
         """
         Lazily yield each file and whether it matches the known checksum.
 
+        Files are always reread, rather than trusting the checksum cache.
+
         :rtype: [(Path, bool)]
         """
-        for path, hash_ in self.items():
-            calculated_hash = self._checksum(path)
+        expected = list(self.items())
+        calculated_hashes = self._checksum_all([path for path, _ in expected], use_cache=False)
+        for (path, hash_), calculated_hash in zip(expected, calculated_hashes):
             yield path, calculated_hash == hash_
 
     def __eq__(self, other):
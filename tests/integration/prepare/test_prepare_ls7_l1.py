@@ -1,8 +1,13 @@
+import io
+import tarfile
 from datetime import datetime
 from pathlib import Path
 
+import yaml
+
 from .common import run_prepare_cli, check_prepare_outputs
 from eodatasets.prepare import ls_usgs_l1_prepare
+from eodatasets.prepare.inventory import DatasetInventory
 from eodatasets.prepare.ls_usgs_l1_prepare import normalise_nci_symlinks
 
 L71GT_TARBALL_PATH: Path = Path(__file__).parent / 'data' / 'LE07_L1GT_104078_20131209_20161119_01_T2.tar.gz'
@@ -373,3 +378,85 @@ def test_skips_old_datasets(tmpdir):
         str(L71GT_TARBALL_PATH),
     )
     assert expected_metadata_path.exists(), "Dataset should have been packaged when using an ancient date cutoff"
+
+
+def test_parallel_prepare_summarises_failures(tmpdir):
+    """A failing dataset shouldn't stop the others from being prepared"""
+    output_path = Path(tmpdir) / 'output'
+    output_path.mkdir()
+    # A folder with no MTL: can't be prepared.
+    broken_dataset = Path(tmpdir) / 'broken'
+    broken_dataset.mkdir()
+    expected_metadata_path = output_path / 'LE07_L1GT_104078_20131209_20161119_01_T2.yaml'
+
+    res = run_prepare_cli(
+        ls_usgs_l1_prepare.main,
+        '--output', str(output_path),
+        '--jobs', '2',
+        str(broken_dataset),
+        str(L71GT_TARBALL_PATH),
+        expect_success=False,
+    )
+    assert res.exit_code == 1
+    assert expected_metadata_path.exists()
+
+
+def test_mtl_read_without_scanning_whole_tar(tmpdir):
+    """With the MTL first (as in our recompressed tars), nothing after it should be read"""
+    mtl_path = Path(tmpdir) / 'LE07_L1GT_104078_20131209_20161119_01_T2_MTL.txt'
+    with tarfile.open(str(L71GT_TARBALL_PATH)) as tar:
+        mtl_member = next(m for m in tar if m.name.endswith('_MTL.txt'))
+        mtl_path.write_bytes(tar.extractfile(mtl_member).read())
+
+    packed_tar = Path(tmpdir) / 'packed.tar'
+    with tarfile.open(str(packed_tar), 'w') as tar:
+        tar.add(str(mtl_path), arcname=mtl_path.name)
+        band = tarfile.TarInfo('LE07_L1GT_104078_20131209_20161119_01_T2_B1.TIF')
+        band.size = 1024 * 1024
+        tar.addfile(band, io.BytesIO(bytes(band.size)))
+
+    # Truncate the band: scanning all members would fail.
+    with packed_tar.open('r+b') as f:
+        f.truncate(packed_tar.stat().st_size // 2)
+
+    mtl_doc, filename = ls_usgs_l1_prepare.get_mtl_content(packed_tar)
+    assert filename == 'LE07_L1GT_104078_20131209_20161119_01_T2_MTL'
+    assert mtl_doc['metadata_file_info']['landsat_scene_id'] == 'LE71040782013343ASA00'
+
+
+def test_prepare_directory_and_tar_with_one_scan(tmpdir, monkeypatch):
+    """Each dataset's files are scanned once, and the inventory is shared by all steps of preparation"""
+    extracted_path = Path(tmpdir) / 'LE07_L1GT_104078_20131209_20161119_01_T2'
+    extracted_path.mkdir()
+    with tarfile.open(str(L71GT_TARBALL_PATH)) as tar:
+        tar.extractall(str(extracted_path))
+    extracted_size = sum(p.stat().st_size for p in extracted_path.rglob('*') if p.is_file())
+
+    scanned = []
+    scan = DatasetInventory.scan.__func__
+
+    def recording_scan(cls, base_path):
+        scanned.append(base_path.name)
+        return scan(cls, base_path)
+
+    monkeypatch.setattr(DatasetInventory, 'scan', classmethod(recording_scan))
+
+    docs = {}
+    for dataset_path in (L71GT_TARBALL_PATH, extracted_path):
+        output_path = Path(tmpdir) / 'output-{}'.format(len(docs))
+        output_path.mkdir()
+        assert ls_usgs_l1_prepare._prepare_path(str(dataset_path), output_path) == 'prepared'
+        [output_yaml] = output_path.glob('*.yaml')
+        docs[dataset_path] = yaml.safe_load(output_yaml.open())
+
+    assert scanned == [L71GT_TARBALL_PATH.name, extracted_path.name]
+
+    assert docs[L71GT_TARBALL_PATH]['size_bytes'] == L71GT_TARBALL_PATH.stat().st_size
+    # The directory's size includes the checksum file written into it.
+    checksum_path = extracted_path / 'package.sha1'
+    assert checksum_path.exists()
+    assert docs[extracted_path]['size_bytes'] == extracted_size + checksum_path.stat().st_size
+    assert docs[extracted_path]['image']['bands'] == {
+        name: dict(band, path=Path(band['path']).name.split('!')[-1])
+        for name, band in docs[L71GT_TARBALL_PATH]['image']['bands'].items()
+    }
@@ -1,3 +1,4 @@
+import time
 from pathlib import Path
 
 from .common import check_prepare_outputs
@@ -342,3 +343,16 @@ def test_prepare_s2a_l1c_safe(tmpdir):
         expected_doc=expected_doc,
         expected_metadata_path=expected_metadata_path
     )
+
+
+def test_granule_documents_keep_their_order():
+    granules = [('granule{}'.format(i), []) for i in range(6)]
+
+    def prepare_granule(granule_id, images):
+        # Later granules finish first.
+        time.sleep(0.01 * (6 - int(granule_id[-1])))
+        return {'tile_id': granule_id}
+
+    for workers in (1, 4):
+        documents = s2_prepare_cophub_zip._map_granules(prepare_granule, granules, workers=workers)
+        assert [d['tile_id'] for d in documents] == [granule_id for granule_id, _ in granules]
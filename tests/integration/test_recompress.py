@@ -1,11 +1,13 @@
+import json
 import tarfile
 from pathlib import Path
 from typing import List, Dict, Tuple
 
 import pytest
+import rasterio
 from click.testing import CliRunner, Result
 
-from eodatasets import verify
+from eodatasets import tarindex, verify
 from eodatasets.scripts import recompress
 
 this_folder = Path(__file__).parent
@@ -37,11 +39,11 @@ def test_recompress_dataset(input_path: Path, tmp_path: Path):
     )
 
     # Pytest has better error messages for strings than Paths.
-    all_output_files = [str(p) for p in output_base.rglob('*') if p.is_file()]
+    all_output_files = sorted(str(p) for p in output_base.rglob('*') if p.is_file())
 
-    assert len(all_output_files) == 1, \
-        f"Expected one output tar file. Got: \n\t" + '\n\t'.join(all_output_files)
-    assert all_output_files == [str(expected_output)]
+    assert len(all_output_files) == 2, \
+        f"Expected one output tar file and its index. Got: \n\t" + '\n\t'.join(all_output_files)
+    assert all_output_files == [str(expected_output), str(expected_output) + '.index']
 
     assert expected_output.exists(), \
         f"No output produced in expected location {expected_output}."
@@ -69,6 +71,7 @@ def test_recompress_dataset(input_path: Path, tmp_path: Path):
         'extras',
         'extras/example-file.txt',
         'package.sha1',
+        'package.index',
     ]
 
     member_sizes = {m.name: m.size for m in members}
@@ -105,11 +108,11 @@ def test_recompress_gap_mask_dataset(tmp_path: Path):
     )
 
     # Pytest has better error messages for strings than Paths.
-    all_output_files = [str(p) for p in output_base.rglob('*') if p.is_file()]
+    all_output_files = sorted(str(p) for p in output_base.rglob('*') if p.is_file())
 
-    assert len(all_output_files) == 1, \
-        f"Expected one output tar file. Got: \n\t" + '\n\t'.join(all_output_files)
-    assert all_output_files == [str(expected_output)]
+    assert len(all_output_files) == 2, \
+        f"Expected one output tar file and its index. Got: \n\t" + '\n\t'.join(all_output_files)
+    assert all_output_files == [str(expected_output), str(expected_output) + '.index']
 
     assert expected_output.exists(), \
         f"No output produced in expected location {expected_output}."
@@ -147,17 +150,18 @@ def test_recompress_gap_mask_dataset(tmp_path: Path):
         ('gap_mask/LE07_L1GT_091080_20080114_20161231_01_T2_GM_B7.TIF', '664'),
         ('gap_mask/LE07_L1GT_091080_20080114_20161231_01_T2_GM_B8.TIF', '664'),
         ('package.sha1', '664'),
+        ('package.index', '664'),
     ]
 
     ####
     # If packaging is rerun, the output should not be touched!
     # ie. skip if output exists.
-    original_crc32 = verify.calculate_file_crc32(expected_output)
+    original_crc32 = verify.calculate_file_crc32(expected_output, use_cache=False)
     original_inode = expected_output.stat().st_ino
 
     _run_recompress(input_path, output_base)
 
-    new_crc32 = verify.calculate_file_crc32(expected_output)
+    new_crc32 = verify.calculate_file_crc32(expected_output, use_cache=False)
     new_inode = expected_output.stat().st_ino
     assert original_crc32 == new_crc32, "Output file was modified on rerun of compress"
     assert original_inode == new_inode, "Output file was replaced on rerun of compress"
@@ -186,11 +190,11 @@ def test_recompress_dirty_dataset(tmp_path: Path):
     )
 
     # Pytest has better error messages for strings than Paths.
-    all_output_files = [str(p) for p in output_base.rglob('*') if p.is_file()]
+    all_output_files = sorted(str(p) for p in output_base.rglob('*') if p.is_file())
 
-    assert len(all_output_files) == 1, \
-        f"Expected one output tar file. Got: \n\t" + '\n\t'.join(all_output_files)
-    assert all_output_files == [str(expected_output)]
+    assert len(all_output_files) == 2, \
+        f"Expected one output tar file and its index. Got: \n\t" + '\n\t'.join(all_output_files)
+    assert all_output_files == [str(expected_output), str(expected_output) + '.index']
 
     assert expected_output.exists(), \
         f"No output produced in expected location {expected_output}."
@@ -231,6 +235,7 @@ def test_recompress_dirty_dataset(tmp_path: Path):
         'LC08_L1TP_091075_20161213_20170316_01_T2_TIR.jpeg',
         'LC08_L1TP_091075_20161213_20170316_01_T2_TIR.tif',
         'package.sha1',
+        'package.index',
     ]
 
 
@@ -244,14 +249,52 @@ def test_run_with_corrupt_data(tmp_path: Path):
     non_usgs_path = tmp_path / packaged_path.name
     non_usgs_path.symlink_to(packaged_path)
 
-    with pytest.raises(ValueError, match="Expected AODH input path structure"):
-        _run_recompress(
-            non_usgs_path,
-            output_path,
-        )
+    # The failure is reported, as with multiple jobs.
+    res = _run_recompress(non_usgs_path, output_path, 1)
+    assert 'Expected AODH input path structure' in res.output
+    assert list(output_path.iterdir()) == []
 
 
-def _run_recompress(input_path, output_base, expected_return=0):
+def test_recompress_auto_tuned(tmp_path: Path):
+    tuning_cache = tmp_path / 'tuning.json'
+    _run_recompress(packaged_path, tmp_path / 'out', 0, '--auto-tune', 'size', '--tuning-cache', str(tuning_cache))
+
+    # Settings are cached per product and kind of band.
+    tuned = json.loads(tuning_cache.read_text())
+    assert 'size:LT05_L1GS/B1.TIF:uint8' in tuned
+    assert tuned['size:LT05_L1GS/B1.TIF:uint8']['compress'] in ('deflate', 'lzw', 'zstd', 'lerc')
+
+    # Tuned compression is lossless.
+    [output_tar] = (tmp_path / 'out').rglob('*.tar')
+    band_name = 'LT05_L1GS_092091_19910506_20170126_01_T2_B1.TIF'
+    with tarfile.open(packaged_path, 'r') as in_tar:
+        with rasterio.MemoryFile(in_tar.extractfile(band_name).read()) as f, f.open() as original:
+            expected = original.read(1)
+    with rasterio.open(tarindex.vsi_path(output_tar, band_name)) as ds:
+        assert ds.profile['compress'] == tuned['size:LT05_L1GS/B1.TIF:uint8']['compress']
+        assert (ds.read(1) == expected).all()
+
+
+def test_recompress_tar_without_mtl(tmp_path: Path):
+    input_path = tmp_path.joinpath(
+        'USGS/L1/Landsat/C1/092_091/LT50920911991126',
+        'LT05_L1GS_092091_19910506_20170126_01_T2.tar.gz'
+    )
+    input_path.parent.mkdir(parents=True)
+    with tarfile.open(packaged_path, 'r') as in_tar, tarfile.open(input_path, 'w:gz') as out_tar:
+        for member in in_tar:
+            if '_MTL' not in member.name:
+                out_tar.addfile(member, in_tar.extractfile(member))
+
+    output_base = tmp_path / 'out'
+    res = _run_recompress(input_path, output_base, 1)
+
+    assert 'No MTL file found in package' in res.output
+    assert not [p for p in output_base.rglob('*') if p.is_file()]
+
+
+def _run_recompress(input_path, output_base, expected_return=0, *extra_args):
+    input_paths = input_path if isinstance(input_path, (list, tuple)) else [input_path]
     res: Result = CliRunner().invoke(
         recompress.main,
         (
@@ -259,7 +302,8 @@ def _run_recompress(input_path, output_base, expected_return=0):
             str(output_base),
             # Out test data is smaller than the default block size.
             '--block-size', '32',
-            str(input_path),
+            *extra_args,
+            *(str(p) for p in input_paths),
         ),
         catch_exceptions=False,
     )
@@ -268,12 +312,165 @@ def _run_recompress(input_path, output_base, expected_return=0):
     return res
 
 
+def test_recompress_jobs_with_manifest(tmp_path: Path):
+    output_base = tmp_path / 'out'
+    manifest_path = tmp_path / 'manifest.jsonl'
+    input_paths = [
+        packaged_path,
+        this_folder.joinpath(
+            'recompress_packed/USGS/L1/Landsat/C1/091_080/LE70910802008014',
+            'LE07_L1GT_091080_20080114_20161231_01_T2.tar.gz'
+        ),
+    ]
+
+    _run_recompress(input_paths, output_base, 0, '--jobs', '2', '--manifest', str(manifest_path))
+
+    output_tars = sorted(output_base.rglob('*.tar'))
+    assert [p.name for p in output_tars] == [
+        'LE07_L1GT_091080_20080114_20161231_01_T2.tar',
+        'LT05_L1GS_092091_19910506_20170126_01_T2.tar',
+    ]
+    entries = [json.loads(line) for line in manifest_path.read_text().splitlines()]
+    assert sorted((e['in_path'], e['status']) for e in entries) == sorted(
+        (str(p.absolute()), 'complete') for p in input_paths
+    )
+
+    # Completed inputs are skipped on rerun, without looking at their outputs.
+    for output_tar in output_tars:
+        output_tar.unlink()
+    res = _run_recompress(input_paths, output_base, 0, '--jobs', '2', '--manifest', str(manifest_path))
+    assert 'skip.manifest' in res.output
+    assert not list(output_base.rglob('*.tar'))
+    assert len(manifest_path.read_text().splitlines()) == 2
+
+
+def test_recompress_jobs_continue_after_error(tmp_path: Path):
+    output_base = tmp_path / 'out'
+    manifest_path = tmp_path / 'manifest.jsonl'
+    # Not in a "USGS" folder structure, so its output path can't be calculated.
+    non_usgs_path = tmp_path / packaged_path.name
+    non_usgs_path.symlink_to(packaged_path)
+    input_paths = [non_usgs_path, packaged_path]
+
+    res = _run_recompress(input_paths, output_base, 1, '--jobs', '2', '--manifest', str(manifest_path))
+
+    assert 'Expected AODH input path structure' in res.output
+    assert [p.name for p in output_base.rglob('*.tar')] == ['LT05_L1GS_092091_19910506_20170126_01_T2.tar']
+    entries = [json.loads(line) for line in manifest_path.read_text().splitlines()]
+    assert sorted((e['in_path'], e['status']) for e in entries) == sorted([
+        (str(non_usgs_path.absolute()), 'failed'),
+        (str(packaged_path.absolute()), 'complete'),
+    ])
+
+
+def test_tifs_waiting_for_mtl_are_spooled_to_disk(tmp_path: Path, monkeypatch):
+    outputs = {}
+    recompress_tif = recompress._recompress_tif
+
+    def recording_recompress_tif(name, *args):
+        contents, hash_ = recompress_tif(name, *args)
+        outputs[name] = contents
+        return contents, hash_
+
+    monkeypatch.setattr(recompress, '_recompress_tif', recording_recompress_tif)
+    _run_recompress(packaged_path, tmp_path / 'out')
+
+    with tarfile.open(packaged_path, 'r') as in_tar:
+        names = [m.name for m in in_tar if m.name.lower().endswith('.tif') or '_MTL' in m.name]
+    mtl_position = next(i for i, name in enumerate(names) if '_MTL' in name)
+    # USGS tars list the MTL after the bands. They can't be written until it's found, so they're not held in memory.
+    assert mtl_position > 0
+    assert all(isinstance(outputs[name], Path) for name in names[:mtl_position])
+    assert all(isinstance(outputs[name], bytes) for name in names[mtl_position + 1:])
+
+
+def test_streamed_tifs_are_read_once_into_memory(tmp_path: Path):
+    members = dict(recompress._stream_tar_members(packaged_path, tmp_path))
+    with tarfile.open(packaged_path, 'r') as in_tar:
+        for member in in_tar:
+            if member.name.lower().endswith('.tif'):
+                [streamed] = [v for m, v in members.items() if m.name == member.name]
+                assert isinstance(streamed, recompress._InMemoryMember)
+                assert streamed.data == in_tar.extractfile(member).read()
+
+
+def test_large_streamed_tifs_are_spooled_once(tmp_path: Path, monkeypatch):
+    spool_dirs = []
+    spool_count = 0
+    spool_to_file = recompress._spool_to_file
+    spool = recompress._spool
+
+    def recording_spool_to_file(input_fp, tmpdir):
+        spool_dirs.append(tmpdir)
+        return spool_to_file(input_fp, tmpdir)
+
+    def counting_spool(input_fp, max_memory):
+        nonlocal spool_count
+        spool_count += 1
+        return spool(input_fp, max_memory)
+
+    monkeypatch.setattr(recompress, '_spool_to_file', recording_spool_to_file)
+    monkeypatch.setattr(recompress, '_spool', counting_spool)
+    _run_recompress(packaged_path, tmp_path / 'out', 0, '--memory-budget', '0')
+
+    with tarfile.open(packaged_path, 'r') as in_tar:
+        files = [m.name for m in in_tar if m.isfile()]
+    tif_count = sum(1 for name in files if name.lower().endswith('.tif'))
+    # Each tif is copied to disk once, by the reader, and its spool directory is removed afterwards.
+    assert len(spool_dirs) == tif_count
+    assert spool_count == len(files) - tif_count
+    assert not any(d.exists() for d in spool_dirs)
+
+
+def test_recompress_spooled_to_disk(tmp_path: Path):
+    # A zero memory budget spools every image through temporary files. The output should be identical.
+    _run_recompress(packaged_path, tmp_path / 'memory')
+    _run_recompress(packaged_path, tmp_path / 'spooled', 0, '--memory-budget', '0', '--workers', '2')
+
+    [memory_tar] = (tmp_path / 'memory').rglob('*.tar')
+    [spooled_tar] = (tmp_path / 'spooled').rglob('*.tar')
+    assert _get_checksums_members(memory_tar)[0] == _get_checksums_members(spooled_tar)[0]
+
+    # No temporary files are left behind.
+    assert sorted(p.name for p in (tmp_path / 'spooled').rglob('*') if p.is_file()) == [
+        spooled_tar.name,
+        spooled_tar.name + '.index',
+    ]
+
+
+def test_recompressed_member_index(tmp_path: Path):
+    _run_recompress(packaged_path, tmp_path)
+    [output_tar] = tmp_path.rglob('*.tar')
+
+    sidecar_index = tarindex.read_index(output_tar)
+    # Without the sidecar, the index is found at the end of the tar.
+    tarindex.sidecar_path(output_tar).unlink()
+    index = tarindex.read_index(output_tar)
+    assert index == sidecar_index
+
+    checksums, members = _get_checksums_members(output_tar)
+    with tarfile.open(output_tar, 'r') as tar:
+        files = [m for m in members if m.isfile() and m.name != tarindex.INDEX_MEMBER_NAME]
+        assert sorted(index) == sorted(m.name for m in files)
+        for member in files:
+            entry = index[member.name]
+            assert (entry.offset, entry.size) == (member.offset_data, member.size)
+            if member.name in checksums:
+                assert entry.sha1 == checksums[member.name]
+            assert tarindex.read_member(output_tar, member.name, index) == tar.extractfile(member).read()
+
+    band_name = 'LT05_L1GS_092091_19910506_20170126_01_T2_B1.TIF'
+    with rasterio.open(tarindex.vsi_path(output_tar, band_name, index)) as ds:
+        assert ds.profile['compress'] == 'deflate'
+        assert ds.read(1).any()
+
+
 def _get_checksums_members(out_tar: Path) -> Tuple[Dict, List[tarfile.TarInfo]]:
     with tarfile.open(out_tar, 'r') as tar:
         members: List[tarfile.TarInfo] = tar.getmembers()
 
-        # Checksum is last (can be calculated while streaming)
-        checksum_member = members[-1]
+        # Checksum is last before the index (can be calculated while streaming)
+        checksum_member = members[-2]
         assert checksum_member.name == 'package.sha1'
         checksums = {}
         for line in tar.extractfile(checksum_member).readlines():
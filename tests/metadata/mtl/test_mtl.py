@@ -0,0 +1,62 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import time
+
+from pathlib import Path
+
+from eodatasets.metadata import mtl
+from eodatasets.metadata.util import parse_type
+from tests import slow
+
+MTL_FILES = sorted(Path(__file__).parent.glob('*_mtl.txt'))
+
+
+def test_parse_text_and_bytes_equally():
+    for mtl_file in MTL_FILES:
+        with mtl_file.open('r') as f:
+            from_text = mtl.parse(f)
+        with mtl_file.open('rb') as f:
+            from_bytes = mtl.parse(f)
+
+        assert from_text == from_bytes
+        assert list(from_text.keys()) == ['l1_metadata_file']
+
+
+def test_parse_ls8_mtl():
+    doc = mtl.load(Path(__file__).parent / 'ls8_mtl.txt')['l1_metadata_file']
+
+    assert doc['metadata_file_info']['landsat_scene_id'] == 'LC81010782014285LGN00'
+    assert doc['product_metadata']['wrs_path'] == 101
+    assert doc['image_attributes']['cloud_cover'] == 0.01
+    # Values that aren't numbers are left as strings (without quotes)
+    assert doc['product_metadata']['date_acquired'] == '2014-10-12'
+
+
+def test_parse_typed_groups():
+    # The shape used by the ortho packager
+    doc = mtl.load(
+        Path(__file__).parent / 'ls8_mtl.txt',
+        value_parser=parse_type,
+        lowercase_groups=False,
+    )['L1_METADATA_FILE']
+
+    assert doc['PRODUCT_METADATA']['date_acquired'] == datetime.date(2014, 10, 12)
+    assert doc['PRODUCT_METADATA']['spacecraft_id'] == 'LANDSAT_8'
+
+
+@slow
+def test_parse_benchmark():
+    """
+    Time parsing of each of our MTL files. (Run with -s to see the timings.)
+    """
+    repeats = 200
+    for mtl_file in MTL_FILES:
+        lines = mtl_file.read_text().splitlines()
+        for name, kwargs in (('plain', {}), ('typed', dict(value_parser=parse_type, lowercase_groups=False))):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                mtl.parse(lines, **kwargs)
+            elapsed = (time.perf_counter() - start) / repeats
+            print('{}\t{}\t{:.3f}ms'.format(mtl_file.name, name, elapsed * 1000))
@@ -0,0 +1,112 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import numpy
+import pytest
+import rasterio
+import rasterio.transform
+import shapely.geometry
+from rasterio.errors import RasterioIOError
+
+from eodatasets.metadata import valid_region
+from tests import write_files
+
+
+def _write_band(path, array, nodata=0):
+    with rasterio.open(
+        str(path), 'w',
+        driver='GTiff',
+        width=array.shape[1],
+        height=array.shape[0],
+        count=1,
+        dtype=array.dtype,
+        nodata=nodata,
+        crs='EPSG:32755',
+        transform=rasterio.transform.from_origin(1000, 2000, 25, 25),
+    ) as ds:
+        ds.write(array, 1)
+    return path
+
+
+def _test_images():
+    d = write_files({})
+    images = []
+    for i in range(2):
+        array = numpy.zeros((203, 157), dtype='uint16')
+        array[10 + i * 4:190, 20:140 - i * 10] = 7
+        images.append(_write_band(d.joinpath('band{}.tif'.format(i)), array))
+    return images
+
+
+def test_valid_region_is_independent_of_block_size():
+    images = _test_images()
+
+    whole = valid_region.valid_region_geometry(images)
+    strips = valid_region.valid_region_geometry(images, max_block_bytes=1000)
+
+    assert whole.equals(strips)
+    # Union of both bands' data, buffered by a pixel and clipped to the image bounds.
+    assert whole.bounds == (1000 + 19 * 25, 2000 - 191 * 25, 1000 + 141 * 25, 2000 - 9 * 25)
+
+
+def test_decimated_valid_region_is_close():
+    images = _test_images()
+
+    full = valid_region.valid_region_geometry(images)
+    decimated = valid_region.valid_region_geometry(images, decimation=4)
+
+    assert full.symmetric_difference(decimated).area < full.area * 0.05
+
+
+def test_valid_region_mapping():
+    images = _test_images()
+    region = valid_region.valid_region(images)
+
+    assert region['type'] == 'Polygon'
+    assert isinstance(region['coordinates'], list)
+    assert shapely.geometry.shape(region).equals(valid_region.valid_region_geometry(images))
+
+    assert valid_region.valid_region([]) is None
+
+
+def test_extents_method_matches_shapes():
+    images = _test_images()
+
+    shapes = valid_region.valid_region_geometry(images, method='shapes')
+    extents = valid_region.valid_region_geometry(images, method='extents')
+    assert shapes.equals(extents)
+
+    decimated_shapes = valid_region.valid_region_geometry(images, decimation=3, method='shapes')
+    decimated_extents = valid_region.valid_region_geometry(images, decimation=3, method='extents')
+    assert decimated_shapes.equals(decimated_extents)
+
+
+def test_decimated_valid_region_is_within_error_bound():
+    images = _test_images()
+    full = valid_region.valid_region_geometry(images)
+
+    for decimation in (2, 4, 8):
+        decimated = valid_region.valid_region_geometry(images, decimation=decimation)
+        # Off by at most the decimation (plus the simplification tolerance), in 25m pixels.
+        assert full.hausdorff_distance(decimated) <= (decimation + 1) * 25
+
+
+def test_concurrent_valid_region_matches_serial():
+    images = _test_images() + _test_images()
+
+    serial = valid_region.valid_region_geometry(images, workers=1)
+    concurrent = valid_region.valid_region_geometry(images, workers=3, num_threads=2)
+    assert serial.equals(concurrent)
+
+
+def test_valid_region_fails_on_any_band():
+    images = _test_images()
+    images.insert(1, images[0].with_name('missing.tif'))
+
+    with pytest.raises(RasterioIOError):
+        valid_region.valid_region_geometry(images, workers=2)
+    assert valid_region.safe_valid_region(images, workers=2) is None
+
+    images[1] = _write_band(images[0].with_name('small.tif'), numpy.ones((5, 5), dtype='uint16'))
+    with pytest.raises(ValueError, match='differing shapes'):
+        valid_region.valid_region_geometry(images, workers=2)
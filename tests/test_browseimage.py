@@ -2,6 +2,10 @@
 
 from __future__ import absolute_import
 
+import numpy
+import rasterio
+import rasterio.transform
+
 from eodatasets import browseimage, drivers, type as ptype
 from tests import write_files, assert_same
 
@@ -76,3 +80,39 @@ def test_create_mono_browse_metadata():
 
     expected.id_, dataset.id_ = None, None
     assert_same(expected, dataset)
+
+
+def test_create_browse_images_from_single_read():
+    d = write_files({})
+
+    data = (numpy.arange(600 * 400).reshape(600, 400) % 3000).astype('int16')
+    data[:50] = -999
+    band_paths = {}
+    for band_number in ('1', '2', '3'):
+        band_paths[band_number] = d.joinpath('band{}.tif'.format(band_number))
+        with rasterio.open(str(band_paths[band_number]), 'w', driver='GTiff', width=400, height=600, count=1,
+                           dtype='int16', crs='EPSG:32755',
+                           transform=rasterio.transform.from_origin(0, 0, 30, 30)) as ds:
+            ds.write(data, 1)
+
+    class TestDriver(drivers.DatasetDriver):
+        def browse_image_bands(self, d):
+            return '3', '2', '1'
+
+    dataset = ptype.DatasetMetadata(
+        image=ptype.ImageMetadata(bands={
+            number: ptype.BandMetadata(path=path, number=number) for number, path in band_paths.items()
+        })
+    )
+    created_files = []
+    browseimage.create_dataset_browse_images(TestDriver(), dataset, d, after_file_creation=created_files.append)
+
+    assert sorted(created_files) == [d.joinpath('browse.fr.jpg'), d.joinpath('browse.jpg')]
+
+    assert dataset.browse['medium'].shape == ptype.Point(1024, 1536)
+    assert dataset.browse['full'].shape == ptype.Point(400, 600)
+    assert dataset.browse['full'].cell_size == 30.0
+
+    with rasterio.open(str(d.joinpath('browse.fr.jpg'))) as ds:
+        assert ds.driver == 'JPEG'
+        assert (ds.count, ds.height, ds.width) == (3, 600, 400)
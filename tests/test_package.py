@@ -1,7 +1,11 @@
 # coding=utf-8
 from __future__ import absolute_import
 
-from eodatasets import package, drivers, type as ptype
+import numpy
+import rasterio
+import rasterio.transform
+
+from eodatasets import compression, package, drivers, verify, type as ptype
 from tests import write_files, TestCase, assert_file_structure
 
 
@@ -107,6 +111,74 @@ class TestPackage(TestCase):
         source_file = source_path.joinpath('LC81010782014285LGN00_B6.img')
         self.assertTrue(source_file.stat().st_size, 4)
 
+    def test_copy_records_checksums(self):
+        test_path = write_files({'source_dir': {
+            'LC81010782014285LGN00_B6.img': 'test',
+            'LC81010782014285LGN00_B4.tif': 'best'
+        }})
+        source_path = test_path.joinpath('source_dir')
+        dest_path = test_path.joinpath('dest_dir')
+
+        checksums = verify.PackageChecksum()
+        package.prepare_target_imagery(
+            source_path,
+            dest_path,
+            compress_imagery=False,
+            checksums=checksums
+        )
+
+        # Copied files are checksummed while being written, without a separate pass.
+        self.assertEqual(2, len(checksums))
+        self.assertEqual(
+            'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3',
+            checksums.get_hash(dest_path.joinpath('LC81010782014285LGN00_B6.img'))
+        )
+        self.assertEqual(
+            verify.calculate_file_sha1(dest_path.joinpath('LC81010782014285LGN00_B4.tif')),
+            checksums.get_hash(dest_path.joinpath('LC81010782014285LGN00_B4.tif'))
+        )
+
+    def test_compress_image(self):
+        test_path = write_files({})
+        source_file = test_path.joinpath('LC81010782014285LGN00_B4.tif')
+        data = (numpy.arange(300 * 200).reshape(300, 200) % 1000).astype('uint16')
+        with rasterio.open(str(source_file), 'w', driver='GTiff', width=200, height=300, count=1,
+                           dtype='uint16', crs='EPSG:32755',
+                           transform=rasterio.transform.from_origin(0, 0, 30, 30)) as ds:
+            ds.write(data, 1)
+
+        dest_file = test_path.joinpath('compressed.tif')
+        package.compress_image(source_file, dest_file, compress='deflate', zlevel=6, tiled=True, block_size=128)
+
+        with rasterio.open(str(dest_file)) as ds:
+            self.assertEqual('deflate', ds.profile['compress'])
+            self.assertEqual((128, 128), (ds.profile['blockysize'], ds.profile['blockxsize']))
+            # Lossless
+            self.assertTrue((ds.read(1) == data).all())
+
+    def test_compress_image_auto_tuned(self):
+        test_path = write_files({})
+        source_file = test_path.joinpath('LC81010782014285LGN00_B4.tif')
+        data = (numpy.arange(300 * 200).reshape(300, 200) % 1000).astype('uint16')
+        with rasterio.open(str(source_file), 'w', driver='GTiff', width=200, height=300, count=1,
+                           dtype='uint16', crs='EPSG:32755',
+                           transform=rasterio.transform.from_origin(0, 0, 30, 30)) as ds:
+            ds.write(data, 1)
+
+        tuning_cache = test_path.joinpath('tuning.json')
+        tuner = compression.Tuner(goal='size', cache_path=tuning_cache)
+        dest_file = test_path.joinpath('compressed.tif')
+        package.compress_image(source_file, dest_file, tuner=tuner, tuning_key=lambda path: 'test/B4')
+
+        # Tuned once, and cached for later runs.
+        tuned = compression.TuningCache(tuning_cache).get('size:test/B4:uint16')
+        self.assertIsNotNone(tuned)
+
+        with rasterio.open(str(dest_file)) as ds:
+            self.assertEqual(tuned['compress'], ds.profile['compress'])
+            # Lossless
+            self.assertTrue((ds.read(1) == data).all())
+
     def test_total_file_size(self):
         # noinspection PyProtectedMember
         f = write_files({
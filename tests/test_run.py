@@ -0,0 +1,65 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pytest
+
+from eodatasets import package, run
+from tests import write_files
+
+
+def _init_dataset(dataset_folder, source_datasets):
+    # Our fake "dataset" is just its id, read from the folder.
+    return dataset_folder.joinpath('id.txt').read_text()
+
+
+def _fake_package_dataset(dataset_driver, dataset, image_path, target_path, **kwargs):
+    target_path.joinpath('ga-metadata.yaml').write_text('id: {}\n'.format(dataset))
+    return dataset
+
+
+def _package(monkeypatch, folders, destination):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('Requires forked worker processes')
+    monkeypatch.setattr(package, 'package_dataset', _fake_package_dataset)
+    # Force forked workers, so they see the patched function too. (Spawned workers re-import the
+    # real one, and it's the default start method on some platforms)
+    monkeypatch.setattr(run, 'ProcessPoolExecutor',
+                        partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('fork')))
+    return run._package_folder(None, folders, destination, {}, _init_dataset, workers=2)
+
+
+def test_package_folders_concurrently(monkeypatch):
+    d = write_files({
+        'input1': {'id.txt': 'LS8_DATASET_1'},
+        'input2': {'id.txt': 'LS8_DATASET_2'},
+        'input3': {'id.txt': 'LS8_DATASET_3'},
+        'output': {},
+    })
+    output = d.joinpath('output')
+
+    created, existing = _package(monkeypatch, [d.joinpath('input{}'.format(i)) for i in (1, 2, 3)], output)
+
+    # In input order, as with a single worker.
+    assert created == [output.joinpath('LS8_DATASET_{}'.format(i)) for i in (1, 2, 3)]
+    assert existing == []
+    assert sorted(p.name for p in output.iterdir()) == ['LS8_DATASET_1', 'LS8_DATASET_2', 'LS8_DATASET_3']
+
+
+def test_concurrent_duplicate_datasets_are_packaged_once(monkeypatch):
+    d = write_files({
+        'input1': {'id.txt': 'LS8_DATASET'},
+        'input2': {'id.txt': 'LS8_DATASET'},
+        'output': {},
+    })
+    output = d.joinpath('output')
+
+    created, existing = _package(monkeypatch, [d.joinpath('input1'), d.joinpath('input2')], output)
+
+    assert len(created) == 1
+    assert existing == created
+    # No leftover temporary folders.
+    assert [p.name for p in output.iterdir()] == ['LS8_DATASET']
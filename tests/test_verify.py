@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 
 import hashlib
+import os
 import unittest
 
 from eodatasets import verify
@@ -84,3 +85,83 @@ a94a8fe5ccb19ba61c4c0873d391e987982fbbd3\ttest1.txt
         }
         verification_results = set(c2.iteratively_verify())
         assert expected_verification == verification_results
+
+    def test_concurrent_package_checksum(self):
+        d = write_files({
+            'package': {
+                'test{}.txt'.format(i): 'test content {}'.format(i) * (i + 1)
+                for i in range(20)
+            }
+        })
+
+        # Hashing with many threads and a tiny block size should match a plain sequential hash.
+        concurrent = verify.PackageChecksum(workers=4, block_size=7)
+        concurrent.add_file(d.joinpath('package'))
+
+        sequential = verify.PackageChecksum(workers=1)
+        for path in sorted(d.joinpath('package').iterdir()):
+            sequential.add_file(path)
+
+        assert len(concurrent) == 20
+        assert concurrent == sequential
+
+        for path, hash_ in concurrent.items():
+            assert hash_ == hashlib.sha1(path.read_bytes()).hexdigest()
+
+        assert all(matches for _, matches in concurrent.iteratively_verify())
+
+    def test_verify_reads_ahead_lazily(self):
+        d = write_files({
+            'test{}.txt'.format(i): 'test content {}'.format(i)
+            for i in range(20)
+        })
+
+        read_paths = []
+
+        class CountingChecksum(verify.PackageChecksum):
+            def _checksum(self, file_path, **kwargs):
+                read_paths.append(file_path)
+                return super(CountingChecksum, self)._checksum(file_path, **kwargs)
+
+        c = CountingChecksum(workers=2)
+        c.add_file(d)
+        del read_paths[:]
+
+        path, matches = next(c.iteratively_verify())
+        assert matches
+        # Only a bounded number of files are read ahead of the one we asked for.
+        assert len(read_paths) <= 2 * 2 + 1
+
+    def test_checksum_cache(self):
+        d = write_files({
+            'test1.txt': 'test'
+        })
+        test_file = d.joinpath('test1.txt')
+        # Recently-modified files aren't cached.
+        os.utime(str(test_file), ns=(0, 10 ** 18))
+
+        verify.use_checksum_cache(d.joinpath('checksums.db'))
+        try:
+            self.assertEqual(verify.calculate_file_sha1(test_file), 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3')
+            self.assertEqual(verify.calculate_file_crc32(test_file), 'd87f7e0c')
+            cache = verify.get_checksum_cache()
+            self.assertEqual(cache.get(test_file, 'sha1'), 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3')
+            self.assertIsNone(cache.get(test_file, 'md5'))
+
+            # Unchanged identity: the file isn't reread. (So we don't notice this sneaky same-size change.)
+            test_file.write_text('best')
+            os.utime(str(test_file), ns=(0, 10 ** 18))
+            c = verify.PackageChecksum()
+            c.add_file(test_file)
+            self.assertEqual(c.get_hash(test_file), 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3')
+            # ... but verification always rereads the file, so it does.
+            self.assertEqual(list(c.iteratively_verify()), [(test_file.absolute(), False)])
+            self.assertEqual(verify.calculate_file_sha1(test_file, use_cache=False), hashlib.sha1(b'best').hexdigest())
+
+            # A new modification time invalidates the entry.
+            os.utime(str(test_file), ns=(0, 10 ** 18 + 1))
+            self.assertEqual(verify.calculate_file_sha1(test_file), hashlib.sha1(b'best').hexdigest())
+        finally:
+            verify.use_checksum_cache(None)
+
+        self.assertIsNone(verify.get_checksum_cache())